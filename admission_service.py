@@ -0,0 +1,147 @@
+"""Admission control for blind-box commands: blacklist and token-bucket rate limits."""
+
+import time
+from typing import Dict, FrozenSet, Iterable, Optional, Tuple
+
+
+ADMIT = "ok"
+REJECT_BLACKLIST = "blacklisted"
+REJECT_USER_RATE = "user_limited"
+REJECT_GROUP_RATE = "group_limited"
+
+
+class TokenBucket:
+    """Refills ``rate`` tokens per second up to ``capacity``; one command costs one token."""
+
+    __slots__ = ("tokens", "updated", "notified")
+
+    def __init__(self, capacity: float, now: float):
+        self.tokens = capacity
+        self.updated = now
+        self.notified = False
+
+    def refill(self, rate: float, capacity: float, now: float) -> float:
+        if now > self.updated:
+            self.tokens = min(capacity, self.tokens + (now - self.updated) * rate)
+            self.updated = now
+        return self.tokens
+
+
+class AdmissionController:
+    """Decides whether a command may run before any config, disk or database work happens.
+
+    Stages run in order: blacklist lookup against a precompiled frozenset, then the
+    per-user and per-group token buckets. Tokens are only taken when both buckets
+    have one, so a request rejected by the group limit does not drain the user bucket.
+    """
+
+    BURST_SECONDS = 10
+    # A normal session (选择, a few 开, 库存) sends several commands back to back; never throttle that.
+    MIN_BURST = 10.0
+    PRUNE_THRESHOLD = 4096
+
+    def __init__(self):
+        self.blacklist: FrozenSet[str] = frozenset()
+        self.exempt: FrozenSet[str] = frozenset()
+        self._rules_key: Tuple = ()
+        self.user_rate = 0.0
+        self.group_rate = 0.0
+        self.user_capacity = 0.0
+        self.group_capacity = 0.0
+        self._user_buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self._group_buckets: Dict[str, TokenBucket] = {}
+        self.counters: Dict[str, int] = {ADMIT: 0, REJECT_BLACKLIST: 0, REJECT_USER_RATE: 0, REJECT_GROUP_RATE: 0}
+
+    def configure(
+        self,
+        blacklist: Iterable[str],
+        exempt: Iterable[str],
+        user_per_minute: int,
+        group_per_minute: int,
+    ):
+        """Recompiles the rules; cheap to call repeatedly because unchanged inputs are skipped."""
+        blacklist = frozenset(str(v) for v in blacklist)
+        exempt = frozenset(str(v) for v in exempt)
+        user_per_minute = max(0, int(user_per_minute))
+        group_per_minute = max(0, int(group_per_minute))
+        rules_key = (blacklist, exempt, user_per_minute, group_per_minute)
+        if rules_key == self._rules_key:
+            return
+        self._rules_key = rules_key
+        self.blacklist = blacklist
+        self.exempt = exempt
+        self.user_rate, self.user_capacity = self._bucket_shape(user_per_minute)
+        self.group_rate, self.group_capacity = self._bucket_shape(group_per_minute)
+        self._user_buckets.clear()
+        self._group_buckets.clear()
+
+    def _bucket_shape(self, per_minute: int) -> Tuple[float, float]:
+        if per_minute <= 0:
+            return 0.0, 0.0
+        rate = per_minute / 60.0
+        return rate, max(self.MIN_BURST, rate * self.BURST_SECONDS)
+
+    def admit(self, group_id: str, user_id: str, now: Optional[float] = None) -> str:
+        if user_id in self.blacklist:
+            self.counters[REJECT_BLACKLIST] += 1
+            return REJECT_BLACKLIST
+        if user_id in self.exempt or (not self.user_rate and not self.group_rate):
+            self.counters[ADMIT] += 1
+            return ADMIT
+
+        now = time.monotonic() if now is None else now
+        if len(self._user_buckets) + len(self._group_buckets) > self.PRUNE_THRESHOLD:
+            self._prune(now)
+        user_bucket = self._bucket(self._user_buckets, (group_id, user_id), self.user_rate, self.user_capacity, now)
+        group_bucket = self._bucket(self._group_buckets, group_id, self.group_rate, self.group_capacity, now)
+        if user_bucket is not None and user_bucket.tokens < 1:
+            self.counters[REJECT_USER_RATE] += 1
+            return REJECT_USER_RATE
+        if group_bucket is not None and group_bucket.tokens < 1:
+            self.counters[REJECT_GROUP_RATE] += 1
+            return REJECT_GROUP_RATE
+        for bucket in (user_bucket, group_bucket):
+            if bucket is not None:
+                bucket.tokens -= 1
+                bucket.notified = False
+        self.counters[ADMIT] += 1
+        return ADMIT
+
+    def should_notify(self, group_id: str, user_id: str, verdict: str) -> bool:
+        """True once per throttling episode, so a flood gets one warning instead of one per message."""
+        if verdict == REJECT_USER_RATE:
+            bucket = self._user_buckets.get((group_id, user_id))
+        elif verdict == REJECT_GROUP_RATE:
+            bucket = self._group_buckets.get(group_id)
+        else:
+            return False
+        if bucket is None or bucket.notified:
+            return False
+        bucket.notified = True
+        return True
+
+    def _bucket(self, buckets: Dict, key, rate: float, capacity: float, now: float) -> Optional[TokenBucket]:
+        if not rate:
+            return None
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(capacity, now)
+        else:
+            bucket.refill(rate, capacity, now)
+        return bucket
+
+    def _prune(self, now: float):
+        # A bucket that would be full again carries no state worth keeping.
+        for buckets, rate, capacity in (
+            (self._user_buckets, self.user_rate, self.user_capacity),
+            (self._group_buckets, self.group_rate, self.group_capacity),
+        ):
+            for key in [k for k, b in buckets.items() if b.refill(rate, capacity, now) >= capacity]:
+                del buckets[key]
+
+    def stats_text(self) -> str:
+        c = self.counters
+        return (
+            f"准入控制：放行 {c[ADMIT]} 次，黑名单拦截 {c[REJECT_BLACKLIST]} 次，"
+            f"用户限流 {c[REJECT_USER_RATE]} 次，群限流 {c[REJECT_GROUP_RATE]} 次"
+        )
@@ -0,0 +1,101 @@
+"""Online backup and rotation helpers for blind-box plugin."""
+
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict, List
+
+try:
+    from .db_service import connect_db
+except Exception:
+    from db_service import connect_db
+
+
+BACKUP_PREFIX = "blindbox-"
+BACKUP_PAGES_PER_STEP = 256
+BACKUP_STEP_SLEEP_SECONDS = 0.005
+BACKUP_MAX_RESTARTS = 3
+
+
+class _BackupRestarted(Exception):
+    pass
+
+
+def backup_file_name(prefix: str = BACKUP_PREFIX, suffix: str = ".db") -> str:
+    """Timestamped (UTC+8) file name; lexical order equals chronological order."""
+    return f"{prefix}{time.strftime('%Y%m%d-%H%M%S', time.gmtime(time.time() + 8 * 3600))}{suffix}"
+
+
+def db_online_backup(
+    db_path: Path,
+    target: Path,
+    pages: int = BACKUP_PAGES_PER_STEP,
+    step_sleep: float = BACKUP_STEP_SLEEP_SECONDS,
+) -> Dict[str, int]:
+    """Copies a live database with the SQLite backup API and verifies the copy.
+
+    The copy advances ``pages`` pages per step and sleeps between steps, so writers only
+    wait for one short step at a time. A write from another connection restarts a stepped
+    copy; after ``BACKUP_MAX_RESTARTS`` restarts the rest is copied in one step, which in WAL
+    mode holds only a read snapshot and still does not block writers. The result is written
+    to ``<target>.part``, checked with ``PRAGMA integrity_check`` and renamed into place only
+    when it is intact.
+    """
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = target.with_name(f"{target.name}.part")
+    if tmp.exists():
+        tmp.unlink()
+    steps = 0
+    restarts = 0
+    last_remaining = -1
+
+    def _progress(status, remaining, total):
+        nonlocal steps, restarts, last_remaining
+        steps += 1
+        if 0 <= last_remaining < remaining:
+            restarts += 1
+            if restarts >= BACKUP_MAX_RESTARTS:
+                raise _BackupRestarted()
+        last_remaining = remaining
+
+    src = connect_db(db_path)
+    dst = sqlite3.connect(str(tmp))
+    try:
+        try:
+            src.backup(dst, pages=max(1, int(pages)), progress=_progress, sleep=max(0.0, float(step_sleep)))
+        except _BackupRestarted:
+            src.backup(dst, pages=-1)
+            steps += 1
+        # The source runs in WAL mode; store the copy as a single self-contained file.
+        dst.execute("PRAGMA journal_mode=DELETE").fetchall()
+        check = dst.execute("PRAGMA integrity_check").fetchone()[0]
+        if check != "ok":
+            raise sqlite3.DatabaseError(f"backup integrity_check failed: {check}")
+        page_count = int(dst.execute("PRAGMA page_count").fetchone()[0])
+    except Exception:
+        dst.close()
+        tmp.unlink(missing_ok=True)
+        raise
+    finally:
+        src.close()
+    dst.close()
+    os.replace(tmp, target)
+    return {"steps": steps, "restarts": restarts, "pages": page_count, "size": target.stat().st_size}
+
+
+def list_backups(backup_dir: Path, prefix: str = BACKUP_PREFIX) -> List[Path]:
+    """Finished backups, oldest first."""
+    if not backup_dir.exists():
+        return []
+    # Only finished files: ``.part`` / ``.tmp`` leftovers of an interrupted run are never counted or rotated.
+    return sorted(p for p in backup_dir.iterdir() if p.is_file() and p.name.startswith(prefix) and p.suffix in {".db", ".json"})
+
+
+def rotate_backups(backup_dir: Path, keep: int, prefix: str = BACKUP_PREFIX) -> int:
+    """Deletes all but the newest ``keep`` backups; returns how many were removed."""
+    backups = list_backups(backup_dir, prefix)
+    stale = backups[: max(0, len(backups) - max(1, int(keep)))]
+    for path in stale:
+        path.unlink(missing_ok=True)
+    return len(stale)
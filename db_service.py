@@ -1,15 +1,79 @@
 """Database service helpers for blind-box plugin."""
 
 import json
+import random
 import sqlite3
 import time
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 
+try:
+    from .resource_service import Category
+except Exception:
+    from resource_service import Category
+
+DB_BUSY_TIMEOUT_SECONDS = 10.0
+# Old SQLite builds cap bound parameters at 999 per statement; IN lists are split below that.
+SQL_IN_CHUNK_SIZE = 900
+
+
+def connect_db(db_path: Path) -> sqlite3.Connection:
+    return sqlite3.connect(db_path, timeout=DB_BUSY_TIMEOUT_SECONDS)
+
+
+def _ensure_version_column(conn: sqlite3.Connection, table: str):
+    columns = {str(r[1]) for r in conn.execute(f"PRAGMA table_info({table})").fetchall()}
+    if "version" not in columns:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+
+
+def new_draw_seed() -> int:
+    return random.SystemRandom().randrange(1, 2 ** 63)
+
+
+def build_draw_order(item_ids: List[str], seed: int) -> List[str]:
+    """Fisher-Yates permutation of ``item_ids`` driven by ``seed``; the same inputs always replay the same order."""
+    order = list(item_ids)
+    rng = random.Random(int(seed))
+    for i in range(len(order) - 1, 0, -1):
+        j = rng.randrange(i + 1)
+        order[i], order[j] = order[j], order[i]
+    return order
+
+
+def _ensure_draw_columns(conn: sqlite3.Connection, table: str):
+    """Adds draw_seed / draw_cursor; rows from before the draw order existed are shuffled once here."""
+    columns = {str(r[1]) for r in conn.execute(f"PRAGMA table_info({table})").fetchall()}
+    if "draw_seed" not in columns:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN draw_seed INTEGER NOT NULL DEFAULT 0")
+    if "draw_cursor" not in columns:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN draw_cursor INTEGER NOT NULL DEFAULT 0")
+    rows = conn.execute(f"SELECT rowid, remaining_items FROM {table} WHERE draw_seed=0").fetchall()
+    updates = []
+    for rowid, items_raw in rows:
+        seed = new_draw_seed()
+        order = build_draw_order(json.loads(items_raw) if items_raw else [], seed)
+        updates.append((json.dumps(order, ensure_ascii=False), seed, rowid))
+    if updates:
+        conn.executemany(
+            f"UPDATE {table} SET remaining_items=?, draw_seed=?, draw_cursor=0, version=version+1 WHERE rowid=?", updates
+        )
+
+
+def _remaining_from_order(order_raw: str, cursor: int) -> List[str]:
+    # remaining_items holds the full draw order; everything before the cursor has been drawn.
+    order = json.loads(order_raw) if order_raw else []
+    return order[int(cursor):]
+
 
 def init_db(db_path: Path):
-    conn = sqlite3.connect(db_path)
+    conn = connect_db(db_path)
     try:
+        # Only takes effect on a fresh file; older databases are converted by the maintenance job.
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        stats_exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='market_listing_stats'"
+        ).fetchone() is not None
         conn.execute(
             """
             CREATE TABLE IF NOT EXISTS user_wallet (
@@ -32,6 +96,19 @@ def init_db(db_path: Path):
             )
             """
         )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS group_category_state (
+                group_id TEXT NOT NULL,
+                category_id TEXT NOT NULL,
+                signature TEXT NOT NULL,
+                remaining_items TEXT NOT NULL,
+                remaining_slots TEXT NOT NULL,
+                updated_at INTEGER NOT NULL,
+                PRIMARY KEY (group_id, category_id)
+            )
+            """
+        )
         conn.execute(
             """
             CREATE TABLE IF NOT EXISTS system_kv (
@@ -57,13 +134,83 @@ def init_db(db_path: Path):
             )
             """
         )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_user_wallet_balance ON user_wallet(group_id, balance)")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_market_listing_item ON market_listing(group_id, category_id, item_id, is_system, price)"
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS market_listing_stats (
+                group_id TEXT NOT NULL,
+                category_id TEXT NOT NULL,
+                item_id TEXT NOT NULL,
+                price_sum INTEGER NOT NULL,
+                listing_count INTEGER NOT NULL,
+                quantity_sum INTEGER NOT NULL,
+                price_quantity_sum INTEGER NOT NULL,
+                min_price INTEGER NOT NULL,
+                PRIMARY KEY (group_id, category_id, item_id)
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS market_trade (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                group_id TEXT NOT NULL,
+                category_id TEXT NOT NULL,
+                item_id TEXT NOT NULL,
+                price INTEGER NOT NULL,
+                quantity INTEGER NOT NULL,
+                buyer_user_id TEXT NOT NULL,
+                seller_user_id TEXT NOT NULL,
+                is_system INTEGER NOT NULL,
+                day_key TEXT NOT NULL,
+                traded_at INTEGER NOT NULL
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS market_trade_daily (
+                group_id TEXT NOT NULL,
+                category_id TEXT NOT NULL,
+                item_id TEXT NOT NULL,
+                day_key TEXT NOT NULL,
+                open_price INTEGER NOT NULL,
+                high_price INTEGER NOT NULL,
+                low_price INTEGER NOT NULL,
+                close_price INTEGER NOT NULL,
+                volume INTEGER NOT NULL,
+                turnover INTEGER NOT NULL,
+                trade_count INTEGER NOT NULL,
+                PRIMARY KEY (group_id, category_id, item_id, day_key)
+            )
+            """
+        )
+        for table in ("user_wallet", "category_state", "group_category_state"):
+            _ensure_version_column(conn, table)
+        for table in ("category_state", "group_category_state"):
+            _ensure_draw_columns(conn, table)
+        if not stats_exists:
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO market_listing_stats(
+                    group_id,category_id,item_id,price_sum,listing_count,quantity_sum,price_quantity_sum,min_price
+                )
+                SELECT group_id,category_id,item_id,SUM(price),COUNT(*),SUM(quantity),SUM(price*quantity),MIN(price)
+                FROM market_listing WHERE is_system=0 AND quantity>0
+                GROUP BY group_id,category_id,item_id
+                """
+            )
         conn.commit()
+        conn.execute("PRAGMA journal_mode=WAL")
     finally:
         conn.close()
 
 
 def db_get_user(db_path: Path, group_id: str, user_id: str):
-    conn = sqlite3.connect(db_path)
+    conn = connect_db(db_path)
     try:
         cur = conn.execute(
             "SELECT group_id,user_id,balance,registered_at FROM user_wallet WHERE group_id=? AND user_id=?",
@@ -80,10 +227,10 @@ def db_get_balance(db_path: Path, group_id: str, user_id: str) -> Optional[int]:
 
 
 def db_register_user(db_path: Path, group_id: str, user_id: str, balance: int):
-    conn = sqlite3.connect(db_path)
+    conn = connect_db(db_path)
     try:
         conn.execute(
-            "INSERT OR REPLACE INTO user_wallet(group_id,user_id,balance,registered_at) VALUES (?,?,?,?)",
+            "INSERT OR IGNORE INTO user_wallet(group_id,user_id,balance,registered_at) VALUES (?,?,?,?)",
             (group_id, user_id, int(balance), int(time.time())),
         )
         conn.commit()
@@ -92,63 +239,329 @@ def db_register_user(db_path: Path, group_id: str, user_id: str, balance: int):
 
 
 def db_update_balance(db_path: Path, group_id: str, user_id: str, balance: int):
-    conn = sqlite3.connect(db_path)
+    conn = connect_db(db_path)
     try:
-        conn.execute("UPDATE user_wallet SET balance=? WHERE group_id=? AND user_id=?", (int(balance), group_id, user_id))
+        conn.execute(
+            "UPDATE user_wallet SET balance=?, version=version+1 WHERE group_id=? AND user_id=?",
+            (int(balance), group_id, user_id),
+        )
         conn.commit()
     finally:
         conn.close()
 
 
-def db_ensure_category_state(db_path: Path, category_id: str, category: dict):
-    conn = sqlite3.connect(db_path)
+def db_adjust_balance(db_path: Path, group_id: str, user_id: str, delta: int, min_balance: int = 0) -> Optional[int]:
+    """Applies ``delta`` atomically; returns the new balance, or None if it would drop below ``min_balance``."""
+    conn = connect_db(db_path)
     try:
-        cur = conn.execute("SELECT signature FROM category_state WHERE category_id=?", (category_id,))
-        row = cur.fetchone()
-        if row is None or row[0] != category["signature"]:
-            conn.execute(
-                "INSERT OR REPLACE INTO category_state(category_id,signature,remaining_items,remaining_slots,updated_at) VALUES (?,?,?,?,?)",
-                (
+        cur = conn.execute(
+            "UPDATE user_wallet SET balance=balance+?, version=version+1 WHERE group_id=? AND user_id=? AND balance+?>=?",
+            (int(delta), group_id, user_id, int(delta), int(min_balance)),
+        )
+        if cur.rowcount == 0:
+            conn.rollback()
+            return None
+        row = conn.execute("SELECT balance FROM user_wallet WHERE group_id=? AND user_id=?", (group_id, user_id)).fetchone()
+        conn.commit()
+        return int(row[0])
+    finally:
+        conn.close()
+
+
+def _state_scope(group_id: str) -> Tuple[str, str, Tuple]:
+    if group_id:
+        return "group_category_state", "group_id=? AND category_id=?", (group_id,)
+    return "category_state", "category_id=?", ()
+
+
+def db_ensure_category_states(db_path: Path, categories: Dict[str, Category], group_id: str = ""):
+    table, where, scope = _state_scope(group_id)
+    conn = connect_db(db_path)
+    try:
+        if group_id:
+            cur = conn.execute("SELECT category_id, signature FROM group_category_state WHERE group_id=?", (group_id,))
+        else:
+            cur = conn.execute("SELECT category_id, signature FROM category_state")
+        current = {str(r[0]): str(r[1]) for r in cur.fetchall()}
+        rows = []
+        adopted = []
+        now = int(time.time())
+        for category_id, category in categories.items():
+            stored = current.get(category_id)
+            if stored == category.signature:
+                continue
+            if stored is not None and stored == category.legacy_signature():
+                # Same contents under the old joined-id signature: keep the pool, only swap the signature.
+                adopted.append((category.signature,) + scope + (category_id,))
+                continue
+            seed = new_draw_seed()
+            rows.append(
+                scope
+                + (
                     category_id,
-                    category["signature"],
-                    json.dumps(list(category["items"].keys()), ensure_ascii=False),
-                    json.dumps(list(category["slots"]), ensure_ascii=False),
-                    int(time.time()),
-                ),
+                    category.signature,
+                    json.dumps(build_draw_order(category.item_ids, seed), ensure_ascii=False),
+                    json.dumps(list(category.slots), ensure_ascii=False),
+                    now,
+                    seed,
+                )
+            )
+        if rows:
+            columns = "group_id,category_id" if group_id else "category_id"
+            marks = ",".join("?" * len(rows[0]))
+            conn.executemany(
+                f"INSERT OR REPLACE INTO {table}({columns},signature,remaining_items,remaining_slots,updated_at,draw_seed,draw_cursor) "
+                f"VALUES ({marks},0)",
+                rows,
             )
+        if adopted:
+            conn.executemany(f"UPDATE {table} SET signature=? WHERE {where}", adopted)
+        if rows or adopted:
             conn.commit()
     finally:
         conn.close()
 
 
-def db_get_category_state(db_path: Path, category_id: str) -> Tuple[List[str], List[int]]:
-    conn = sqlite3.connect(db_path)
+def db_ensure_category_state(db_path: Path, category_id: str, category: Category, group_id: str = ""):
+    db_ensure_category_states(db_path, {category_id: category}, group_id)
+
+
+def db_get_category_state(db_path: Path, category_id: str, group_id: str = "") -> Tuple[List[str], List[int]]:
+    table, where, scope = _state_scope(group_id)
+    conn = connect_db(db_path)
     try:
-        cur = conn.execute("SELECT remaining_items, remaining_slots FROM category_state WHERE category_id=?", (category_id,))
+        cur = conn.execute(
+            f"SELECT remaining_items, remaining_slots, draw_cursor FROM {table} WHERE {where}", scope + (category_id,)
+        )
         row = cur.fetchone()
         if not row:
             return [], []
-        items = json.loads(row[0]) if row[0] else []
         slots = json.loads(row[1]) if row[1] else []
-        return list(items), sorted(int(v) for v in slots)
+        return _remaining_from_order(row[0], row[2]), sorted(int(v) for v in slots)
     finally:
         conn.close()
 
 
-def db_set_category_state(db_path: Path, category_id: str, signature: str, items: List[str], slots: List[int]):
-    conn = sqlite3.connect(db_path)
+def db_get_category_states(
+    db_path: Path, category_ids: List[str], group_id: str = ""
+) -> Dict[str, Tuple[List[str], List[int]]]:
+    wanted = list(dict.fromkeys(category_ids))
+    table = "group_category_state" if group_id else "category_state"
+    scope = "group_id=? AND " if group_id else ""
+    result: Dict[str, Tuple[List[str], List[int]]] = {}
+    conn = connect_db(db_path)
+    try:
+        for start in range(0, len(wanted), SQL_IN_CHUNK_SIZE):
+            chunk = wanted[start:start + SQL_IN_CHUNK_SIZE]
+            cur = conn.execute(
+                f"SELECT category_id, remaining_items, remaining_slots, draw_cursor FROM {table} "
+                f"WHERE {scope}category_id IN ({','.join('?' * len(chunk))})",
+                ((group_id,) if group_id else ()) + tuple(chunk),
+            )
+            for category_id, items_raw, slots_raw, cursor in cur.fetchall():
+                slots = json.loads(slots_raw) if slots_raw else []
+                result[str(category_id)] = (_remaining_from_order(items_raw, cursor), sorted(int(v) for v in slots))
+        return result
+    finally:
+        conn.close()
+
+
+def db_set_category_state(
+    db_path: Path, category_id: str, signature: str, items: List[str], slots: List[int], group_id: str = ""
+):
+    """Refills a pool: ``items`` are permuted with a fresh recorded seed and the draw cursor restarts at 0."""
+    table, where, scope = _state_scope(group_id)
+    seed = new_draw_seed()
+    conn = connect_db(db_path)
     try:
         conn.execute(
-            "UPDATE category_state SET signature=?, remaining_items=?, remaining_slots=?, updated_at=? WHERE category_id=?",
-            (signature, json.dumps(items, ensure_ascii=False), json.dumps(slots, ensure_ascii=False), int(time.time()), category_id),
+            f"UPDATE {table} SET signature=?, remaining_items=?, remaining_slots=?, updated_at=?, draw_seed=?, draw_cursor=0, "
+            f"version=version+1 WHERE {where}",
+            (
+                signature,
+                json.dumps(build_draw_order(items, seed), ensure_ascii=False),
+                json.dumps(slots, ensure_ascii=False),
+                int(time.time()),
+                seed,
+            )
+            + scope
+            + (category_id,),
         )
         conn.commit()
     finally:
         conn.close()
 
 
+def db_get_draw_window(
+    db_path: Path, category_id: str, count: int, group_id: str = ""
+) -> Tuple[List[str], int, List[int], Optional[int]]:
+    """(next ``count`` items at the draw cursor, remaining count, slots, version) of a pool.
+
+    Only the window is decoded: SQLite walks the stored order with json_each and returns
+    just the items about to be drawn, so an open does not rebuild the whole order in Python.
+    """
+    table, where, scope = _state_scope(group_id)
+    conn = connect_db(db_path)
+    try:
+        try:
+            row = conn.execute(
+                f"SELECT (SELECT json_group_array(value) FROM json_each(s.remaining_items) "
+                f"WHERE key >= s.draw_cursor AND key < s.draw_cursor + ?), "
+                f"json_array_length(s.remaining_items) - s.draw_cursor, s.remaining_slots, s.version "
+                f"FROM {table} AS s WHERE {where}",
+                (int(count),) + scope + (category_id,),
+            ).fetchone()
+        except sqlite3.OperationalError as ex:
+            if "no such function" not in str(ex):
+                raise
+            # SQLite built without JSON1: fall back to decoding the order in Python.
+            row = conn.execute(
+                f"SELECT remaining_items, draw_cursor, remaining_slots, version FROM {table} WHERE {where}",
+                scope + (category_id,),
+            ).fetchone()
+            if row:
+                remaining = _remaining_from_order(row[0], row[1])
+                row = (json.dumps(remaining[: int(count)]), len(remaining), row[2], row[3])
+        if not row:
+            return [], 0, [], None
+        slots = json.loads(row[2]) if row[2] else []
+        return json.loads(row[0]), max(0, int(row[1])), sorted(int(v) for v in slots), int(row[3])
+    finally:
+        conn.close()
+
+
+def db_get_pool_draw_info(db_path: Path, category_id: str, group_id: str = "") -> Optional[Tuple[int, int, int]]:
+    """(seed, cursor, total) of a pool's recorded draw order, or None if the pool does not exist."""
+    table, where, scope = _state_scope(group_id)
+    conn = connect_db(db_path)
+    try:
+        row = conn.execute(
+            f"SELECT draw_seed, draw_cursor, remaining_items FROM {table} WHERE {where}",
+            scope + (category_id,),
+        ).fetchone()
+        if not row:
+            return None
+        return int(row[0]), int(row[1]), len(json.loads(row[2]) if row[2] else [])
+    finally:
+        conn.close()
+
+
+def db_commit_draw(
+    db_path: Path,
+    *,
+    group_id: str,
+    user_id: str,
+    pool_group_id: str,
+    category_id: str,
+    expected_version: int,
+    draw_count: int,
+    remaining_slots: List[int],
+    price: int,
+    item_names: List[str],
+) -> Tuple[str, Optional[int]]:
+    """Writes one or more draws from the same pool atomically.
+
+    The drawn items are the next ``draw_count`` entries of the pool's recorded draw order, so
+    only the cursor advances; the order itself is not rewritten. ``price`` is the total
+    charged for the whole batch.
+    Returns ("ok", new_balance), ("conflict", None) when the pool version moved,
+    or ("insufficient", None) when the wallet can no longer cover ``price``.
+    """
+    table, where, scope = _state_scope(pool_group_id)
+    conn = connect_db(db_path)
+    try:
+        cur = conn.execute(
+            f"UPDATE {table} SET draw_cursor=draw_cursor+?, remaining_slots=?, updated_at=?, version=version+1 "
+            f"WHERE {where} AND version=?",
+            (
+                int(draw_count),
+                json.dumps(remaining_slots, ensure_ascii=False),
+                int(time.time()),
+            )
+            + scope
+            + (category_id, int(expected_version)),
+        )
+        if cur.rowcount == 0:
+            conn.rollback()
+            return "conflict", None
+        cur = conn.execute(
+            "UPDATE user_wallet SET balance=balance-?, version=version+1 WHERE group_id=? AND user_id=? AND balance>=?",
+            (int(price), group_id, user_id, int(price)),
+        )
+        if cur.rowcount == 0:
+            conn.rollback()
+            return "insufficient", None
+        counts: Dict[str, int] = {}
+        for item_name in item_names:
+            counts[item_name] = counts.get(item_name, 0) + 1
+        for item_name, count in counts.items():
+            _add_inventory_in_txn(conn, group_id, user_id, category_id, item_name, count)
+        conn.execute(
+            "UPDATE user_stats SET open_count=open_count+? WHERE group_id=? AND user_id=?",
+            (len(item_names), group_id, user_id),
+        )
+        row = conn.execute("SELECT balance FROM user_wallet WHERE group_id=? AND user_id=?", (group_id, user_id)).fetchone()
+        conn.commit()
+        return "ok", int(row[0])
+    finally:
+        conn.close()
+
+
+def _add_inventory_in_txn(conn: sqlite3.Connection, group_id: str, user_id: str, category_id: str, item_name: str, count: int):
+    conn.execute(
+        """
+        INSERT INTO user_inventory(group_id,user_id,category_id,item_name,count)
+        VALUES (?,?,?,?,?)
+        ON CONFLICT(group_id,user_id,category_id,item_name)
+        DO UPDATE SET count = count + excluded.count
+        """,
+        (group_id, user_id, category_id, item_name, int(count)),
+    )
+
+
+LEADERBOARD_COLUMNS = {
+    "balance": ("user_wallet", "balance"),
+    "collection": ("user_stats", "collection_count"),
+    "opens": ("user_stats", "open_count"),
+}
+
+
+def db_get_leaderboard(db_path: Path, group_id: str, metric: str, limit: int = 10) -> List[Tuple[str, int]]:
+    """Top ``limit`` users of a group; walks the (group_id, metric) index backwards, so cost is O(limit)."""
+    table, column = LEADERBOARD_COLUMNS[metric]
+    conn = connect_db(db_path)
+    try:
+        cur = conn.execute(
+            f"SELECT user_id,{column} FROM {table} WHERE group_id=? AND {column}>0 ORDER BY {column} DESC LIMIT ?",
+            (group_id, max(1, int(limit))),
+        )
+        return [(str(r[0]), int(r[1])) for r in cur.fetchall()]
+    finally:
+        conn.close()
+
+
+def db_get_user_stats(db_path: Path, group_id: str, user_id: str) -> Tuple[int, int]:
+    conn = connect_db(db_path)
+    try:
+        row = conn.execute(
+            "SELECT collection_count,open_count FROM user_stats WHERE group_id=? AND user_id=?", (group_id, user_id)
+        ).fetchone()
+        return (int(row[0]), int(row[1])) if row else (0, 0)
+    finally:
+        conn.close()
+
+
+def db_get_open_counts(db_path: Path) -> List[Tuple[str, str, int]]:
+    conn = connect_db(db_path)
+    try:
+        rows = conn.execute("SELECT group_id,user_id,open_count FROM user_stats WHERE open_count>0").fetchall()
+        return [(str(g), str(u), int(n)) for g, u, n in rows]
+    finally:
+        conn.close()
+
+
 def db_get_kv(db_path: Path, key: str) -> Optional[str]:
-    conn = sqlite3.connect(db_path)
+    conn = connect_db(db_path)
     try:
         cur = conn.execute("SELECT v FROM system_kv WHERE k=?", (key,))
         row = cur.fetchone()
@@ -158,7 +571,7 @@ def db_get_kv(db_path: Path, key: str) -> Optional[str]:
 
 
 def db_set_kv(db_path: Path, key: str, value: str):
-    conn = sqlite3.connect(db_path)
+    conn = connect_db(db_path)
     try:
         conn.execute("INSERT OR REPLACE INTO system_kv(k,v) VALUES (?,?)", (key, str(value)))
         conn.commit()
@@ -166,8 +579,45 @@ def db_set_kv(db_path: Path, key: str, value: str):
         conn.close()
 
 
+def db_get_kv_by_prefix(db_path: Path, prefix: str) -> Dict[str, str]:
+    conn = connect_db(db_path)
+    try:
+        cur = conn.execute("SELECT k, v FROM system_kv WHERE k >= ? AND k < ?", (prefix, prefix + "\uffff"))
+        return {str(k): str(v) for k, v in cur.fetchall()}
+    finally:
+        conn.close()
+
+
+def db_set_kv_many(db_path: Path, values: Dict[str, str]):
+    if not values:
+        return
+    conn = connect_db(db_path)
+    try:
+        conn.executemany("INSERT OR REPLACE INTO system_kv(k,v) VALUES (?,?)", [(k, str(v)) for k, v in values.items()])
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def db_grant_daily_gift_once(db_path: Path, amount: int, date_key: str, marker_key: str = "last_daily_gift_date") -> Optional[int]:
+    """Grants the gift and records ``date_key`` in one write transaction; returns None if already granted."""
+    conn = connect_db(db_path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT v FROM system_kv WHERE k=?", (marker_key,)).fetchone()
+        if row and str(row[0]) == date_key:
+            conn.rollback()
+            return None
+        cur = conn.execute("UPDATE user_wallet SET balance = balance + ?, version = version + 1", (int(amount),))
+        conn.execute("INSERT OR REPLACE INTO system_kv(k,v) VALUES (?,?)", (marker_key, date_key))
+        conn.commit()
+        return int(cur.rowcount or 0)
+    finally:
+        conn.close()
+
+
 def db_grant_daily_gift(db_path: Path, amount: int) -> int:
-    conn = sqlite3.connect(db_path)
+    conn = connect_db(db_path)
     try:
         cur = conn.execute("UPDATE user_wallet SET balance = balance + ?", (int(amount),))
         conn.commit()
@@ -188,7 +638,7 @@ def db_add_market_listing(
     is_system: int,
     day_key: str,
 ):
-    conn = sqlite3.connect(db_path)
+    conn = connect_db(db_path)
     try:
         conn.execute(
             """
@@ -209,13 +659,28 @@ def db_add_market_listing(
                 int(time.time()),
             ),
         )
+        if not int(is_system):
+            conn.execute(
+                """
+                INSERT INTO market_listing_stats(
+                    group_id,category_id,item_id,price_sum,listing_count,quantity_sum,price_quantity_sum,min_price
+                ) VALUES (?,?,?,?,1,?,?,?)
+                ON CONFLICT(group_id,category_id,item_id) DO UPDATE SET
+                    price_sum = price_sum + excluded.price_sum,
+                    listing_count = listing_count + 1,
+                    quantity_sum = quantity_sum + excluded.quantity_sum,
+                    price_quantity_sum = price_quantity_sum + excluded.price_quantity_sum,
+                    min_price = MIN(min_price, excluded.min_price)
+                """,
+                (group_id, category_id, item_id, int(price), int(quantity), int(price) * int(quantity), int(price)),
+            )
         conn.commit()
     finally:
         conn.close()
 
 
 def db_list_market_listings(db_path: Path, group_id: str, category_id: str = "") -> List[dict]:
-    conn = sqlite3.connect(db_path)
+    conn = connect_db(db_path)
     try:
         if category_id:
             cur = conn.execute(
@@ -257,28 +722,234 @@ def db_list_market_listings(db_path: Path, group_id: str, category_id: str = "")
 
 def db_consume_market_listing(db_path: Path, listing_id: int, quantity: int) -> bool:
     need = max(1, int(quantity))
-    conn = sqlite3.connect(db_path)
+    conn = connect_db(db_path)
     try:
-        cur = conn.execute("SELECT quantity FROM market_listing WHERE id=?", (int(listing_id),))
-        row = cur.fetchone()
-        if not row:
-            return False
-        have = int(row[0])
-        if have < need:
+        cur = conn.execute("UPDATE market_listing SET quantity=quantity-? WHERE id=? AND quantity>=?", (need, int(listing_id), need))
+        if cur.rowcount == 0:
+            conn.rollback()
             return False
-        remain = have - need
+        row = conn.execute(
+            "SELECT quantity,group_id,category_id,item_id,price,is_system FROM market_listing WHERE id=?",
+            (int(listing_id),),
+        ).fetchone()
+        remain = int(row[0])
+        if remain <= 0:
+            conn.execute("DELETE FROM market_listing WHERE id=?", (int(listing_id),))
+        if not int(row[5]):
+            _apply_listing_stats_consume(conn, str(row[1]), str(row[2]), str(row[3]), int(row[4]), need, remain <= 0)
+        conn.commit()
+        return True
+    finally:
+        conn.close()
+
+
+def _apply_listing_stats_consume(
+    conn: sqlite3.Connection, group_id: str, category_id: str, item_id: str, price: int, quantity: int, removed: bool
+):
+    key = (group_id, category_id, item_id)
+    conn.execute(
+        """
+        UPDATE market_listing_stats
+        SET quantity_sum = quantity_sum - ?, price_quantity_sum = price_quantity_sum - ?,
+            price_sum = price_sum - ?, listing_count = listing_count - ?
+        WHERE group_id=? AND category_id=? AND item_id=?
+        """,
+        (quantity, price * quantity, price if removed else 0, 1 if removed else 0) + key,
+    )
+    if not removed:
+        return
+    cur = conn.execute(
+        "SELECT MIN(price) FROM market_listing WHERE group_id=? AND category_id=? AND item_id=? AND is_system=0 AND quantity>0",
+        key,
+    )
+    min_price = cur.fetchone()[0]
+    if min_price is None:
+        conn.execute("DELETE FROM market_listing_stats WHERE group_id=? AND category_id=? AND item_id=?", key)
+    else:
+        conn.execute(
+            "UPDATE market_listing_stats SET min_price=? WHERE group_id=? AND category_id=? AND item_id=?",
+            (int(min_price),) + key,
+        )
+
+
+def db_purchase_listing(
+    db_path: Path, listing_id: int, group_id: str, buyer_user_id: str, quantity: int, day_key: str = ""
+) -> Tuple[str, Optional[int], int]:
+    """Buys from one listing atomically and appends the fill to ``market_trade``.
+
+    Returns (status, new_balance, total_price) where status is "ok", "sold_out" or "insufficient".
+    """
+    need = max(1, int(quantity))
+    conn = connect_db(db_path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            "SELECT quantity,group_id,category_id,item_id,price,is_system,item_name,seller_user_id FROM market_listing WHERE id=?",
+            (int(listing_id),),
+        ).fetchone()
+        if not row or int(row[0]) < need:
+            conn.rollback()
+            return "sold_out", None, 0
+        total_price = int(row[4]) * need
+        cur = conn.execute(
+            "UPDATE user_wallet SET balance=balance-?, version=version+1 WHERE group_id=? AND user_id=? AND balance>=?",
+            (total_price, group_id, buyer_user_id, total_price),
+        )
+        if cur.rowcount == 0:
+            conn.rollback()
+            return "insufficient", None, total_price
+        remain = int(row[0]) - need
         if remain > 0:
             conn.execute("UPDATE market_listing SET quantity=? WHERE id=?", (remain, int(listing_id)))
         else:
             conn.execute("DELETE FROM market_listing WHERE id=?", (int(listing_id),))
+        if not int(row[5]):
+            _apply_listing_stats_consume(conn, str(row[1]), str(row[2]), str(row[3]), int(row[4]), need, remain <= 0)
+        _add_inventory_in_txn(conn, group_id, buyer_user_id, str(row[2]), str(row[6]), need)
+        conn.execute(
+            """
+            INSERT INTO market_trade(
+                group_id,category_id,item_id,price,quantity,buyer_user_id,seller_user_id,is_system,day_key,traded_at
+            ) VALUES (?,?,?,?,?,?,?,?,?,?)
+            """,
+            (
+                group_id,
+                str(row[2]),
+                str(row[3]),
+                int(row[4]),
+                need,
+                buyer_user_id,
+                str(row[7]),
+                int(row[5]),
+                day_key,
+                int(time.time()),
+            ),
+        )
+        balance = conn.execute(
+            "SELECT balance FROM user_wallet WHERE group_id=? AND user_id=?", (group_id, buyer_user_id)
+        ).fetchone()
         conn.commit()
-        return True
+        return "ok", int(balance[0]), total_price
+    finally:
+        conn.close()
+
+
+MARKET_TRADE_ROLLUP_KEY = "market_trade_rollup_id"
+
+
+def merge_trade_into_daily(daily: Dict[Tuple[str, str, str, str], List[int]], trade: Tuple) -> None:
+    """Folds one (group, category, item, day, price, quantity) fill into an OHLC accumulator.
+
+    Trades must arrive in id order so the first/last fill of a day become open/close.
+    """
+    group_id, category_id, item_id, day_key, price, quantity = trade
+    key = (group_id, category_id, item_id, day_key)
+    acc = daily.get(key)
+    if acc is None:
+        daily[key] = [price, price, price, price, quantity, price * quantity, 1]
+        return
+    acc[1] = max(acc[1], price)
+    acc[2] = min(acc[2], price)
+    acc[3] = price
+    acc[4] += quantity
+    acc[5] += price * quantity
+    acc[6] += 1
+
+
+def db_rollup_market_trades(db_path: Path, retention_days: int, batch_size: int = 1000) -> Tuple[int, int]:
+    """Compacts trades past the rollup watermark into ``market_trade_daily`` and prunes old raw rows.
+
+    Returns (rolled_up, pruned).
+    """
+    conn = connect_db(db_path)
+    rolled = 0
+    try:
+        while True:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT v FROM system_kv WHERE k=?", (MARKET_TRADE_ROLLUP_KEY,)).fetchone()
+            watermark = int(row[0]) if row else 0
+            trades = conn.execute(
+                "SELECT id,group_id,category_id,item_id,day_key,price,quantity FROM market_trade WHERE id>? ORDER BY id LIMIT ?",
+                (watermark, max(1, int(batch_size))),
+            ).fetchall()
+            if not trades:
+                conn.rollback()
+                break
+            daily: Dict[Tuple[str, str, str, str], List[int]] = {}
+            for trade in trades:
+                merge_trade_into_daily(daily, (str(trade[1]), str(trade[2]), str(trade[3]), str(trade[4]), int(trade[5]), int(trade[6])))
+            conn.executemany(
+                """
+                INSERT INTO market_trade_daily(
+                    group_id,category_id,item_id,day_key,open_price,high_price,low_price,close_price,volume,turnover,trade_count
+                ) VALUES (?,?,?,?,?,?,?,?,?,?,?)
+                ON CONFLICT(group_id,category_id,item_id,day_key) DO UPDATE SET
+                    high_price = MAX(high_price, excluded.high_price),
+                    low_price = MIN(low_price, excluded.low_price),
+                    close_price = excluded.close_price,
+                    volume = volume + excluded.volume,
+                    turnover = turnover + excluded.turnover,
+                    trade_count = trade_count + excluded.trade_count
+                """,
+                [key + tuple(acc) for key, acc in daily.items()],
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO system_kv(k,v) VALUES (?,?)", (MARKET_TRADE_ROLLUP_KEY, str(int(trades[-1][0])))
+            )
+            conn.commit()
+            rolled += len(trades)
+
+        cutoff = int(time.time()) - max(0, int(retention_days)) * 86400
+        row = conn.execute("SELECT v FROM system_kv WHERE k=?", (MARKET_TRADE_ROLLUP_KEY,)).fetchone()
+        watermark = int(row[0]) if row else 0
+        cur = conn.execute("DELETE FROM market_trade WHERE id<=? AND traded_at<?", (watermark, cutoff))
+        conn.commit()
+        return rolled, max(0, cur.rowcount)
+    finally:
+        conn.close()
+
+
+def db_get_market_trade_daily(
+    db_path: Path, group_id: str, category_id: str, item_id: str, since_day: str
+) -> List[Tuple[str, int, int, int, int, int, int, int]]:
+    """Daily rows from ``since_day`` on, oldest first: (day, open, high, low, close, volume, turnover, trades)."""
+    conn = connect_db(db_path)
+    try:
+        cur = conn.execute(
+            """
+            SELECT day_key,open_price,high_price,low_price,close_price,volume,turnover,trade_count
+            FROM market_trade_daily
+            WHERE group_id=? AND category_id=? AND item_id=? AND day_key>=?
+            ORDER BY day_key
+            """,
+            (group_id, category_id, item_id, since_day),
+        )
+        return [(str(r[0]),) + tuple(int(v) for v in r[1:]) for r in cur.fetchall()]
+    finally:
+        conn.close()
+
+
+def db_get_listing_stats(db_path: Path, group_id: str, category_id: str = "") -> Dict[Tuple[str, str], Tuple[int, int, int, int, int]]:
+    conn = connect_db(db_path)
+    try:
+        sql = (
+            "SELECT category_id,item_id,price_sum,listing_count,quantity_sum,price_quantity_sum,min_price "
+            "FROM market_listing_stats WHERE group_id=?"
+        )
+        params: Tuple = (group_id,)
+        if category_id:
+            sql += " AND category_id=?"
+            params = (group_id, category_id)
+        return {
+            (str(r[0]), str(r[1])): (int(r[2]), int(r[3]), int(r[4]), int(r[5]), int(r[6]))
+            for r in conn.execute(sql, params).fetchall()
+        }
     finally:
         conn.close()
 
 
 def db_delete_expired_system_listings(db_path: Path, group_id: str, day_key: str):
-    conn = sqlite3.connect(db_path)
+    conn = connect_db(db_path)
     try:
         conn.execute(
             "DELETE FROM market_listing WHERE group_id=? AND is_system=1 AND day_key<>?",
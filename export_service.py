@@ -0,0 +1,323 @@
+"""Streaming JSONL export / import of the blind-box economy."""
+
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+try:
+    from .db_service import build_draw_order, connect_db, new_draw_seed
+    from .maintenance_service import MULTIPLIER_KV_PREFIX, OPEN_TS_KV_PREFIX, prefix_upper_bound
+except Exception:
+    from db_service import build_draw_order, connect_db, new_draw_seed
+    from maintenance_service import MULTIPLIER_KV_PREFIX, OPEN_TS_KV_PREFIX, prefix_upper_bound
+
+
+EXPORT_FORMAT = "arknights_blindbox_economy"
+EXPORT_VERSION = 1
+EXPORT_BATCH_SIZE = 1000
+IMPORT_CHUNK_SIZE = 1000
+RECORD_TYPES = ("wallet", "inventory", "pool", "listing", "kv")
+# Only these KV keys are economy data. Everything else (trade rollup watermark, daily gift,
+# maintenance and backup stamps) is bookkeeping local to one database and never leaves it.
+ECONOMY_KV_PREFIXES = (MULTIPLIER_KV_PREFIX, OPEN_TS_KV_PREFIX)
+
+# (record type, SELECT for one group, SELECT for every group, output fields); rows come back in key order.
+_EXPORT_QUERIES: List[Tuple[str, str, str, Tuple[str, ...]]] = [
+    (
+        "wallet",
+        "SELECT group_id,user_id,balance,registered_at FROM user_wallet WHERE group_id=? ORDER BY user_id",
+        "SELECT group_id,user_id,balance,registered_at FROM user_wallet ORDER BY group_id,user_id",
+        ("group_id", "user_id", "balance", "registered_at"),
+    ),
+    (
+        "inventory",
+        "SELECT group_id,user_id,category_id,item_name,count FROM user_inventory WHERE group_id=? "
+        "ORDER BY user_id,category_id,item_name",
+        "SELECT group_id,user_id,category_id,item_name,count FROM user_inventory "
+        "ORDER BY group_id,user_id,category_id,item_name",
+        ("group_id", "user_id", "category_id", "item_name", "count"),
+    ),
+    (
+        "pool",
+        "SELECT group_id,category_id,signature,remaining_items,remaining_slots,draw_seed,draw_cursor "
+        "FROM group_category_state WHERE group_id=? ORDER BY category_id",
+        "SELECT '',category_id,signature,remaining_items,remaining_slots,draw_seed,draw_cursor FROM category_state "
+        "UNION ALL SELECT group_id,category_id,signature,remaining_items,remaining_slots,draw_seed,draw_cursor "
+        "FROM group_category_state ORDER BY 1,2",
+        ("group_id", "category_id", "signature", "draw_order", "remaining_slots", "draw_seed", "draw_cursor"),
+    ),
+    (
+        "listing",
+        "SELECT group_id,category_id,item_id,item_name,price,quantity,seller_user_id,is_system,day_key,created_at "
+        "FROM market_listing WHERE group_id=? AND quantity>0 ORDER BY id",
+        "SELECT group_id,category_id,item_id,item_name,price,quantity,seller_user_id,is_system,day_key,created_at "
+        "FROM market_listing WHERE quantity>0 ORDER BY id",
+        (
+            "group_id", "category_id", "item_id", "item_name", "price", "quantity",
+            "seller_user_id", "is_system", "day_key", "created_at",
+        ),
+    ),
+    (
+        "kv",
+        "SELECT k,v FROM system_kv WHERE k>=? AND k<? ORDER BY k",
+        "SELECT k,v FROM system_kv WHERE " + " OR ".join("(k>=? AND k<?)" for _ in ECONOMY_KV_PREFIXES) + " ORDER BY k",
+        ("k", "v"),
+    ),
+]
+
+
+def is_economy_kv(key: str) -> bool:
+    return str(key).startswith(ECONOMY_KV_PREFIXES)
+
+
+def export_header(group_id: str) -> dict:
+    return {
+        "type": "header",
+        "format": EXPORT_FORMAT,
+        "version": EXPORT_VERSION,
+        "group_id": group_id,
+        "exported_at": int(time.time()),
+    }
+
+
+def iter_db_records(db_path: Path, group_id: str = "", batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[dict]:
+    """Yields export records table by table, holding at most ``batch_size`` rows at a time.
+
+    With ``group_id`` only that group's rows (and its cooldown KV keys) are read; an empty
+    ``group_id`` exports every group plus the shared pools and the economy KV keys. All
+    tables are read inside one read transaction, so they come from the same snapshot.
+    """
+    batch_size = max(1, int(batch_size))
+    conn = connect_db(db_path)
+    try:
+        conn.execute("BEGIN")
+        for record_type, group_sql, all_sql, fields in _EXPORT_QUERIES:
+            if not group_id and record_type == "kv":
+                bounds = tuple(v for prefix in ECONOMY_KV_PREFIXES for v in (prefix, prefix_upper_bound(prefix)))
+                cur = conn.execute(all_sql, bounds)
+            elif not group_id:
+                cur = conn.execute(all_sql)
+            elif record_type == "kv":
+                prefix = f"{OPEN_TS_KV_PREFIX}{group_id}:"
+                cur = conn.execute(group_sql, (prefix, prefix_upper_bound(prefix)))
+            else:
+                cur = conn.execute(group_sql, (group_id,))
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    record = dict(zip(fields, row))
+                    if record_type == "pool":
+                        record["draw_order"] = json.loads(record["draw_order"] or "[]")
+                        record["remaining_items"] = record["draw_order"][record["draw_cursor"]:]
+                        record["remaining_slots"] = json.loads(record["remaining_slots"] or "[]")
+                    record["type"] = record_type
+                    yield record
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def write_jsonl(path: Path, header: dict, records: Iterable[dict]) -> Dict[str, int]:
+    """Streams ``records`` to ``path`` one JSON object per line; returns per-type counts."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.part")
+    counts = {record_type: 0 for record_type in RECORD_TYPES}
+    try:
+        with tmp.open("w", encoding="utf-8") as f:
+            f.write(json.dumps(header, ensure_ascii=False) + "\n")
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                counts[record["type"]] = counts.get(record["type"], 0) + 1
+    except Exception:
+        tmp.unlink(missing_ok=True)
+        raise
+    os.replace(tmp, path)
+    return counts
+
+
+def read_jsonl(path: Path) -> Tuple[dict, Iterator[dict]]:
+    """Returns the validated header and a lazy iterator over the remaining records."""
+    f = path.open("r", encoding="utf-8")
+    try:
+        header = json.loads(f.readline() or "{}")
+    except ValueError:
+        f.close()
+        raise ValueError("导出文件首行不是有效的 JSON")
+    if header.get("type") != "header" or header.get("format") != EXPORT_FORMAT:
+        f.close()
+        raise ValueError("不是盲盒经济导出文件")
+    if int(header.get("version", 0)) > EXPORT_VERSION:
+        f.close()
+        raise ValueError(f"导出文件版本 {header.get('version')} 高于当前支持的 {EXPORT_VERSION}")
+
+    def _records() -> Iterator[dict]:
+        with f:
+            for line_no, line in enumerate(f, start=2):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    raise ValueError(f"第 {line_no} 行不是有效的 JSON")
+                if record.get("type") in RECORD_TYPES:
+                    yield record
+
+    return header, _records()
+
+
+def remap_group(records: Iterable[dict], source_group: str, target_group: str) -> Iterator[dict]:
+    """Moves a single-group export onto ``target_group`` (rows and cooldown KV keys)."""
+    old_prefix = f"{OPEN_TS_KV_PREFIX}{source_group}:"
+    new_prefix = f"{OPEN_TS_KV_PREFIX}{target_group}:"
+    for record in records:
+        if record["type"] == "kv":
+            if record["k"].startswith(old_prefix):
+                record["k"] = new_prefix + record["k"][len(old_prefix):]
+        elif record.get("group_id") == source_group:
+            record["group_id"] = target_group
+        yield record
+
+
+_IMPORT_SQL = {
+    "wallet": (
+        "INSERT INTO user_wallet(group_id,user_id,balance,registered_at) VALUES (?,?,?,?) "
+        "ON CONFLICT(group_id,user_id) DO UPDATE SET balance=excluded.balance, version=version+1"
+    ),
+    # Upsert (not REPLACE) so the user_inventory triggers keep user_stats exact.
+    "inventory": (
+        "INSERT INTO user_inventory(group_id,user_id,category_id,item_name,count) VALUES (?,?,?,?,?) "
+        "ON CONFLICT(group_id,user_id,category_id,item_name) DO UPDATE SET count=excluded.count"
+    ),
+    "group_pool": (
+        "INSERT INTO group_category_state(group_id,category_id,signature,remaining_items,remaining_slots,updated_at,"
+        "draw_seed,draw_cursor) VALUES (?,?,?,?,?,?,?,?) ON CONFLICT(group_id,category_id) DO UPDATE SET "
+        "signature=excluded.signature, remaining_items=excluded.remaining_items, remaining_slots=excluded.remaining_slots, "
+        "updated_at=excluded.updated_at, draw_seed=excluded.draw_seed, draw_cursor=excluded.draw_cursor, version=version+1"
+    ),
+    "global_pool": (
+        "INSERT INTO category_state(category_id,signature,remaining_items,remaining_slots,updated_at,draw_seed,draw_cursor) "
+        "VALUES (?,?,?,?,?,?,?) ON CONFLICT(category_id) DO UPDATE SET signature=excluded.signature, "
+        "remaining_items=excluded.remaining_items, remaining_slots=excluded.remaining_slots, "
+        "updated_at=excluded.updated_at, draw_seed=excluded.draw_seed, draw_cursor=excluded.draw_cursor, version=version+1"
+    ),
+    "listing": (
+        "INSERT INTO market_listing(group_id,category_id,item_id,item_name,price,quantity,seller_user_id,"
+        "is_system,day_key,created_at) VALUES (?,?,?,?,?,?,?,?,?,?)"
+    ),
+    "kv": "INSERT INTO system_kv(k,v) VALUES (?,?) ON CONFLICT(k) DO UPDATE SET v=excluded.v",
+}
+
+
+def pool_draw_state(record: dict) -> Tuple[List[str], int, int]:
+    """(draw order, seed, cursor) for an imported pool; files without a recorded order get a fresh one."""
+    if "draw_order" in record:
+        return list(record["draw_order"]), int(record.get("draw_seed", 0)), int(record.get("draw_cursor", 0))
+    seed = new_draw_seed()
+    return build_draw_order(list(record.get("remaining_items", [])), seed), seed, 0
+
+
+def _import_row(record: dict, now: int) -> Tuple[str, tuple]:
+    record_type = record["type"]
+    if record_type == "wallet":
+        return "wallet", (
+            str(record["group_id"]), str(record["user_id"]), int(record["balance"]), int(record.get("registered_at", now))
+        )
+    if record_type == "inventory":
+        return "inventory", (
+            str(record["group_id"]), str(record["user_id"]), str(record["category_id"]),
+            str(record["item_name"]), int(record["count"]),
+        )
+    if record_type == "pool":
+        order, seed, cursor = pool_draw_state(record)
+        state = (
+            str(record["category_id"]),
+            str(record.get("signature", "")),
+            json.dumps(order, ensure_ascii=False),
+            json.dumps([int(v) for v in record.get("remaining_slots", [])], ensure_ascii=False),
+            now,
+            seed,
+            cursor,
+        )
+        group_id = str(record.get("group_id", ""))
+        return ("group_pool", (group_id,) + state) if group_id else ("global_pool", state)
+    if record_type == "listing":
+        return "listing", (
+            str(record["group_id"]), str(record["category_id"]), str(record["item_id"]), str(record["item_name"]),
+            int(record["price"]), int(record["quantity"]), str(record["seller_user_id"]), int(record["is_system"]),
+            str(record["day_key"]), int(record.get("created_at", now)),
+        )
+    return "kv", (str(record["k"]), str(record["v"]))
+
+
+def db_import_records(db_path: Path, records: Iterable[dict], chunk_size: int = IMPORT_CHUNK_SIZE) -> Dict[str, int]:
+    """Upserts streamed records with ``executemany``, one short transaction per ``chunk_size`` rows.
+
+    Wallets, inventory, pools and economy KV keys are upserted; other KV keys are skipped.
+    A group's listings are replaced: its current listings are deleted when the first listing
+    of that group arrives, and its ``market_listing_stats`` rows are rebuilt at the end.
+    """
+    chunk_size = max(1, int(chunk_size))
+    counts = {record_type: 0 for record_type in RECORD_TYPES}
+    buffers: Dict[str, List[tuple]] = {}
+    pending = 0
+    listing_groups: Set[str] = set()
+    now = int(time.time())
+    conn = connect_db(db_path)
+
+    def _flush():
+        nonlocal pending
+        with conn:
+            for key, rows in buffers.items():
+                if rows:
+                    conn.executemany(_IMPORT_SQL[key], rows)
+        buffers.clear()
+        pending = 0
+
+    try:
+        for record in records:
+            if record["type"] == "kv" and not is_economy_kv(record["k"]):
+                continue
+            key, row = _import_row(record, now)
+            if key == "listing" and row[0] not in listing_groups:
+                _flush()
+                with conn:
+                    conn.execute("DELETE FROM market_listing WHERE group_id=?", (row[0],))
+                listing_groups.add(row[0])
+            buffers.setdefault(key, []).append(row)
+            counts[record["type"]] += 1
+            pending += 1
+            if pending >= chunk_size:
+                _flush()
+        _flush()
+        for group_id in listing_groups:
+            _rebuild_listing_stats(conn, group_id)
+    finally:
+        conn.close()
+    return counts
+
+
+def _rebuild_listing_stats(conn: sqlite3.Connection, group_id: str):
+    with conn:
+        conn.execute("DELETE FROM market_listing_stats WHERE group_id=?", (group_id,))
+        conn.execute(
+            """
+            INSERT INTO market_listing_stats(
+                group_id,category_id,item_id,price_sum,listing_count,quantity_sum,price_quantity_sum,min_price
+            )
+            SELECT group_id,category_id,item_id,SUM(price),COUNT(*),SUM(quantity),SUM(price*quantity),MIN(price)
+            FROM market_listing WHERE group_id=? AND is_system=0 AND quantity>0
+            GROUP BY group_id,category_id,item_id
+            """,
+            (group_id,),
+        )
+
+
+def export_file_name(group_id: Optional[str]) -> str:
+    scope = "".join(ch if ch.isalnum() or ch in "-_" else "_" for ch in group_id) if group_id else "all"
+    return f"economy-{scope}-{time.strftime('%Y%m%d-%H%M%S', time.gmtime(time.time() + 8 * 3600))}.jsonl"
@@ -0,0 +1,229 @@
+"""Image derivative helpers for blind-box plugin."""
+
+import base64
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+Image = None
+_pil_checked = False
+
+IMAGE_FORMATS = {"jpeg": ("JPEG", ".jpg"), "webp": ("WEBP", ".webp")}
+
+
+def _load_pillow():
+    """Imports Pillow on first use so plugin startup does not pay for it."""
+    global Image, _pil_checked
+    if not _pil_checked:
+        _pil_checked = True
+        try:
+            from PIL import Image as pil_image
+            Image = pil_image
+        except Exception:
+            Image = None
+    return Image
+
+
+def pillow_available() -> bool:
+    return _load_pillow() is not None
+
+
+def file_content_hash(path: Path, chunk_size: int = 1 << 16) -> str:
+    h = hashlib.sha1()
+    with path.open("rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def normalize_image_format(value: object) -> str:
+    fmt = str(value or "").strip().lower()
+    if fmt in {"jpg", "jpeg"}:
+        return "jpeg"
+    if fmt == "webp":
+        return "webp"
+    return "jpeg"
+
+
+def _temp_path(target: Path) -> Path:
+    # Images are built in worker threads, so two sends of the same picture may race on one target.
+    return target.with_name(f"{target.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+
+def build_image_derivative(source: Path, target: Path, max_edge: int, quality: int, fmt: str):
+    pil_format, _ = IMAGE_FORMATS[fmt]
+    with Image.open(source) as img:
+        img.load()
+        if max_edge > 0 and max(img.size) > max_edge:
+            img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        if pil_format == "JPEG":
+            if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+                rgba = img.convert("RGBA")
+                canvas = Image.new("RGB", rgba.size, (255, 255, 255))
+                canvas.paste(rgba, mask=rgba.split()[-1])
+                img = canvas
+            elif img.mode != "RGB":
+                img = img.convert("RGB")
+        elif img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA")
+
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp = _temp_path(target)
+        img.save(tmp, format=pil_format, quality=int(quality), optimize=True)
+    os.replace(tmp, target)
+
+
+def build_image_grid(sources: List[Path], target: Path, cell_edge: int, columns: int, quality: int, fmt: str):
+    pil_format, _ = IMAGE_FORMATS[fmt]
+    cell_edge = max(16, int(cell_edge))
+    columns = max(1, min(int(columns), len(sources)))
+    rows = (len(sources) + columns - 1) // columns
+    canvas = Image.new("RGB", (columns * cell_edge, rows * cell_edge), (255, 255, 255))
+    for index, source in enumerate(sources):
+        with Image.open(source) as img:
+            img.load()
+            img.thumbnail((cell_edge, cell_edge), Image.LANCZOS)
+            tile = img.convert("RGBA")
+        x = (index % columns) * cell_edge + (cell_edge - tile.width) // 2
+        y = (index // columns) * cell_edge + (cell_edge - tile.height) // 2
+        canvas.paste(tile, (x, y), mask=tile.split()[-1])
+
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = _temp_path(target)
+    canvas.save(tmp, format=pil_format, quality=int(quality), optimize=True)
+    os.replace(tmp, target)
+
+
+class ImageDerivativeCache:
+    """Serves resized/re-encoded copies of local images from a content-hash keyed cache."""
+
+    def __init__(self, cache_dir: Path, max_edge: int = 1280, quality: int = 85, fmt: str = "jpeg"):
+        self.cache_dir = cache_dir
+        self.max_edge = max(0, int(max_edge))
+        self.quality = min(95, max(1, int(quality)))
+        self.fmt = normalize_image_format(fmt)
+        self._resolved: Dict[str, Tuple[int, int, Path]] = {}
+
+    @property
+    def params(self) -> Tuple[int, int, str]:
+        return self.max_edge, self.quality, self.fmt
+
+    def get(self, source: Path) -> Path:
+        """Returns the derivative path for ``source``, or ``source`` itself when no smaller copy can be built."""
+        if _load_pillow() is None:
+            return source
+        try:
+            st = source.stat()
+        except OSError:
+            return source
+
+        key = str(source)
+        cached = self._resolved.get(key)
+        if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            return cached[2]
+
+        resolved = self._build(source, st.st_size)
+        self._resolved[key] = (st.st_mtime_ns, st.st_size, resolved)
+        return resolved
+
+    def _build(self, source: Path, source_size: int) -> Path:
+        _, ext = IMAGE_FORMATS[self.fmt]
+        digest = file_content_hash(source)
+        target = self.cache_dir / f"{digest}_{self.max_edge}_q{self.quality}{ext}"
+        if not target.exists():
+            build_image_derivative(source, target, self.max_edge, self.quality, self.fmt)
+        if target.stat().st_size >= source_size:
+            return source
+        return target
+
+    def clear_memo(self):
+        self._resolved.clear()
+
+
+class ImageByteCache:
+    """Bounded LRU of encoded image bytes, invalidated by file mtime/size."""
+
+    def __init__(self, budget_bytes: int):
+        self.budget_bytes = max(0, int(budget_bytes))
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, Tuple[int, int, bytes]]" = OrderedDict()
+        # Images are read in worker threads, so lookups and evictions are serialized.
+        self._lock = threading.Lock()
+
+    def get_bytes(self, path: Path) -> bytes:
+        st = path.stat()
+        key = str(path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+
+        data = path.read_bytes()
+        with self._lock:
+            self._drop(key)
+            if 0 < len(data) <= self.budget_bytes:
+                self._entries[key] = (st.st_mtime_ns, st.st_size, data)
+                self.used_bytes += len(data)
+                self._evict()
+        return data
+
+    def get_base64(self, path: Path) -> str:
+        return base64.b64encode(self.get_bytes(path)).decode("ascii")
+
+    def resize(self, budget_bytes: int):
+        with self._lock:
+            self.budget_bytes = max(0, int(budget_bytes))
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.used_bytes = 0
+
+    def stats_text(self) -> str:
+        total = self.hits + self.misses
+        ratio = (self.hits / total * 100) if total else 0.0
+        return (
+            f"图片内存缓存：{len(self._entries)} 张，"
+            f"{self.used_bytes / 1048576:.1f}/{self.budget_bytes / 1048576:.1f} MB，"
+            f"命中 {self.hits} / 未命中 {self.misses}（命中率 {ratio:.1f}%），淘汰 {self.evictions}"
+        )
+
+    def _evict(self):
+        while self.used_bytes > self.budget_bytes and self._entries:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _drop(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry:
+            self.used_bytes -= len(entry[2])
+
+
+class FileHashMemo:
+    """Remembers content hashes per path until the file's mtime/size changes."""
+
+    def __init__(self):
+        self._hashes: Dict[str, Tuple[int, int, str]] = {}
+
+    def get(self, path: Path) -> str:
+        st = path.stat()
+        key = str(path)
+        cached = self._hashes.get(key)
+        if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            return cached[2]
+        digest = file_content_hash(path)
+        self._hashes[key] = (st.st_mtime_ns, st.st_size, digest)
+        return digest
@@ -1,12 +1,16 @@
 """Inventory persistence helpers for blind-box plugin."""
 
-import sqlite3
 from pathlib import Path
 from typing import List, Tuple
 
+try:
+    from .db_service import connect_db
+except Exception:
+    from db_service import connect_db
+
 
 def init_inventory_table(db_path: Path):
-    conn = sqlite3.connect(db_path)
+    conn = connect_db(db_path)
     try:
         conn.execute(
             """
@@ -20,13 +24,65 @@ def init_inventory_table(db_path: Path):
             )
             """
         )
+        stats_exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='user_stats'"
+        ).fetchone() is not None
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS user_stats (
+                group_id TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                collection_count INTEGER NOT NULL DEFAULT 0,
+                open_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (group_id, user_id)
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_user_stats_collection ON user_stats(group_id, collection_count)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_user_stats_open ON user_stats(group_id, open_count)")
+        # collection_count follows user_inventory through triggers, so every write path
+        # (plain helpers and the draw/purchase transactions in db_service) keeps it exact.
+        conn.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS trg_user_inventory_insert AFTER INSERT ON user_inventory
+            BEGIN
+                INSERT INTO user_stats(group_id,user_id,collection_count) VALUES (NEW.group_id,NEW.user_id,NEW.count)
+                ON CONFLICT(group_id,user_id) DO UPDATE SET collection_count = collection_count + excluded.collection_count;
+            END
+            """
+        )
+        conn.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS trg_user_inventory_update AFTER UPDATE OF count ON user_inventory
+            BEGIN
+                UPDATE user_stats SET collection_count = collection_count + NEW.count - OLD.count
+                WHERE group_id=NEW.group_id AND user_id=NEW.user_id;
+            END
+            """
+        )
+        conn.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS trg_user_inventory_delete AFTER DELETE ON user_inventory
+            BEGIN
+                UPDATE user_stats SET collection_count = collection_count - OLD.count
+                WHERE group_id=OLD.group_id AND user_id=OLD.user_id;
+            END
+            """
+        )
+        if not stats_exists:
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO user_stats(group_id,user_id,collection_count)
+                SELECT group_id,user_id,SUM(count) FROM user_inventory GROUP BY group_id,user_id
+                """
+            )
         conn.commit()
     finally:
         conn.close()
 
 
 def add_inventory_item(db_path: Path, group_id: str, user_id: str, category_id: str, item_name: str, count: int = 1):
-    conn = sqlite3.connect(db_path)
+    conn = connect_db(db_path)
     try:
         conn.execute(
             """
@@ -43,7 +99,7 @@ def add_inventory_item(db_path: Path, group_id: str, user_id: str, category_id:
 
 
 def get_user_inventory(db_path: Path, group_id: str, user_id: str) -> List[Tuple[str, str, int]]:
-    conn = sqlite3.connect(db_path)
+    conn = connect_db(db_path)
     try:
         cur = conn.execute(
             "SELECT category_id,item_name,count FROM user_inventory WHERE group_id=? AND user_id=? ORDER BY category_id,item_name",
@@ -55,7 +111,7 @@ def get_user_inventory(db_path: Path, group_id: str, user_id: str) -> List[Tuple
 
 
 def get_user_inventory_by_category(db_path: Path, group_id: str, user_id: str, category_id: str) -> List[Tuple[str, int]]:
-    conn = sqlite3.connect(db_path)
+    conn = connect_db(db_path)
     try:
         cur = conn.execute(
             "SELECT item_name,count FROM user_inventory WHERE group_id=? AND user_id=? AND category_id=? ORDER BY item_name",
@@ -68,28 +124,20 @@ def get_user_inventory_by_category(db_path: Path, group_id: str, user_id: str, c
 
 def consume_inventory_item(db_path: Path, group_id: str, user_id: str, category_id: str, item_name: str, count: int = 1) -> bool:
     need = max(1, int(count))
-    conn = sqlite3.connect(db_path)
+    key = (group_id, user_id, category_id, item_name)
+    conn = connect_db(db_path)
     try:
         cur = conn.execute(
-            "SELECT count FROM user_inventory WHERE group_id=? AND user_id=? AND category_id=? AND item_name=?",
-            (group_id, user_id, category_id, item_name),
+            "UPDATE user_inventory SET count=count-? WHERE group_id=? AND user_id=? AND category_id=? AND item_name=? AND count>=?",
+            (need,) + key + (need,),
         )
-        row = cur.fetchone()
-        have = int(row[0]) if row else 0
-        if have < need:
+        if cur.rowcount == 0:
+            conn.rollback()
             return False
-
-        remain = have - need
-        if remain > 0:
-            conn.execute(
-                "UPDATE user_inventory SET count=? WHERE group_id=? AND user_id=? AND category_id=? AND item_name=?",
-                (remain, group_id, user_id, category_id, item_name),
-            )
-        else:
-            conn.execute(
-                "DELETE FROM user_inventory WHERE group_id=? AND user_id=? AND category_id=? AND item_name=?",
-                (group_id, user_id, category_id, item_name),
-            )
+        conn.execute(
+            "DELETE FROM user_inventory WHERE group_id=? AND user_id=? AND category_id=? AND item_name=? AND count<=0",
+            key,
+        )
         conn.commit()
         return True
     finally:
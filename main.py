@@ -1,93 +1,82 @@
 import asyncio
+import hashlib
 import json
 import random
-import re
 import shutil
+import sqlite3
 import sys
+import threading
 import time
+from collections import OrderedDict
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Set, Tuple
 
 from astrbot.api import logger
 from astrbot.api.event import AstrMessageEvent, filter
 from astrbot.api.star import Context, Star, register
 
 try:
-    from .db_service import (
-        db_add_market_listing,
-        db_consume_market_listing,
-        db_delete_expired_system_listings,
-        db_ensure_category_state,
-        db_get_balance,
-        db_get_category_state,
-        db_get_kv,
-        db_list_market_listings,
-        db_get_user,
-        db_grant_daily_gift,
-        db_register_user,
-        db_set_category_state,
-        db_set_kv,
-        db_update_balance,
-        init_db,
-    )
-    from . import resource_service as resource_service_module
-    from .time_service import utc8_date_hour
-    from .inventory_service import (
-        add_inventory_item,
-        consume_inventory_item,
-        get_user_inventory,
-        get_user_inventory_by_category,
-        init_inventory_table,
-    )
+    import astrbot.api.message_components as Comp
+except Exception:
+    Comp = None
+
+try:
+    from .time_service import utc8_date_days_ago, utc8_date_hour
     from .market_service import (
         build_market_breakdown,
         calc_scarcity_multiplier,
         clamp_non_negative_float,
         clamp_volatility,
         get_daily_market_multiplier_for_item,
+        PricingContext,
+    )
+    from .resource_index_service import build_name_index, search_name_index, sync_box_index_file
+    from .resource_service import Category, ITEM_TABLE_CACHE_SIZE, ResourceScanner
+    from .profile_service import CommandProfiler
+    from .admission_service import ADMIT, AdmissionController, REJECT_BLACKLIST
+    from .backup_service import db_online_backup, list_backups, rotate_backups
+    from .export_service import export_file_name, export_header, read_jsonl, remap_group, write_jsonl
+    from .storage_service import create_storage, normalize_storage_engine, StorageBackend
+    from .media_cache_service import MediaReferenceCache, MediaUploader
+    from .image_service import (
+        build_image_grid,
+        FileHashMemo,
+        IMAGE_FORMATS,
+        ImageByteCache,
+        ImageDerivativeCache,
+        normalize_image_format,
+        pillow_available,
     )
-    from .resource_index_service import sync_box_index_file
 except Exception:
     plugin_dir = str(Path(__file__).resolve().parent)
     if plugin_dir not in sys.path:
         sys.path.insert(0, plugin_dir)
-    from db_service import (
-        db_add_market_listing,
-        db_consume_market_listing,
-        db_delete_expired_system_listings,
-        db_ensure_category_state,
-        db_get_balance,
-        db_get_category_state,
-        db_get_kv,
-        db_list_market_listings,
-        db_get_user,
-        db_grant_daily_gift,
-        db_register_user,
-        db_set_category_state,
-        db_set_kv,
-        db_update_balance,
-        init_db,
-    )
-    try:
-        import resource_service as resource_service_module
-    except Exception:
-        resource_service_module = None
-    from time_service import utc8_date_hour
-    from inventory_service import (
-        add_inventory_item,
-        consume_inventory_item,
-        get_user_inventory,
-        get_user_inventory_by_category,
-        init_inventory_table,
-    )
+    from time_service import utc8_date_days_ago, utc8_date_hour
     from market_service import (
         build_market_breakdown,
         calc_scarcity_multiplier,
         clamp_non_negative_float,
         clamp_volatility,
         get_daily_market_multiplier_for_item,
+        PricingContext,
+    )
+    from resource_index_service import build_name_index, search_name_index, sync_box_index_file
+    from resource_service import Category, ITEM_TABLE_CACHE_SIZE, ResourceScanner
+    from profile_service import CommandProfiler
+    from admission_service import ADMIT, AdmissionController, REJECT_BLACKLIST
+    from backup_service import db_online_backup, list_backups, rotate_backups
+    from export_service import export_file_name, export_header, read_jsonl, remap_group, write_jsonl
+    from storage_service import create_storage, normalize_storage_engine, StorageBackend
+    from media_cache_service import MediaReferenceCache, MediaUploader
+    from image_service import (
+        build_image_grid,
+        FileHashMemo,
+        IMAGE_FORMATS,
+        ImageByteCache,
+        ImageDerivativeCache,
+        normalize_image_format,
+        pillow_available,
     )
-    from resource_index_service import sync_box_index_file
 
 
 @register("astrbot_plugin_arknights_authorization", "codex", "明日方舟通行证盲盒互动插件", "1.7.2")
@@ -95,6 +84,46 @@ class ArknightsBlindBoxPlugin(Star):
     """明日方舟通行证盲盒互动插件。"""
 
     GUIDE_CANDIDATES = ["selection.jpg", "selection.png", "cover.jpg", "cover.png"]
+    OPEN_RETRY_LIMIT = 5
+    BATCH_OPEN_ALL_WORDS = {"全部", "all"}
+    BATCH_OPEN_TEN_WORDS = {"十连", "ten"}
+    BATCH_IMAGE_GRID_KEEP = 64
+    LEADERBOARD_SIZE = 10
+    MARKET_TREND_DAYS = 14
+    MARKET_ACTION_ALIASES = {"list": "列表", "sell": "上架", "buy": "购买", "trend": "走势", "history": "走势"}
+    MARKET_SUB_ACTIONS = {"上架", "购买", "走势"}
+    MARKET_ROLLUP_INTERVAL_SECONDS = 300
+    MAINTENANCE_CHECK_SECONDS = 600
+    MAINTENANCE_KV_KEEP_DAYS = 2
+    MAINTENANCE_BATCH_SIZE = 500
+    BACKUP_CHECK_SECONDS = 600
+    STARTUP_WAIT_SECONDS = 30
+    RESOURCE_RESCAN_SECONDS = 60
+    VIEW_CACHE_SIZE = 256
+    STARTUP_INDEPENDENT_ACTIONS = {
+        "",
+        "注册",
+        "signup",
+        "reg",
+        "钱包",
+        "balance",
+        "money",
+        "排行",
+        "排行榜",
+        "rank",
+        "top",
+        "帮助",
+        "help",
+    }
+    LEADERBOARD_METRICS = {
+        "余额": "balance",
+        "balance": "balance",
+        "收藏": "collection",
+        "collection": "collection",
+        "开盒": "opens",
+        "opens": "opens",
+    }
+    LEADERBOARD_LABELS = {"balance": ("余额", "元"), "collection": ("收藏", "件"), "opens": ("开盒", "次")}
 
     def __init__(self, context: Context):
         super().__init__(context)
@@ -106,6 +135,12 @@ class ArknightsBlindBoxPlugin(Star):
         self.session_path = self.data_dir / "sessions.json"
         self.db_path = self.data_dir / "blindbox.db"
         self.resource_index_path = self.data_dir / "resource_box_index.json"
+        self.resource_scan_cache_path = self.data_dir / "resource_scan_cache.json"
+        self.profile_dir = self.data_dir / "profiles"
+        self.image_cache_dir = self.data_dir / "image_cache"
+        self.memory_snapshot_path = self.data_dir / "memory_snapshot.json"
+        self.backup_dir = self.data_dir / "backups"
+        self.export_dir = self.data_dir / "exports"
 
         self.resource_dir = self.base_dir / "resources"
         self.number_box_dir = self.resource_dir / "number_box"
@@ -113,43 +148,193 @@ class ArknightsBlindBoxPlugin(Star):
 
         self.sessions: Dict[str, str] = {}
         self.runtime_config: Dict[str, object] = {}
-        self.categories: Dict[str, dict] = {}
+        self.categories: Dict[str, Category] = {}
+        self._scanner = ResourceScanner(self.resource_scan_cache_path, self.GUIDE_CANDIDATES, ITEM_TABLE_CACHE_SIZE)
+        self._item_store = self._scanner.store
         self.resource_box_index: Dict[str, dict] = {}
+        self.item_name_index: Dict[str, object] = {}
+        self._item_name_index_key: Tuple = ()
+        self._pool_state_cache: Dict[Tuple[str, str], Tuple[List[str], List[int]]] = {}
+        self._ensured_pool_keys: Set[Tuple[str, str]] = set()
+        self._view_generations: Dict[Tuple[str, str], int] = {}
+        self._view_cache: "OrderedDict[Tuple[str, str, str], Tuple[Tuple, str]]" = OrderedDict()
+        self._system_market_refreshed: Dict[str, Tuple] = {}
+        self._inflight_reads: Dict[Tuple[str, str, str], asyncio.Future] = {}
+        self._view_stats: Dict[str, int] = {"hit": 0, "render": 0, "coalesced": 0}
+        self._loop_thread_id = threading.get_ident()
 
         self._runtime_config_mtime: float = 0
         self._last_context_sync: float = 0
         self._daily_gift_task: Optional[asyncio.Task] = None
+        self._snapshot_task: Optional[asyncio.Task] = None
+        self._market_rollup_task: Optional[asyncio.Task] = None
+        self._maintenance_task: Optional[asyncio.Task] = None
+        self._maintenance_job: Optional[asyncio.Task] = None
+        self._backup_task: Optional[asyncio.Task] = None
+        self._backup_job: Optional[asyncio.Task] = None
+        self._last_backup_summary = ""
+        self._transfer_job: Optional[asyncio.Task] = None
+        self._last_transfer_summary = ""
+        self._startup_task: Optional[asyncio.Task] = None
+        self._rescan_task: Optional[asyncio.Task] = None
+        self._last_resource_scan = 0.0
+        self._startup_ready: Optional[asyncio.Future] = None
+        self._startup_began: float = 0
+        self._startup_timings: Dict[str, float] = {}
+        self._last_scan_summary = ""
+        self._last_maintenance_summary = ""
+        self.storage: Optional[StorageBackend] = None
         self._last_open_ts: Dict[str, float] = {}
+        self._profiler: Optional[CommandProfiler] = None
+        self._admission = AdmissionController()
+        self._admission_config_gen = -1
+        self._image_pipeline: Optional[ImageDerivativeCache] = None
+        self._image_pipeline_warned = False
+        self._image_byte_cache: Optional[ImageByteCache] = None
+        self._image_hash_memo = FileHashMemo()
+        self._media_uploaders: Dict[str, MediaUploader] = {}
+        self._media_refs = MediaReferenceCache(
+            self._db_get_media_id,
+            self._db_set_media_id,
+            self._db_delete_media_id,
+            lambda message: logger.warning(f"[arknights_blindbox] {message}"),
+        )
 
     async def initialize(self):
+        self._startup_began = time.perf_counter()
+        self._startup_ready = asyncio.get_running_loop().create_future()
+        self._loop_thread_id = threading.get_ident()
         self.data_dir.mkdir(parents=True, exist_ok=True)
         self._migrate_legacy_data_if_needed()
         self._ensure_default_runtime_config()
         self._load_all()
         self._sync_runtime_config_from_context()
         self._init_db()
-        self._grant_daily_gift_if_due()
-        self._refresh_categories_and_states()
+        self._startup_timings["schema"] = self._elapsed_since_startup_ms()
+        self._startup_task = asyncio.create_task(self._finish_startup())
         self._daily_gift_task = asyncio.create_task(self._daily_gift_loop())
-        logger.info("[arknights_blindbox] 插件初始化完成。")
+        self._market_rollup_task = asyncio.create_task(self._market_rollup_loop())
+        self._maintenance_task = asyncio.create_task(self._maintenance_loop())
+        self._backup_task = asyncio.create_task(self._backup_loop())
+        if self.storage.engine == "memory":
+            self._snapshot_task = asyncio.create_task(self._storage_snapshot_loop())
+        logger.info(
+            f"[arknights_blindbox] 插件初始化完成（数据库就绪 {self._startup_timings['schema']:.0f} ms，资源在后台加载）。"
+        )
+
+    async def _finish_startup(self):
+        try:
+            await self._rescan_resources(sync_legacy=True)
+        except Exception as ex:
+            logger.warning(f"[arknights_blindbox] 后台加载资源失败，将在首次指令时重试：{ex}")
+        finally:
+            self._startup_timings["resources"] = self._elapsed_since_startup_ms()
+            if not self._startup_ready.done():
+                self._startup_ready.set_result(True)
+            logger.info(
+                f"[arknights_blindbox] 资源加载完成：{len(self.categories)} 个种类，"
+                f"启动后 {self._startup_timings['resources']:.0f} ms（扫描：{self._last_scan_summary or '未完成'}）"
+            )
+
+    def _scan_resources(self, sync_legacy: bool = False) -> Tuple[Dict[str, Category], Dict[str, dict]]:
+        # Runs in a worker thread: filesystem only; plugin state is applied afterwards on the loop.
+        if sync_legacy:
+            self._sync_legacy_resource_dirs()
+        scanned = self._scan_categories()
+        if tuple((cid, c.signature) for cid, c in scanned.items()) == self._item_name_index_key:
+            # Unchanged signatures: reuse the box index instead of loading every category's items.
+            return scanned, self.resource_box_index
+        return scanned, sync_box_index_file(self.resource_index_path, scanned)
+
+    async def _rescan_resources(self, sync_legacy: bool = False):
+        scanned, resource_box_index = await asyncio.to_thread(self._scan_resources, sync_legacy)
+        self._apply_scanned_categories(scanned, resource_box_index)
+        self._last_resource_scan = time.monotonic()
+
+    def _schedule_resource_rescan(self):
+        """Starts a background rescan at most every RESOURCE_RESCAN_SECONDS; commands never wait for it."""
+        if time.monotonic() - self._last_resource_scan < self.RESOURCE_RESCAN_SECONDS:
+            return
+        if self._rescan_task is not None and not self._rescan_task.done():
+            return
+        self._rescan_task = asyncio.create_task(self._run_resource_rescan())
+
+    async def _run_resource_rescan(self):
+        try:
+            await self._rescan_resources()
+        except Exception as ex:
+            self._last_resource_scan = time.monotonic()
+            logger.warning(f"[arknights_blindbox] 后台重新扫描资源失败：{ex}")
+
+    async def _wait_until_ready(self) -> bool:
+        ready = self._startup_ready
+        if ready is None or ready.done():
+            return True
+        try:
+            await asyncio.wait_for(asyncio.shield(ready), timeout=self.STARTUP_WAIT_SECONDS)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def _elapsed_since_startup_ms(self) -> float:
+        return (time.perf_counter() - self._startup_began) * 1000
+
+    def _mark_first_reply(self):
+        if "first_reply" in self._startup_timings or not self._startup_began:
+            return
+        self._startup_timings["first_reply"] = self._elapsed_since_startup_ms()
+        logger.info(f"[arknights_blindbox] 启动后首次响应耗时 {self._startup_timings['first_reply']:.0f} ms")
 
     @filter.command("方舟盲盒")
     async def arknights_blindbox(self, event: AstrMessageEvent):
+        profiler = self._profiler
+        if profiler is not None and profiler.active and profiler.busy:
+            # cProfile and tracemalloc are process-wide: profile one command at a time and skip the rest.
+            profiler.note_concurrent()
+            profiler = None
+        if profiler is None or not profiler.active:
+            async for r in self._dispatch_command(event):
+                self._mark_first_reply()
+                yield r
+            return
+
+        args = self._extract_command_args(event.message_str)
+        action = args[0].lower() if args else ""
+        snapshot = profiler.begin()
+        try:
+            async for r in self._dispatch_command(event):
+                profiler.pause()
+                self._mark_first_reply()
+                yield r
+                profiler.resume()
+        finally:
+            if profiler.end(action, snapshot):
+                self._finish_profiler()
+
+    async def _dispatch_command(self, event: AstrMessageEvent):
+        args = self._extract_command_args(event.message_str)
+        action = args[0].lower() if args else ""
+        identity = self._get_identity(event)
+        verdict = self._admit_command(identity)
+        if verdict != ADMIT:
+            if verdict != REJECT_BLACKLIST and self._admission.should_notify(identity[0], identity[1], verdict):
+                yield event.plain_result("操作过于频繁，请稍后再试。")
+            return
+
         self._maybe_reload_runtime_data()
         self._sync_runtime_config_from_context()
         self._grant_daily_gift_if_due()
-        self._refresh_categories_and_states()
 
-        args = self._extract_command_args(event.message_str)
+        if action not in self.STARTUP_INDEPENDENT_ACTIONS:
+            if not await self._wait_until_ready():
+                yield event.plain_result("插件正在加载盲盒资源，请稍后再试。")
+                return
+            self._schedule_resource_rescan()
+
         if not args:
             yield event.plain_result(self._build_help_text())
             return
 
-        action = args[0].lower()
-
-        if self._is_blacklisted(event):
-            return
-
         if action in {"注册", "signup", "reg"}:
             identity = self._get_identity(event)
             if identity is None:
@@ -190,14 +375,24 @@ class ArknightsBlindBoxPlugin(Star):
             if not rows:
                 yield event.plain_result(f"当前库存为空。\n当前群：{group_id}")
                 return
+            pricing = self._build_pricing_context(group_id, sorted({row[0] for row in rows}))
+            portfolio_total = 0
+            pending_count = 0
             lines = ["当前库存："]
             for category_id, item_name, count in rows:
-                unit_price, unit_text = self._get_inventory_unit_price(group_id, category_id, item_name)
+                unit_price, unit_text = self._get_inventory_unit_price(group_id, category_id, item_name, pricing)
+                if unit_price is not None:
+                    portfolio_total += unit_price * count
+                else:
+                    pending_count += 1
                 total_text = f"{unit_price * count} 元" if unit_price is not None else "待定"
                 lines.append(
                     f"- [{category_id}] {item_name} x{count} | 通行证单价：{unit_text} | 数量总价：{total_text}"
                 )
-            lines.append(f"\n当前群：{group_id}")
+            self._flush_pricing_context(pricing)
+            pending_text = f"（另有 {pending_count} 项待定）" if pending_count else ""
+            lines.append(f"\n库存总估值：{portfolio_total} 元{pending_text}")
+            lines.append(f"当前群：{group_id}")
             yield event.plain_result("\n".join(lines))
             return
 
@@ -210,12 +405,44 @@ class ArknightsBlindBoxPlugin(Star):
             if self._db_get_user(group_id, user_id) is None:
                 yield event.plain_result("你还未注册，请先发送：/方舟盲盒 注册")
                 return
+            view_category = self._market_view_category(args[1:])
+            if view_category is not None:
+                self._refresh_system_market(group_id)
+                text = await self._read_view_text(
+                    "market", group_id, view_category, lambda: self._render_market_text(view_category, group_id)
+                )
+                yield event.plain_result(text)
+                return
             for r in self._handle_market_command(event, group_id, user_id, args[1:]):
                 yield r
             return
 
         if action in {"列表", "list", "types"}:
-            yield event.plain_result(self._build_category_list_text())
+            identity = self._get_identity(event)
+            group_id = identity[0] if identity else ""
+            yield event.plain_result(
+                await self._read_view_text("list", group_id, "", lambda: self._render_category_list_text(group_id))
+            )
+            return
+
+        if action in {"排行", "排行榜", "rank", "top"}:
+            identity = self._get_identity(event)
+            if identity is None:
+                yield event.plain_result("无法识别你的账号ID，暂时无法查看排行。")
+                return
+            metric = self.LEADERBOARD_METRICS.get(args[1] if len(args) > 1 else "余额")
+            if metric is None:
+                yield event.plain_result("用法：/方舟盲盒 排行 [余额|收藏|开盒]")
+                return
+            yield event.plain_result(self._build_leaderboard_text(identity[0], identity[1], metric))
+            return
+
+        if action in {"搜索", "search", "find"}:
+            keyword = " ".join(args[1:]).strip()
+            if not keyword:
+                yield event.plain_result("请提供关键字，例如：/方舟盲盒 搜索 能天使")
+                return
+            yield event.plain_result(self._build_search_text(keyword))
             return
 
         if action in {"帮助", "help"}:
@@ -223,7 +450,7 @@ class ArknightsBlindBoxPlugin(Star):
             return
 
         if action in {"重载资源", "reload", "reload_resources", "rescan"}:
-            self._refresh_categories_and_states(force_sync_legacy=True)
+            await self._rescan_resources(sync_legacy=True)
             yield event.plain_result(
                 "资源已重新扫描。\n"
                 f"当前已加载种类数：{len(self.categories)}\n"
@@ -231,7 +458,7 @@ class ArknightsBlindBoxPlugin(Star):
             )
             return
 
-        if action in {"选择", "开", "开启", "open", "状态", "status", "刷新", "reset", "refresh"}:
+        if action in {"选择", "select", "开", "开启", "open", "状态", "status", "刷新", "reset", "refresh"}:
             identity = self._get_identity(event)
             if identity is None:
                 yield event.plain_result("无法识别你的账号ID，暂时无法进行盲盒操作。")
@@ -248,18 +475,18 @@ class ArknightsBlindBoxPlugin(Star):
             category_id = args[1]
             category = self.categories.get(category_id)
             if not category:
-                yield event.plain_result(f"不存在种类 `{category_id}`。\n\n{self._build_category_list_text()}")
+                yield event.plain_result(f"不存在种类 `{category_id}`。\n\n{self._build_category_list_text(group_id)}")
                 return
 
             self.sessions[self._build_session_key(event)] = category_id
             self._save_json(self.session_path, self.sessions)
 
-            remain_items, remain_slots = self._db_get_category_state(category_id)
+            remain_items, remain_slots = self._db_get_category_state(category_id, group_id)
             price = self._get_category_price(category_id)
 
             if not remain_items or not remain_slots:
                 yield event.plain_result(
-                    f"你已选择【{category['id']}】\n"
+                    f"你已选择【{category.id}】\n"
                     f"当前卡池剩余：{len(remain_items)}\n"
                     f"当前单抽价格：{self._format_price_text(price)}\n"
                     "该种类已不可继续开启。你可以：\n"
@@ -269,13 +496,13 @@ class ArknightsBlindBoxPlugin(Star):
                 return
 
             tip = (
-                f"你已选择【{category['id']}】\n"
+                f"你已选择【{category.id}】\n"
                 f"当前卡池剩余：{len(remain_items)}\n"
                 f"当前单抽价格：{self._format_price_text(price)}\n"
                 f"可选序号：{self._format_slots(remain_slots)}\n"
-                "请发送指令：/方舟盲盒 开 <序号>"
+                "请发送指令：/方舟盲盒 开 <序号>（可一次多个，或 开 十连 / 开 全部）"
             )
-            for r in self._build_results_with_optional_image(event, tip, category.get("guide_image")):
+            for r in await self._build_results_with_optional_image(event, tip, category.guide_image):
                 yield r
             return
 
@@ -284,10 +511,14 @@ class ArknightsBlindBoxPlugin(Star):
             assert identity is not None
             group_id, user_id = identity
 
-            if len(args) < 2 or not args[1].isdigit():
-                yield event.plain_result("请提供数字序号，例如：/方舟盲盒 开 3")
+            slot_args = args[1:]
+            if not slot_args or not (
+                slot_args[0] in self.BATCH_OPEN_ALL_WORDS
+                or slot_args[0] in self.BATCH_OPEN_TEN_WORDS
+                or all(v.isdigit() for v in slot_args)
+            ):
+                yield event.plain_result("请提供数字序号，例如：/方舟盲盒 开 3（一次开多个：开 1 3 5 / 开 十连 / 开 全部）")
                 return
-            choose_slot = int(args[1])
 
             category_id = self.sessions.get(self._build_session_key(event))
             if not category_id or category_id not in self.categories:
@@ -295,12 +526,19 @@ class ArknightsBlindBoxPlugin(Star):
                 return
             category = self.categories[category_id]
 
-            remain_items, remain_slots = self._db_get_category_state(category_id)
+            remain_items, remain_slots = self._db_get_category_state(category_id, group_id)
             if not remain_items or not remain_slots:
-                yield event.plain_result(f"【{category['id']}】卡池或序号已耗尽，请发送：/方舟盲盒 刷新 {category_id}")
+                yield event.plain_result(f"【{category.id}】卡池或序号已耗尽，请发送：/方舟盲盒 刷新 {category_id}")
+                return
+            choose_slots = self._parse_open_slots(slot_args, remain_slots, len(remain_items))
+            unavailable = [v for v in choose_slots if v not in remain_slots]
+            if unavailable:
+                yield event.plain_result(
+                    f"序号 {', '.join(str(v) for v in unavailable)} 已不可用，可选序号：{self._format_slots(remain_slots)}"
+                )
                 return
-            if choose_slot not in remain_slots:
-                yield event.plain_result(f"序号 {choose_slot} 已不可用，可选序号：{self._format_slots(remain_slots)}")
+            if len(choose_slots) > len(remain_items):
+                yield event.plain_result(f"卡池仅剩 {len(remain_items)} 个，本次最多开 {len(remain_items)} 个。")
                 return
 
             balance = self._db_get_balance(group_id, user_id)
@@ -311,8 +549,9 @@ class ArknightsBlindBoxPlugin(Star):
             if price <= 0:
                 yield event.plain_result("当前种类的通行证价格待定，请联系管理员设置特殊定价后再开启。")
                 return
-            if balance < price:
-                yield event.plain_result(f"余额不足，当前余额：{balance} 元，当前单抽价格：{price} 元")
+            total_price = price * len(choose_slots)
+            if balance < total_price:
+                yield event.plain_result(self._format_open_insufficient_text(balance, price, len(choose_slots)))
                 return
 
             cooldown_key = self._build_session_key(event)
@@ -325,26 +564,57 @@ class ArknightsBlindBoxPlugin(Star):
                 yield event.plain_result(f"操作过快，请等待 {wait_sec} 秒后再开盲盒。")
                 return
 
-            selected = random.choice(remain_items)
-            remain_items.remove(selected)
-            remain_slots.remove(choose_slot)
-            self._db_set_category_state(category_id, remain_items, remain_slots)
-            self._db_update_balance(group_id, user_id, balance - price)
+            status, selected, remain_count, remain_slots, new_balance = self._commit_open_with_retry(
+                group_id, user_id, category_id, choose_slots, price
+            )
+            if status == "slot_taken":
+                unavailable = [v for v in choose_slots if v not in remain_slots]
+                yield event.plain_result(
+                    f"序号 {', '.join(str(v) for v in unavailable)} 已不可用，可选序号：{self._format_slots(remain_slots)}"
+                )
+                return
+            if status == "pool_short":
+                yield event.plain_result(f"卡池仅剩 {remain_count} 个，本次最多开 {remain_count} 个。")
+                return
+            if status == "insufficient":
+                yield event.plain_result(
+                    self._format_open_insufficient_text(self._db_get_balance(group_id, user_id), price, len(choose_slots))
+                )
+                return
+            if status != "ok":
+                yield event.plain_result("当前开盒人数较多，请稍后重试。")
+                return
             self._set_last_open_ts(cooldown_key, now_ts)
 
-            item = category["items"][selected]
-            self._db_add_inventory_item(group_id, user_id, category_id, item["name"], 1)
-            prize_image = item.get("image")
-            msg = (
-                f"你选择了第 {choose_slot} 号盲盒，开启结果：\n"
-                f"所属种类：{category['id']}\n"
-                f"奖品名称：{item['name']}\n"
-                f"当前卡池剩余：{len(remain_items)}\n"
-                f"当前可选序号：{self._format_slots(remain_slots)}\n"
-                f"本次花费：{price} 元，当前余额：{self._db_get_balance(group_id, user_id)} 元\n"
-                f"当前群：{group_id}"
+            if len(selected) == 1:
+                item = category.items[selected[0]]
+                msg = (
+                    f"你选择了第 {choose_slots[0]} 号盲盒，开启结果：\n"
+                    f"所属种类：{category.id}\n"
+                    f"奖品名称：{item.name}\n"
+                    f"当前卡池剩余：{remain_count}\n"
+                    f"当前可选序号：{self._format_slots(remain_slots)}\n"
+                    f"本次花费：{price} 元，当前余额：{new_balance} 元\n"
+                    f"当前群：{group_id}"
+                )
+                for r in await self._build_results_with_optional_image(event, msg, category.image_path(item.item_id)):
+                    yield r
+                return
+
+            lines = [f"你一次开启了 {len(selected)} 个盲盒，开启结果："]
+            for slot, item_id in zip(choose_slots, selected):
+                lines.append(f"- 第 {slot} 号：{category.items[item_id].name}")
+            lines.extend(
+                [
+                    f"所属种类：{category.id}",
+                    f"当前卡池剩余：{remain_count}",
+                    f"当前可选序号：{self._format_slots(remain_slots)}",
+                    f"本次花费：{total_price} 元（{len(selected)} × {price} 元），当前余额：{new_balance} 元",
+                    f"当前群：{group_id}",
+                ]
             )
-            for r in self._build_results_with_optional_image(event, msg, prize_image):
+            images = [category.image_path(item_id) for item_id in selected]
+            for r in await self._build_results_with_image_list(event, "\n".join(lines), images):
                 yield r
             return
 
@@ -353,10 +623,10 @@ class ArknightsBlindBoxPlugin(Star):
             if not category_id or category_id not in self.categories:
                 yield event.plain_result("请使用：/方舟盲盒 刷新 <种类ID>")
                 return
-            self._db_reset_category_state(category_id, self.categories[category_id])
-            remain_items, remain_slots = self._db_get_category_state(category_id)
+            self._db_reset_category_state(category_id, self.categories[category_id], group_id)
+            remain_items, remain_slots = self._db_get_category_state(category_id, group_id)
             yield event.plain_result(
-                f"【{self.categories[category_id]['id']}】已刷新。\n"
+                f"【{self.categories[category_id].id}】已刷新。\n"
                 f"卡池剩余：{len(remain_items)}\n"
                 f"可选序号：{self._format_slots(remain_slots)}"
             )
@@ -370,12 +640,15 @@ class ArknightsBlindBoxPlugin(Star):
             identity = self._get_identity(event)
             assert identity is not None
             group_id, user_id = identity
-            remain_items, remain_slots = self._db_get_category_state(category_id)
+            remain_items, remain_slots = self._db_get_category_state(category_id, group_id)
             category = self.categories[category_id]
+            draw_info = self._db_get_pool_draw_info(category_id, group_id)
+            draw_text = self._format_draw_info(draw_info, user_id in self._get_admin_ids())
             yield event.plain_result(
-                f"【{category['id']}】\n"
-                f"卡池状态：{len(remain_items)}/{len(category['items'])}\n"
-                f"序号状态：{len(remain_slots)}/{category['slot_total']}\n"
+                f"【{category.id}】\n"
+                f"卡池状态：{len(remain_items)}/{category.item_count}\n"
+                f"序号状态：{len(remain_slots)}/{category.slot_total}\n"
+                f"{draw_text}"
                 f"单抽价格：{self._format_price_text(self._get_category_price(category_id))}\n"
                 f"你的余额：{self._db_get_balance(group_id, user_id)}\n"
                 f"当前群：{group_id}"
@@ -391,15 +664,15 @@ class ArknightsBlindBoxPlugin(Star):
 
     def _handle_admin_command(self, event: AstrMessageEvent, args: List[str]):
         if not args:
-            return [event.plain_result("管理员指令：\n- 管理员 列表|添加|移除 <user_id>\n- 特殊定价 <种类ID> <金额>\n- 余额 <user_id> <金额> [group_id]\n- 黑名单 列表|添加|移除 <user_id>")]
+            return [event.plain_result("管理员指令：\n- 管理员 列表|添加|移除 <user_id>\n- 特殊定价 <种类ID> <金额>\n- 余额 <user_id> <金额|+N|-N> [group_id]\n- 黑名单 列表|添加|移除 <user_id>\n- 性能 <次数> [内存]|状态|停止\n- 报告\n- 维护\n- 备份 [列表]\n- 导出 [group_id|全部]\n- 导入 <文件名> [目标group_id]")]
 
         identity = self._get_identity(event)
         if identity is None:
             return [event.plain_result("无法识别你的账号ID，无法执行管理员操作。")]
-        _, current_user_id = identity
+        current_group_id, current_user_id = identity
         admins = self._get_admin_ids()
         action = args[0]
-        action_alias = {"list": "列表", "add": "添加", "remove": "移除", "setprice": "特殊定价", "setbalance": "余额", "blacklist": "黑名单"}
+        action_alias = {"list": "列表", "add": "添加", "remove": "移除", "setprice": "特殊定价", "setbalance": "余额", "blacklist": "黑名单", "profile": "性能", "report": "报告", "maintain": "维护", "maintenance": "维护"}
         action = action_alias.get(action, action)
 
         if action == "列表":
@@ -437,7 +710,7 @@ class ArknightsBlindBoxPlugin(Star):
             category_id, amount = args[1], args[2]
             if category_id not in self.categories:
                 return [event.plain_result(f"不存在种类 `{category_id}`")]
-            if self.categories[category_id]["box_type"] != "special":
+            if self.categories[category_id].box_type != "special":
                 return [event.plain_result("该种类不是特殊盒。")]
             if not amount.isdigit() or int(amount) < 0:
                 return [event.plain_result("金额必须是非负整数。")]
@@ -449,17 +722,23 @@ class ArknightsBlindBoxPlugin(Star):
 
         if action == "余额":
             if len(args) < 3:
-                return [event.plain_result("用法：/方舟盲盒 管理员 余额 <user_id> <金额> [group_id]")]
+                return [event.plain_result("用法：/方舟盲盒 管理员 余额 <user_id> <金额|+N|-N> [group_id]")]
             if current_user_id not in admins:
                 return [event.plain_result("仅管理员可设置用户余额。")]
             if not bool(self.runtime_config.get("admin_balance_set_enabled", True)):
                 return [event.plain_result("WebUI 已关闭管理员余额设置功能。")]
             target_user_id, amount = args[1], args[2]
             target_group_id = args[3] if len(args) > 3 else identity[0]
-            if not amount.isdigit() or int(amount) < 0:
-                return [event.plain_result("金额必须是非负整数。")]
+            is_delta = amount[:1] in {"+", "-"} and amount[1:].isdigit()
+            if not is_delta and (not amount.isdigit() or int(amount) < 0):
+                return [event.plain_result("金额必须是非负整数，或使用 +N / -N 增减余额。")]
             if self._db_get_user(target_group_id, target_user_id) is None:
                 return [event.plain_result(f"用户 {target_user_id} 在群 {target_group_id} 未注册。")]
+            if is_delta:
+                new_balance = self._db_adjust_balance(target_group_id, target_user_id, int(amount))
+                if new_balance is None:
+                    return [event.plain_result(f"调整失败：用户 {target_user_id} 余额不足以扣除 {amount[1:]} 元。")]
+                return [event.plain_result(f"已调整余额：群 {target_group_id} 用户 {target_user_id} {amount} 元，当前 {new_balance} 元")]
             self._db_update_balance(target_group_id, target_user_id, int(amount))
             return [event.plain_result(f"已设置余额：群 {target_group_id} 用户 {target_user_id} = {amount} 元")]
 
@@ -491,8 +770,124 @@ class ArknightsBlindBoxPlugin(Star):
                 return [event.plain_result(f"已移出黑名单：{target}")]
             return [event.plain_result("未知黑名单指令。")]
 
+        if action == "性能":
+            if current_user_id not in admins:
+                return [event.plain_result("仅管理员可进行性能采样。")]
+            if len(args) < 2:
+                return [event.plain_result("用法：/方舟盲盒 管理员 性能 <次数> [内存] 或 /方舟盲盒 管理员 性能 状态|停止")]
+            sub_action = {"status": "状态", "stop": "停止"}.get(args[1].lower(), args[1])
+            if sub_action == "状态":
+                if self._profiler is None or not self._profiler.active:
+                    return [event.plain_result("当前没有进行中的性能采样。")]
+                return [event.plain_result(self._profiler.status_text())]
+            if sub_action == "停止":
+                if self._profiler is None or not self._profiler.active:
+                    return [event.plain_result("当前没有进行中的性能采样。")]
+                return [event.plain_result(self._finish_profiler())]
+            if not sub_action.isdigit() or int(sub_action) <= 0:
+                return [event.plain_result("采样次数必须是正整数。")]
+            if self._profiler is not None and self._profiler.active:
+                return [event.plain_result(f"{self._profiler.status_text()}\n如需重新开始请先发送：/方舟盲盒 管理员 性能 停止")]
+            trace_memory = len(args) > 2 and args[2].lower() in {"内存", "mem", "memory", "tracemalloc"}
+            self._profiler = CommandProfiler(self.profile_dir, int(sub_action), trace_memory=trace_memory)
+            mode = "cProfile + tracemalloc" if trace_memory else "cProfile"
+            return [event.plain_result(f"已开始性能采样：接下来 {sub_action} 次指令（模式：{mode}）\n结果将写入：{self.profile_dir}")]
+
+        if action == "报告":
+            if current_user_id not in admins:
+                return [event.plain_result("仅管理员可查看运行报告。")]
+            return [event.plain_result(self._build_admin_report_text())]
+
+        if action == "维护":
+            if current_user_id not in admins:
+                return [event.plain_result("仅管理员可执行数据库维护。")]
+            convert = len(args) > 1 and args[1] in {"完整", "full"}
+            if not self._start_maintenance(convert):
+                return [event.plain_result("已有数据库维护正在进行，请稍后查看 管理员 报告。")]
+            note = "（含一次完整 VACUUM，期间其他指令可能因数据库繁忙而失败）" if convert else ""
+            return [event.plain_result(f"已开始在后台维护数据库{note}，完成后结果会写入日志并显示在 管理员 报告 中。")]
+
+        if action in {"备份", "backup"}:
+            if current_user_id not in admins:
+                return [event.plain_result("仅管理员可执行数据库备份。")]
+            if len(args) > 1 and args[1] in {"列表", "list"}:
+                return [event.plain_result(self._build_backup_list_text())]
+            if not self._start_backup():
+                return [event.plain_result("已有备份正在进行，请稍后查看 管理员 报告。")]
+            return [event.plain_result("已开始在后台备份数据库，完成后结果会写入日志并显示在 管理员 报告 中。")]
+
+        if action in {"导出", "export"}:
+            if current_user_id not in admins:
+                return [event.plain_result("仅管理员可导出经济数据。")]
+            scope = args[1] if len(args) > 1 else current_group_id
+            group_id = "" if scope in {"全部", "all"} else scope
+            if not self._start_transfer("导出", self._run_storage_export, group_id):
+                return [event.plain_result("已有导出/导入正在进行，请稍后查看 管理员 报告。")]
+            target = f"群 {group_id}" if group_id else "全部群"
+            return [event.plain_result(f"已开始在后台导出{target}的经济数据（JSONL），文件保存在：{self.export_dir}")]
+
+        if action in {"导入", "import"}:
+            if current_user_id not in admins:
+                return [event.plain_result("仅管理员可导入经济数据。")]
+            if len(args) < 2:
+                return [event.plain_result(self._build_export_list_text())]
+            path = self.export_dir / Path(args[1]).name
+            if not path.is_file():
+                return [event.plain_result(f"找不到导出文件：{path.name}\n\n{self._build_export_list_text()}")]
+            target_group = args[2] if len(args) > 2 else ""
+            if not self._start_transfer("导入", self._run_storage_import, path, target_group):
+                return [event.plain_result("已有导出/导入正在进行，请稍后查看 管理员 报告。")]
+            return [event.plain_result(f"已开始在后台导入 {path.name}，完成后结果会写入日志并显示在 管理员 报告 中。")]
+
         return [event.plain_result("未知管理员指令。")]
 
+    def _build_admin_report_text(self) -> str:
+        lines = ["【运行报告】", f"已加载种类数：{len(self.categories)}"]
+        cache = self._get_image_byte_cache()
+        lines.append(cache.stats_text() if cache is not None else "图片内存缓存：未开启")
+        lines.append(self._item_store.stats_text())
+        lines.append(f"最近一次资源扫描：{self._last_scan_summary or '尚未执行'}")
+        if self._profiler is not None and self._profiler.active:
+            lines.append(self._profiler.status_text())
+        timings = self._startup_timings
+        startup_parts = [f"数据库就绪 {timings['schema']:.0f} ms"] if "schema" in timings else []
+        if "resources" in timings:
+            startup_parts.append(f"资源就绪 {timings['resources']:.0f} ms")
+        if "first_reply" in timings:
+            startup_parts.append(f"首次响应 {timings['first_reply']:.0f} ms")
+        lines.append(f"启动耗时：{'，'.join(startup_parts) if startup_parts else '未记录'}")
+        stats = self._view_stats
+        lines.append(
+            f"列表/市场视图：缓存命中 {stats['hit']} 次，重新渲染 {stats['render']} 次，并发合并 {stats['coalesced']} 次"
+        )
+        lines.append(self._admission.stats_text())
+        if self._maintenance_job is not None and not self._maintenance_job.done():
+            lines.append("最近一次数据库维护：正在进行")
+        else:
+            lines.append(f"最近一次数据库维护：{self._last_maintenance_summary or '本次运行尚未执行'}")
+        if self._backup_job is not None and not self._backup_job.done():
+            lines.append("最近一次数据库备份：正在进行")
+        else:
+            lines.append(f"最近一次数据库备份：{self._last_backup_summary or '本次运行尚未执行'}")
+        if self._transfer_job is not None and not self._transfer_job.done():
+            lines.append("最近一次导出/导入：正在进行")
+        else:
+            lines.append(f"最近一次导出/导入：{self._last_transfer_summary or '本次运行尚未执行'}")
+        return "\n".join(lines)
+
+
+    def _finish_profiler(self) -> str:
+        profiler = self._profiler
+        self._profiler = None
+        if profiler is None:
+            return "当前没有进行中的性能采样。"
+        try:
+            stats_path, summary_path = profiler.finish()
+        except Exception as ex:
+            logger.warning(f"[arknights_blindbox] 写入性能采样结果失败：{ex}")
+            return f"性能采样结果写入失败：{ex}"
+        logger.info(f"[arknights_blindbox] 性能采样完成：{stats_path}")
+        return f"性能采样已完成。\n统计文件：{stats_path}\n摘要文件：{summary_path}"
 
     def _extract_command_args(self, raw_message: str) -> List[str]:
         text = (raw_message or "").strip()
@@ -503,6 +898,7 @@ class ArknightsBlindBoxPlugin(Star):
             "/方舟盲盒重载资源": "重载资源",
             "/方舟盲盒帮助": "帮助",
             "/方舟盲盒列表": "列表",
+            "/方舟盲盒搜索": "搜索",
             "/方舟盲盒注册": "注册",
             "/方舟盲盒钱包": "钱包",
             "/方舟盲盒库存": "库存",
@@ -523,30 +919,160 @@ class ArknightsBlindBoxPlugin(Star):
             "2) /方舟盲盒 钱包\n"
             "3) /方舟盲盒 库存\n"
             "4) /方舟盲盒 列表\n"
-            "5) /方舟盲盒 市场 [种类ID]\n"
-            "6) /方舟盲盒 市场 上架 <种类ID> <奖品名> <价格> [数量]\n"
-            "7) /方舟盲盒 市场 购买 <种类ID> <奖品名> [数量]\n"
-            "8) /方舟盲盒 选择 <种类ID>\n"
-            "9) /方舟盲盒 开 <序号>\n"
-            "10) /方舟盲盒 状态 [种类ID]\n"
-            "11) /方舟盲盒 刷新 [种类ID]\n"
-            "12) /方舟盲盒 重载资源\n"
-            "13) /方舟盲盒 管理员 <列表|添加|移除|特殊定价|余额|黑名单> ..."
+            "5) /方舟盲盒 搜索 <关键字>\n"
+            "6) /方舟盲盒 排行 [余额|收藏|开盒]\n"
+            "7) /方舟盲盒 市场 [种类ID]\n"
+            "8) /方舟盲盒 市场 上架 <种类ID> <奖品名> <价格> [数量]\n"
+            "9) /方舟盲盒 市场 购买 <种类ID> <奖品名> [数量]\n"
+            "10) /方舟盲盒 市场 走势 <种类ID> <奖品名> [天数]\n"
+            "11) /方舟盲盒 选择 <种类ID>\n"
+            "12) /方舟盲盒 开 <序号> [序号...] | 十连 | 全部\n"
+            "13) /方舟盲盒 状态 [种类ID]\n"
+            "14) /方舟盲盒 刷新 [种类ID]\n"
+            "15) /方舟盲盒 重载资源\n"
+            "16) /方舟盲盒 管理员 <列表|添加|移除|特殊定价|余额|黑名单|性能|报告|维护|备份|导出|导入> ..."
+        )
+
+    def _build_leaderboard_text(self, group_id: str, user_id: str, metric: str) -> str:
+        label, unit = self.LEADERBOARD_LABELS[metric]
+        rows = self._db_get_leaderboard(group_id, metric, self.LEADERBOARD_SIZE)
+        if not rows:
+            return f"本群暂无{label}排行数据。\n当前群：{group_id}"
+        lines = [f"【{label}排行】前 {len(rows)} 名："]
+        rank = 0
+        last_value = None
+        for index, (uid, value) in enumerate(rows, start=1):
+            if value != last_value:
+                rank, last_value = index, value
+            marker = "（你）" if uid == user_id else ""
+            lines.append(f"{rank}. {uid}{marker}：{value} {unit}")
+        if metric == "balance":
+            mine = self._db_get_balance(group_id, user_id)
+        else:
+            collection, opens = self._db_get_user_stats(group_id, user_id)
+            mine = collection if metric == "collection" else opens
+        lines.append(f"\n你的{label}：{mine if mine is not None else 0} {unit}")
+        lines.append(f"当前群：{group_id}")
+        return "\n".join(lines)
+
+    def _bump_view_generation(self, kind: str, scope: str = ""):
+        key = (kind, scope)
+        self._view_generations[key] = self._view_generations.get(key, 0) + 1
+
+    def _view_stamp(self, group_id: str, with_listings: bool) -> Tuple:
+        gens = self._view_generations
+        date_key, _ = self._utc8_date_hour()
+        return (
+            date_key,
+            gens.get(("config", ""), 0),
+            gens.get(("categories", ""), 0),
+            gens.get(("pool", self._get_pool_group_id(group_id)), 0),
+            gens.get(("listing", group_id), 0) if with_listings else 0,
         )
 
-    def _build_category_list_text(self) -> str:
+    def _on_loop_thread(self) -> bool:
+        """Shared caches are only written from the event loop; worker-thread renders just read them."""
+        return threading.get_ident() == self._loop_thread_id
+
+    def _get_cached_view(self, view: str, group_id: str, arg: str, stamp: Tuple, render) -> str:
+        # Other processes can change pools and listings behind our back, so only cache in single-process mode.
+        if not self._use_local_state_cache() or not self._on_loop_thread():
+            return render()
+        key = (view, group_id, arg)
+        cached = self._lookup_view(key, stamp)
+        if cached is not None:
+            return cached
+        self._view_stats["render"] += 1
+        text = render()
+        self._store_view(key, stamp, text)
+        return text
+
+    def _lookup_view(self, key: Tuple[str, str, str], stamp: Tuple) -> Optional[str]:
+        cached = self._view_cache.get(key)
+        if cached is None or cached[0] != stamp:
+            return None
+        self._view_cache.move_to_end(key)
+        self._view_stats["hit"] += 1
+        return cached[1]
+
+    def _store_view(self, key: Tuple[str, str, str], stamp: Tuple, text: str):
+        # The argument comes straight from the user; only known categories (and "" for overviews) are kept.
+        if key[2] and key[2] not in self.categories:
+            return
+        self._view_cache[key] = (stamp, text)
+        self._view_cache.move_to_end(key)
+        while len(self._view_cache) > self.VIEW_CACHE_SIZE:
+            self._view_cache.popitem(last=False)
+
+    async def _read_view_text(self, view: str, group_id: str, arg: str, render) -> str:
+        """Serves a read-only view, sharing one computation among concurrent identical requests.
+
+        On sqlite ``render`` runs in a worker thread, which only reads the shared caches;
+        the result is published to the view cache here on the loop, and only if nothing
+        it depends on changed while it was being rendered.
+        """
+        key = (view, group_id, arg)
+        stamp = self._view_stamp(group_id, with_listings=view == "market")
+        if self._use_local_state_cache():
+            cached = self._lookup_view(key, stamp)
+            if cached is not None:
+                return cached
+        pending = self._inflight_reads.get(key)
+        if pending is not None:
+            self._view_stats["coalesced"] += 1
+            return await asyncio.shield(pending)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight_reads[key] = future
+        try:
+            self._view_stats["render"] += 1
+            if self.storage.engine == "sqlite":
+                # Render off the event loop so identical requests arriving meanwhile can join this one.
+                text = await asyncio.to_thread(render)
+            else:
+                text = render()
+            if self._use_local_state_cache() and stamp == self._view_stamp(group_id, with_listings=view == "market"):
+                self._store_view(key, stamp, text)
+            future.set_result(text)
+            return text
+        except Exception as ex:
+            future.set_exception(ex)
+            # Mark retrieved so a flight nobody joined does not log "exception was never retrieved".
+            future.exception()
+            raise
+        finally:
+            if not future.done():
+                future.cancel()
+            if self._inflight_reads.get(key) is future:
+                del self._inflight_reads[key]
+
+    def _build_category_list_text(self, group_id: str = "") -> str:
+        stamp = self._view_stamp(group_id, with_listings=False)
+        return self._get_cached_view("list", group_id, "", stamp, lambda: self._render_category_list_text(group_id))
+
+    def _render_category_list_text(self, group_id: str = "") -> str:
         if not self.categories:
             return "当前未发现盲盒资源。请先在 resources/number_box 或 resources/special_box 下放入资源。"
+        states = self._db_get_category_states(list(self.categories.keys()), group_id)
         lines = ["可用盲盒种类："]
         for category_id, category in self.categories.items():
-            remain_items, remain_slots = self._db_get_category_state(category_id)
+            remain_items, remain_slots = states.get(category_id, ([], []))
             lines.append(
-                f"- {category_id}（类型: {category['box_type']}，价格: {self._format_price_text(self._get_category_price(category_id))}，"
-                f"卡池: {len(remain_items)}/{len(category['items'])}，序号: {len(remain_slots)}/{category['slot_total']}）"
+                f"- {category_id}（类型: {category.box_type}，价格: {self._format_price_text(self._get_category_price(category_id))}，"
+                f"卡池: {len(remain_items)}/{category.item_count}，序号: {len(remain_slots)}/{category.slot_total}）"
             )
         lines.append("\n使用：/方舟盲盒 选择 <种类ID>")
         return "\n".join(lines)
 
+    def _build_search_text(self, keyword: str) -> str:
+        matches = search_name_index(self.item_name_index, keyword, limit=10)
+        if not matches:
+            return f"未找到与 `{keyword}` 相关的奖品。"
+        lines = [f"与 `{keyword}` 相关的奖品："]
+        for category_id, _, name, slot_no, _ in matches:
+            lines.append(f"- [{category_id}] #{slot_no} {name}")
+        lines.append("\n查看价格：/方舟盲盒 市场 <种类ID>")
+        return "\n".join(lines)
+
     def _handle_market_command(self, event: AstrMessageEvent, group_id: str, user_id: str, args: List[str]):
         self._refresh_system_market(group_id)
 
@@ -554,8 +1080,7 @@ class ArknightsBlindBoxPlugin(Star):
             return [event.plain_result(self._build_market_text("", group_id))]
 
         action = str(args[0]).strip().lower()
-        alias = {"list": "列表", "sell": "上架", "buy": "购买"}
-        action = alias.get(action, action)
+        action = self.MARKET_ACTION_ALIASES.get(action, action)
 
         if action == "上架":
             if len(args) < 4:
@@ -569,9 +1094,9 @@ class ArknightsBlindBoxPlugin(Star):
             if price <= 0 or quantity <= 0:
                 return [event.plain_result("价格和数量必须大于 0。")]
 
-            item_id = self._find_item_id_by_name(category_id, item_name)
+            item_id, item_name = self._resolve_item_name(category_id, item_name)
             if not item_id:
-                return [event.plain_result(f"种类 {category_id} 中不存在奖品 `{item_name}`。")]
+                return [event.plain_result(f"种类 {category_id} 中不存在奖品 `{args[2]}`。")]
 
             if not self._db_consume_inventory_item(group_id, user_id, category_id, item_name, quantity):
                 return [event.plain_result(f"上架失败：库存不足（{item_name}）。")]
@@ -597,6 +1122,8 @@ class ArknightsBlindBoxPlugin(Star):
             quantity = int(args[3]) if len(args) > 3 and str(args[3]).isdigit() else 1
             if quantity <= 0:
                 return [event.plain_result("购买数量必须大于 0。")]
+            _, resolved_name = self._resolve_item_name(category_id, item_name)
+            item_name = resolved_name or item_name
 
             listing = self._pick_listing_for_buy(group_id, category_id, item_name)
             if not listing:
@@ -604,21 +1131,59 @@ class ArknightsBlindBoxPlugin(Star):
             if listing["quantity"] < quantity:
                 return [event.plain_result(f"库存不足，当前可购买：{listing['quantity']}。")]
 
-            total_price = int(listing["price"]) * quantity
-            balance = self._db_get_balance(group_id, user_id) or 0
-            if balance < total_price:
+            status, new_balance, total_price = self._db_purchase_listing(int(listing["id"]), group_id, user_id, quantity)
+            if status == "insufficient":
+                balance = self._db_get_balance(group_id, user_id) or 0
                 return [event.plain_result(f"余额不足，需 {total_price} 元，当前余额 {balance} 元。")]
-
-            if not self._db_consume_market_listing(int(listing["id"]), quantity):
+            if status != "ok":
                 return [event.plain_result("购买失败：商品已被抢完，请重试。")]
+            return [event.plain_result(f"购买成功：{item_name} x{quantity}，花费 {total_price} 元，当前余额 {new_balance} 元")]
 
-            self._db_update_balance(group_id, user_id, balance - total_price)
-            self._db_add_inventory_item(group_id, user_id, category_id, item_name, quantity)
-            return [event.plain_result(f"购买成功：{item_name} x{quantity}，花费 {total_price} 元，当前余额 {balance-total_price} 元")]
+        if action == "走势":
+            if len(args) < 3:
+                return [event.plain_result("用法：/方舟盲盒 市场 走势 <种类ID> <奖品名> [天数]")]
+            category_id = args[1]
+            if category_id not in self.categories:
+                return [event.plain_result(f"不存在种类 `{category_id}`。")]
+            days = int(args[3]) if len(args) > 3 and str(args[3]).isdigit() else self.MARKET_TREND_DAYS
+            days = min(90, max(1, days))
+            item_id, item_name = self._resolve_item_name(category_id, args[2])
+            if not item_id:
+                return [event.plain_result(f"种类 [{category_id}] 中找不到奖品：{args[2]}")]
+            return [event.plain_result(self._build_market_trend_text(group_id, category_id, item_id, item_name, days))]
 
         category_id = args[0]
         return [event.plain_result(self._build_market_text(category_id, group_id))]
 
+    def _market_view_category(self, args: List[str]) -> Optional[str]:
+        """Category shown by a read-only ``市场`` request ("" for the overview), or None for sub-actions."""
+        if not args:
+            return ""
+        action = str(args[0]).strip().lower()
+        if self.MARKET_ACTION_ALIASES.get(action, action) in self.MARKET_SUB_ACTIONS:
+            return None
+        return args[0]
+
+    def _build_market_trend_text(self, group_id: str, category_id: str, item_id: str, item_name: str, days: int) -> str:
+        try:
+            self._db_rollup_market_trades()
+        except sqlite3.OperationalError as ex:
+            logger.warning(f"[arknights_blindbox] 成交记录汇总失败（数据库繁忙）：{ex}")
+        since_day = utc8_date_days_ago(days - 1)
+        rows = self._db_get_market_trade_daily(group_id, category_id, item_id, since_day)
+        if not rows:
+            return f"[{category_id}] {item_name} 近 {days} 天暂无成交记录。\n当前群：{group_id}"
+        lines = [f"【走势】[{category_id}] {item_name}（近 {days} 天）", "日期 | 开 | 高 | 低 | 收 | 均价 | 成交量"]
+        for day_key, open_price, high, low, close, volume, turnover, _ in rows:
+            avg = round(turnover / volume) if volume else close
+            lines.append(f"{day_key} | {open_price} | {high} | {low} | {close} | {avg} | {volume}")
+        first_open, last_close = rows[0][1], rows[-1][4]
+        if first_open > 0:
+            change = (last_close - first_open) / first_open * 100
+            lines.append(f"区间涨跌：{change:+.1f}%")
+        lines.append(f"当前群：{group_id}")
+        return "\n".join(lines)
+
     def _build_session_key(self, event: AstrMessageEvent) -> str:
         identity = self._get_identity(event)
         if identity is None:
@@ -733,22 +1298,35 @@ class ArknightsBlindBoxPlugin(Star):
     def _get_blacklist_user_ids(self) -> List[str]:
         return self._normalize_id_list(self.runtime_config.get("blacklist_user_ids", []))
 
-    def _is_blacklisted(self, event: AstrMessageEvent) -> bool:
-        identity = self._get_identity(event)
-        return bool(identity and identity[1] in self._get_blacklist_user_ids())
+    def _admit_command(self, identity: Optional[Tuple[str, str]]) -> str:
+        # Runs before any reload/sync, so rules are recompiled only when the last known config changed.
+        config_gen = self._view_generations.get(("config", ""), 0)
+        if config_gen != self._admission_config_gen:
+            self._admission.configure(
+                self._get_blacklist_user_ids(),
+                self._get_admin_ids(),
+                int(self.runtime_config.get("rate_limit_user_per_minute", 20)),
+                int(self.runtime_config.get("rate_limit_group_per_minute", 300)),
+            )
+            self._admission_config_gen = config_gen
+        if identity is None:
+            return ADMIT
+        return self._admission.admit(identity[0], identity[1])
 
 
     def _format_price_text(self, price: int) -> str:
         return f"{price} 元" if price > 0 else "待定"
 
-    def _get_inventory_unit_price(self, group_id: str, category_id: str, item_name: str) -> Tuple[Optional[int], str]:
+    def _get_inventory_unit_price(
+        self, group_id: str, category_id: str, item_name: str, pricing: Optional[PricingContext] = None
+    ) -> Tuple[Optional[int], str]:
         item_id = self._find_item_id_by_name(category_id, item_name)
-        price, _ = self._get_market_price_breakdown(group_id, category_id, item_id)
+        price, _ = self._get_market_price_breakdown(group_id, category_id, item_id, pricing)
         return (price, self._format_price_text(price)) if price > 0 else (None, "待定")
 
     def _get_category_price(self, category_id: str) -> int:
-        category = self.categories.get(category_id, {})
-        if category.get("box_type") == "number":
+        category = self.categories.get(category_id)
+        if category is not None and category.box_type == "number":
             return int(self.runtime_config.get("number_box_price", 25))
         if not category:
             if category_id.startswith("num"):
@@ -764,21 +1342,57 @@ class ArknightsBlindBoxPlugin(Star):
         return int(self.runtime_config.get("special_box_default_price", 0))
 
     def _find_item_id_by_name(self, category_id: str, item_name: str) -> str:
+        exact = self.item_name_index.get("by_category", {}).get(category_id, {})
+        return exact.get(str(item_name or "").strip(), "")
+
+    def _resolve_item_name(self, category_id: str, item_name: str) -> Tuple[str, str]:
         target = str(item_name or "").strip()
-        idx = self.resource_box_index.get(category_id, {})
-        for box in idx.get("boxes", []) if isinstance(idx, dict) else []:
-            if str(box.get("name", "")).strip() == target:
-                return str(box.get("item_id", ""))
+        item_id = self._find_item_id_by_name(category_id, target)
+        if item_id:
+            return item_id, target
+        matches = search_name_index(self.item_name_index, target, category_id=category_id, limit=2, min_score=0.5)
+        if not matches:
+            return "", ""
+        if len(matches) > 1 and matches[0][4] == matches[1][4]:
+            return "", ""
+        _, item_id, name, _, _ = matches[0]
+        return item_id, name
+
+
+    def _build_pricing_context(self, group_id: str, category_ids: Optional[List[str]] = None) -> PricingContext:
+        ids = list(category_ids) if category_ids is not None else list(self.categories.keys())
+        wanted = set(ids)
+        current_date, _ = self._utc8_date_hour()
+        multiplier_prefix = f"market_multiplier:{current_date}:"
+        if len(ids) == 1:
+            multiplier_prefix = f"{multiplier_prefix}{ids[0]}:"
+
+        states = self._db_get_category_states(ids, group_id)
+        listing_stats = {
+            key: value
+            for key, value in self._db_get_listing_stats(group_id, ids[0] if len(ids) == 1 else "").items()
+            if key[0] in wanted
+        }
 
-        category = self.categories.get(category_id, {})
-        items = category.get("items", {}) if isinstance(category, dict) else {}
-        for item_id, item in items.items():
-            if str(item.get("name", "")).strip() == target:
-                return item_id
-        return ""
+        return PricingContext(
+            date_str=current_date,
+            volatility=clamp_volatility(self.runtime_config.get("market_volatility", 0.2)),
+            scarcity_weight=clamp_non_negative_float(self.runtime_config.get("market_scarcity_weight", 0.8)),
+            remaining_items={cid: states.get(cid, ([], []))[0] for cid in ids},
+            stored_multipliers=self._db_get_kv_by_prefix(multiplier_prefix),
+            listing_stats=listing_stats,
+            listing_price_mode=self.runtime_config.get("market_listing_price_mode", "mean"),
+        )
 
+    def _flush_pricing_context(self, pricing: PricingContext):
+        if pricing.pending_kv:
+            self._db_set_kv_many(pricing.pending_kv)
+            pricing.stored_multipliers.update(pricing.pending_kv)
+            pricing.pending_kv = {}
 
-    def _get_market_price_breakdown(self, group_id: str, category_id: str, item_id: str = "") -> Tuple[int, str]:
+    def _get_market_price_breakdown(
+        self, group_id: str, category_id: str, item_id: str = "", pricing: Optional[PricingContext] = None
+    ) -> Tuple[int, str]:
         base_price = self._get_category_price(category_id)
         if base_price <= 0:
             return 0, "基准价待定"
@@ -787,59 +1401,67 @@ class ArknightsBlindBoxPlugin(Star):
         if not category:
             return base_price, f"基准价 {base_price}"
 
-        remain_items, _ = self._db_get_category_state(category_id)
-        total_items = len(category.get("items", {}))
-        volatility = clamp_volatility(self.runtime_config.get("market_volatility", 0.2))
-        scarcity_weight = clamp_non_negative_float(self.runtime_config.get("market_scarcity_weight", 0.8))
+        own_pricing = pricing is None
+        if pricing is None:
+            pricing = self._build_pricing_context(group_id, [category_id])
 
-        current_date, _ = self._utc8_date_hour()
+        total_items = category.item_count
         item_key = item_id or "_category_default_"
         market_multiplier = get_daily_market_multiplier_for_item(
-            date_str=current_date,
+            date_str=pricing.date_str,
             category_id=category_id,
             item_id=item_key,
-            volatility=volatility,
-            kv_getter=self._db_get_kv,
-            kv_setter=self._db_set_kv,
+            volatility=pricing.volatility,
+            kv_getter=pricing.kv_get,
+            kv_setter=pricing.kv_set,
         )
-        scarcity_multiplier = calc_scarcity_multiplier(len(remain_items), total_items, scarcity_weight)
+        remaining_count = len(pricing.remaining_items.get(category_id, []))
+        scarcity_multiplier = calc_scarcity_multiplier(remaining_count, total_items, pricing.scarcity_weight)
         price, detail = build_market_breakdown(
             base_price=base_price,
             market_multiplier=market_multiplier,
             scarcity_multiplier=scarcity_multiplier,
         )
-        user_prices = [
-            int(x["price"]) for x in self._db_list_market_listings(group_id, category_id)
-            if int(x.get("is_system", 0)) == 0 and (not item_id or str(x.get("item_id")) == item_id)
-        ]
-        if user_prices:
-            avg_user = sum(user_prices) / len(user_prices)
+        if own_pricing:
+            self._flush_pricing_context(pricing)
+        avg_user = pricing.user_listing_average(category_id, item_id)
+        if avg_user is not None:
             price = max(1, int(round((price * 0.7) + (avg_user * 0.3))))
-            detail = f"{detail}；用户上架均价影响后={price}"
+            avg_label = "用户上架量加权均价" if pricing.listing_price_mode == "weighted" else "用户上架均价"
+            detail = f"{detail}；{avg_label}影响后={price}"
         return price, detail
 
     def _build_market_text(self, category_id: str = "", group_id: str = "") -> str:
+        stamp = self._view_stamp(group_id, with_listings=True)
+        return self._get_cached_view(
+            "market", group_id, category_id, stamp, lambda: self._render_market_text(category_id, group_id)
+        )
+
+    def _render_market_text(self, category_id: str = "", group_id: str = "") -> str:
         if not self.categories:
             return "当前未发现盲盒资源。请先在 resources/number_box 或 resources/special_box 下放入资源。"
 
         if category_id:
             category = self.categories.get(category_id)
             if not category:
-                return f"不存在种类 `{category_id}`。\n\n{self._build_category_list_text()}"
+                return f"不存在种类 `{category_id}`。\n\n{self._build_category_list_text(group_id)}"
 
-            remain_items, _ = self._db_get_category_state(category_id)
+            pricing = self._build_pricing_context(group_id, [category_id])
+            remain_items = pricing.remaining_items.get(category_id, [])
             lines = [
                 f"【市场】{category_id}",
-                f"剩余盲盒数量：{len(remain_items)}/{len(category.get('items', {}))}",
+                f"剩余盲盒数量：{len(remain_items)}/{category.item_count}",
                 "单盒价格（按盲盒独立计算）：",
             ]
-            for item_id, item in sorted(category.get("items", {}).items(), key=lambda x: (x[1].get("slot_no", 0), x[0])):
-                price, detail = self._get_market_price_breakdown(group_id, category_id, item_id)
+            for item in sorted(category.items.values(), key=lambda x: (x.slot_no, x.item_id)):
+                item_id = item.item_id
+                price, detail = self._get_market_price_breakdown(group_id, category_id, item_id, pricing)
                 sold_text = "（已开出）" if item_id not in remain_items else ""
                 lines.append(
-                    f"- #{item.get('slot_no', 0)} {item.get('name', item_id)}：{self._format_price_text(price)} {sold_text}"
+                    f"- #{item.slot_no} {item.name}：{self._format_price_text(price)} {sold_text}"
                 )
                 lines.append(f"  · {detail}")
+            self._flush_pricing_context(pricing)
             listings = self._db_list_market_listings(group_id, category_id)
             if listings:
                 lines.append("\n当前在售：")
@@ -848,19 +1470,24 @@ class ArknightsBlindBoxPlugin(Star):
                     lines.append(f"- {row['item_name']} x{row['quantity']} | {row['price']} 元 | 来源：{seller}")
             return "\n".join(lines)
 
+        pricing = self._build_pricing_context(group_id)
         lines = ["【市场总览】"]
         for cid, category in self.categories.items():
-            remain_items, _ = self._db_get_category_state(cid)
-            price_list = [self._get_market_price_breakdown(group_id, cid, item_id)[0] for item_id in category.get("items", {}).keys()]
+            remain_items = pricing.remaining_items.get(cid, [])
+            price_list = [
+                self._get_market_price_breakdown(group_id, cid, item_id, pricing)[0]
+                for item_id in self._get_indexed_item_ids(cid)
+            ]
             valid = [p for p in price_list if p > 0]
             if valid:
                 price_text = f"{min(valid)}~{max(valid)} 元"
             else:
                 price_text = "待定"
             lines.append(
-                f"- {cid}（类型: {category['box_type']}，单盒价格区间: {price_text}，"
-                f"剩余: {len(remain_items)}/{len(category.get('items', {}))}）"
+                f"- {cid}（类型: {category.box_type}，单盒价格区间: {price_text}，"
+                f"剩余: {len(remain_items)}/{category.item_count}）"
             )
+        self._flush_pricing_context(pricing)
         system_cnt = len([x for x in self._db_list_market_listings(group_id) if int(x.get("is_system", 0)) == 1])
         lines.append(f"\n系统在售数量：{system_cnt}（每天 0 点刷新，最多 3 种）")
         lines.append("\n查看详情：/方舟盲盒 市场 <种类ID>")
@@ -868,6 +1495,13 @@ class ArknightsBlindBoxPlugin(Star):
         lines.append("购买：/方舟盲盒 市场 购买 <种类ID> <奖品名> [数量]")
         return "\n".join(lines)
 
+    def _get_indexed_item_ids(self, category_id: str) -> List[str]:
+        """Item ids from the in-memory box index, so overview pages never load item tables."""
+        entry = self.resource_box_index.get(category_id)
+        if entry is None:
+            return self.categories[category_id].item_ids
+        return [str(box.get("item_id", "")) for box in entry.get("boxes", [])]
+
     def _pick_listing_for_buy(self, group_id: str, category_id: str, item_name: str) -> Optional[dict]:
         rows = self._db_list_market_listings(group_id, category_id)
         target = str(item_name).strip()
@@ -878,23 +1512,34 @@ class ArknightsBlindBoxPlugin(Star):
 
     def _refresh_system_market(self, group_id: str):
         date_key, _ = self._utc8_date_hour()
+        refreshed_key = (date_key, self._view_generations.get(("listing", group_id), 0))
+        if self._use_local_state_cache() and self._system_market_refreshed.get(group_id) == refreshed_key:
+            return
+        self._refresh_system_market_listings(group_id, date_key)
+        self._system_market_refreshed[group_id] = (date_key, self._view_generations.get(("listing", group_id), 0))
+
+    def _refresh_system_market_listings(self, group_id: str, date_key: str):
         self._db_delete_expired_system_listings(group_id, date_key)
 
         existing = [x for x in self._db_list_market_listings(group_id) if int(x.get("is_system", 0)) == 1 and x.get("day_key") == date_key]
         if existing:
             return
 
-        all_items = []
-        for category_id, category in self.categories.items():
-            remain_items, _ = self._db_get_category_state(category_id)
-            for item_id in remain_items:
-                item = category.get("items", {}).get(item_id)
-                if item:
-                    all_items.append((category_id, item_id, str(item.get("name", item_id))))
+        pricing = self._build_pricing_context(group_id)
+        all_items = [
+            (category_id, item_id)
+            for category_id in self.categories
+            for item_id in pricing.remaining_items.get(category_id, [])
+        ]
 
         random.shuffle(all_items)
-        for category_id, item_id, item_name in all_items[:3]:
-            price, _ = self._get_market_price_breakdown(group_id, category_id, item_id)
+        # Names are looked up only for the picked items, so only their categories' item tables load.
+        for category_id, item_id in all_items[:3]:
+            item = self.categories[category_id].items.get(item_id)
+            if item is None:
+                continue
+            item_name = item.name
+            price, _ = self._get_market_price_breakdown(group_id, category_id, item_id, pricing)
             if price <= 0:
                 continue
             self._db_add_market_listing(
@@ -908,15 +1553,181 @@ class ArknightsBlindBoxPlugin(Star):
                 is_system=1,
                 day_key=date_key,
             )
+        self._flush_pricing_context(pricing)
 
-    def _build_results_with_optional_image(self, event: AstrMessageEvent, text: str, image: Optional[Path]):
+    async def _build_results_with_optional_image(self, event: AstrMessageEvent, text: str, image: Optional[Path]):
+        # Resizing/re-encoding and reading the bytes are Pillow and disk work; keep them off the event loop.
+        image = await asyncio.to_thread(self._prepare_send_image, image)
         image_str = str(image) if image else ""
+        reference_result = await self._build_media_reference_result(event, image)
+        if reference_result is not None:
+            return [reference_result, event.plain_result(text)]
+        cached_component = await asyncio.to_thread(self._build_cached_image_component, image)
+        if cached_component is not None and hasattr(event, "chain_result"):
+            return [event.chain_result([cached_component]), event.plain_result(text)]
         if image_str and hasattr(event, "image_result"):
             return [event.image_result(image_str), event.plain_result(text)]
         if image_str:
             return [event.plain_result(f"{text}\n图片：{image_str}")]
         return [event.plain_result(text)]
 
+    async def _build_results_with_image_list(self, event: AstrMessageEvent, text: str, images: List[Optional[Path]]):
+        images = [Path(v) for v in images if v]
+        if len(images) <= 1:
+            return await self._build_results_with_optional_image(event, text, images[0] if images else None)
+        # Compositing the grid decodes and resizes every image; keep it off the event loop.
+        grid = await asyncio.to_thread(self._build_image_grid, images)
+        if grid is not None:
+            return await self._build_results_with_optional_image(event, text, grid)
+        prepared = await asyncio.to_thread(lambda: [self._prepare_send_image(v) for v in images])
+        if Comp is not None and hasattr(event, "chain_result"):
+            components = await asyncio.to_thread(lambda: [self._build_cached_image_component(v) for v in prepared])
+            chain = [c or Comp.Image.fromFileSystem(str(v)) for c, v in zip(components, prepared)]
+            return [event.chain_result(chain), event.plain_result(text)]
+        if hasattr(event, "image_result"):
+            return [event.image_result(str(v)) for v in prepared] + [event.plain_result(text)]
+        return [event.plain_result(text + "\n图片：" + "\n".join(str(v) for v in prepared))]
+
+    def _build_image_grid(self, images: List[Path]) -> Optional[Path]:
+        if not pillow_available():
+            return None
+        fmt = normalize_image_format(self.runtime_config.get("image_format", "jpeg"))
+        quality = min(95, max(1, int(self.runtime_config.get("image_quality", 85))))
+        cell_edge = 320
+        columns = min(5, len(images))
+        try:
+            digests = [self._image_hash_memo.get(v) for v in images]
+            key = hashlib.sha1(f"{'|'.join(digests)}|{cell_edge}|{columns}|{quality}".encode("utf-8")).hexdigest()
+            grid_dir = self.image_cache_dir / "grids"
+            target = grid_dir / f"{key}{IMAGE_FORMATS[fmt][1]}"
+            if not target.exists():
+                build_image_grid(images, target, cell_edge, columns, quality, fmt)
+                self._prune_image_grids(grid_dir)
+            return target
+        except Exception as ex:
+            logger.warning(f"[arknights_blindbox] 拼接开盒图片失败：{ex}")
+            return None
+
+    def _prune_image_grids(self, grid_dir: Path):
+        # Grids are built in worker threads, so another prune may remove files while this one lists them.
+        files = []
+        for path in grid_dir.iterdir():
+            try:
+                if path.is_file():
+                    files.append((path.stat().st_mtime, path))
+            except OSError:
+                continue
+        files.sort()
+        for _, stale in files[: max(0, len(files) - self.BATCH_IMAGE_GRID_KEEP)]:
+            try:
+                stale.unlink()
+            except OSError:
+                pass
+
+    def _prepare_send_image(self, image: Optional[Path]) -> Optional[Path]:
+        if not image or not bool(self.runtime_config.get("image_optimize_enabled", True)):
+            return image
+        if not pillow_available():
+            if not self._image_pipeline_warned:
+                self._image_pipeline_warned = True
+                logger.warning("[arknights_blindbox] 未安装 Pillow，图片压缩已跳过，将直接发送原图。")
+            return image
+        params = (
+            max(0, int(self.runtime_config.get("image_max_edge", 1280))),
+            min(95, max(1, int(self.runtime_config.get("image_quality", 85)))),
+            normalize_image_format(self.runtime_config.get("image_format", "jpeg")),
+        )
+        pipeline = self._image_pipeline
+        if pipeline is None or pipeline.params != params:
+            pipeline = ImageDerivativeCache(self.image_cache_dir, *params)
+            self._image_pipeline = pipeline
+        try:
+            return pipeline.get(Path(image))
+        except Exception as ex:
+            logger.warning(f"[arknights_blindbox] 生成压缩图片失败（{image}）：{ex}")
+            return image
+
+    def register_media_uploader(self, uploader: MediaUploader):
+        """Enables media-id reuse for ``uploader.platform`` (see media_cache_service.MediaUploader)."""
+        self._media_uploaders[str(uploader.platform)] = uploader
+
+    async def _build_media_reference_result(self, event: AstrMessageEvent, image: Optional[Path]):
+        ttl_hours = max(0, int(self.runtime_config.get("media_cache_ttl_hours", 72)))
+        if not image or ttl_hours <= 0 or not hasattr(event, "chain_result"):
+            return None
+        uploader = self._media_uploaders.get(self._get_platform_name(event))
+        if uploader is None:
+            return None
+        try:
+            content_hash = self._image_hash_memo.get(Path(image))
+        except Exception:
+            return None
+        component = await self._media_refs.resolve(uploader, Path(image), content_hash, ttl_hours * 3600)
+        return event.chain_result([component]) if component is not None else None
+
+    def _get_platform_name(self, event: AstrMessageEvent) -> str:
+        getter = getattr(event, "get_platform_name", None)
+        if callable(getter):
+            try:
+                name = str(getter() or "").strip()
+                if name:
+                    return name
+            except Exception:
+                pass
+        return str(getattr(event, "platform", "") or "unknown")
+
+    def _get_image_byte_cache(self) -> Optional[ImageByteCache]:
+        budget_mb = max(0, int(self.runtime_config.get("image_memory_cache_mb", 0)))
+        if budget_mb <= 0:
+            self._image_byte_cache = None
+            return None
+        budget = budget_mb * 1024 * 1024
+        if self._image_byte_cache is None:
+            self._image_byte_cache = ImageByteCache(budget)
+        elif self._image_byte_cache.budget_bytes != budget:
+            self._image_byte_cache.resize(budget)
+        return self._image_byte_cache
+
+    def _build_cached_image_component(self, image: Optional[Path]):
+        if not image or Comp is None:
+            return None
+        cache = self._get_image_byte_cache()
+        if cache is None:
+            return None
+        try:
+            return Comp.Image.fromBase64(cache.get_base64(Path(image)))
+        except Exception as ex:
+            logger.warning(f"[arknights_blindbox] 读取图片缓存失败（{image}）：{ex}")
+            return None
+
+    def _parse_open_slots(self, tokens: List[str], remain_slots: List[int], remain_count: int) -> List[int]:
+        ordered = sorted(remain_slots)
+        if tokens[0] in self.BATCH_OPEN_ALL_WORDS:
+            return ordered[:remain_count]
+        if tokens[0] in self.BATCH_OPEN_TEN_WORDS:
+            return ordered[: min(10, remain_count)]
+        slots: List[int] = []
+        for token in tokens:
+            slot = int(token)
+            if slot not in slots:
+                slots.append(slot)
+        return slots
+
+    def _format_open_insufficient_text(self, balance: Optional[int], price: int, count: int) -> str:
+        if count <= 1:
+            return f"余额不足，当前余额：{balance} 元，当前单抽价格：{price} 元"
+        return f"余额不足，当前余额：{balance} 元，本次 {count} 抽共需 {price * count} 元（单抽 {price} 元）"
+
+    def _format_draw_info(self, draw_info: Optional[Tuple[int, int, int]], is_admin: bool) -> str:
+        if not draw_info:
+            return ""
+        seed, cursor, total = draw_info
+        # The seed replays the whole order, so players only see its hash until the pool is drawn out.
+        if is_admin or cursor >= total:
+            return f"抽取顺序：种子 {seed}，已抽 {cursor}/{total}\n"
+        digest = hashlib.sha256(str(seed).encode("ascii")).hexdigest()[:16]
+        return f"抽取顺序：已抽 {cursor}/{total}，种子 SHA-256 前缀 {digest}\n"
+
     def _format_slots(self, slots: List[int]) -> str:
         if not slots:
             return "无"
@@ -930,11 +1741,11 @@ class ArknightsBlindBoxPlugin(Star):
         self._runtime_config_mtime = self._safe_mtime(self.runtime_config_path)
 
     def _maybe_reload_runtime_data(self):
-        self._sync_legacy_resource_dirs()
         runtime_mtime = self._safe_mtime(self.runtime_config_path)
         if runtime_mtime > self._runtime_config_mtime:
             self.runtime_config = self._load_json(self.runtime_config_path, default=self.runtime_config)
             self._runtime_config_mtime = runtime_mtime
+            self._bump_view_generation("config")
             logger.info("[arknights_blindbox] 已自动重载 runtime_config.json")
 
     def _sync_runtime_config_from_context(self):
@@ -956,7 +1767,7 @@ class ArknightsBlindBoxPlugin(Star):
             return
 
         merged = dict(self.runtime_config)
-        for key in ["initial_balance", "number_box_price", "special_box_default_price", "admin_ids", "special_box_prices", "daily_gift_amount", "daily_gift_hour_utc8", "admin_balance_set_enabled", "open_cooldown_seconds", "blacklist_user_ids", "market_volatility", "market_scarcity_weight"]:
+        for key in ["initial_balance", "number_box_price", "special_box_default_price", "admin_ids", "special_box_prices", "daily_gift_amount", "daily_gift_hour_utc8", "admin_balance_set_enabled", "open_cooldown_seconds", "blacklist_user_ids", "market_volatility", "market_scarcity_weight", "image_optimize_enabled", "image_max_edge", "image_quality", "image_format", "image_memory_cache_mb", "media_cache_ttl_hours", "market_listing_price_mode", "pool_scope", "multi_process_mode", "storage_engine", "memory_snapshot_interval_seconds", "market_trade_retention_days", "maintenance_interval_hours", "rate_limit_user_per_minute", "rate_limit_group_per_minute", "backup_interval_hours", "backup_keep_count", "category_item_cache_size"]:
             if key in conf:
                 merged[key] = conf[key]
         if merged != self.runtime_config:
@@ -964,77 +1775,30 @@ class ArknightsBlindBoxPlugin(Star):
             self._save_json(self.runtime_config_path, self.runtime_config)
             logger.info("[arknights_blindbox] 已同步并保存 WebUI 插件配置")
 
-    def _refresh_categories_and_states(self, force_sync_legacy: bool = False):
-        if force_sync_legacy:
-            self._sync_legacy_resource_dirs()
-        scanned = self._scan_categories()
+    def _apply_scanned_categories(self, scanned: Dict[str, Category], resource_box_index: Dict[str, dict]):
+        capacity = max(1, int(self.runtime_config.get("category_item_cache_size", ITEM_TABLE_CACHE_SIZE)))
+        if capacity != self._item_store.capacity:
+            self._item_store.resize(capacity)
         self.categories = scanned
-        for category_id, category in scanned.items():
-            self._db_ensure_category_state(category_id, category)
-        self.resource_box_index = sync_box_index_file(self.resource_index_path, self.categories)
-
-    def _scan_categories(self) -> Dict[str, dict]:
-        scanner = getattr(resource_service_module, "scan_categories", None)
-        if callable(scanner):
-            return scanner(self.number_box_dir, self.special_box_dir, self.GUIDE_CANDIDATES)
-        return self._scan_categories_fallback()
-
-    def _scan_categories_fallback(self) -> Dict[str, dict]:
-        result: Dict[str, dict] = {}
-        for box_type, root in (("number", self.number_box_dir), ("special", self.special_box_dir)):
-            if not root.exists():
-                continue
-            for cat_dir in root.iterdir():
-                if not cat_dir.is_dir():
-                    continue
-                category_id = cat_dir.name
-                items, slots = self._parse_prize_items_fallback(cat_dir)
-                if not items or not slots:
-                    continue
-                guide = self._find_guide_image_fallback(cat_dir)
-                result[category_id] = {
-                    "id": category_id,
-                    "box_type": box_type,
-                    "guide_image": guide,
-                    "items": items,
-                    "slot_total": len(slots),
-                    "slots": sorted(slots),
-                    "signature": self._build_category_signature_fallback(list(items.keys()), slots),
-                }
+        self._db_ensure_category_states(scanned)
+        self.resource_box_index = resource_box_index
+        index_key = tuple((cid, c.signature) for cid, c in self.categories.items())
+        if index_key != self._item_name_index_key:
+            self.item_name_index = build_name_index(self.resource_box_index)
+            self._item_name_index_key = index_key
+            self._pool_state_cache.clear()
+            self._view_cache.clear()
+            self._bump_view_generation("categories")
+            self._ensured_pool_keys.clear()
+
+    def _scan_categories(self) -> Dict[str, Category]:
+        result = self._scanner.scan((("number", self.number_box_dir), ("special", self.special_box_dir)))
+        stats = self._scanner.last_stats
+        self._last_scan_summary = (
+            f"{len(result)} 个种类，重新解析 {stats['reparsed']:.0f} 个目录，耗时 {stats['elapsed_ms']:.0f} ms"
+        )
         return result
 
-    def _find_guide_image_fallback(self, cat_dir: Path) -> Optional[Path]:
-        for name in self.GUIDE_CANDIDATES:
-            p = cat_dir / name
-            if p.exists():
-                return p
-        return None
-
-    def _parse_prize_items_fallback(self, cat_dir: Path) -> Tuple[Dict[str, dict], List[int]]:
-        slots: List[int] = []
-        items: Dict[str, dict] = {}
-        pattern = re.compile(r"^(\d+)[-_](.+)$")
-        for f in sorted(cat_dir.iterdir()):
-            if not f.is_file():
-                continue
-            if f.name in self.GUIDE_CANDIDATES:
-                continue
-            if f.suffix.lower() not in {".jpg", ".jpeg", ".png", ".webp"}:
-                continue
-            m = pattern.match(f.stem)
-            if not m:
-                continue
-            slot_no = int(m.group(1))
-            display_name = m.group(2).strip() or f.stem
-            item_id = f.name
-            items[item_id] = {"name": display_name, "image": f, "slot_no": slot_no}
-            if slot_no not in slots:
-                slots.append(slot_no)
-        return items, sorted(slots)
-
-    def _build_category_signature_fallback(self, item_ids: List[str], slots: List[int]) -> str:
-        return "|".join(sorted(item_ids)) + "::" + ",".join(map(str, sorted(slots)))
-
     def _ensure_default_runtime_config(self):
         if self.runtime_config_path.exists():
             return
@@ -1051,6 +1815,24 @@ class ArknightsBlindBoxPlugin(Star):
             "blacklist_user_ids": [],
             "market_volatility": 0.2,
             "market_scarcity_weight": 0.8,
+            "image_optimize_enabled": True,
+            "image_max_edge": 1280,
+            "image_quality": 85,
+            "image_format": "jpeg",
+            "image_memory_cache_mb": 0,
+            "media_cache_ttl_hours": 72,
+            "market_listing_price_mode": "mean",
+            "pool_scope": "global",
+            "multi_process_mode": False,
+            "storage_engine": "sqlite",
+            "memory_snapshot_interval_seconds": 60,
+            "market_trade_retention_days": 30,
+            "maintenance_interval_hours": 24,
+            "rate_limit_user_per_minute": 20,
+            "rate_limit_group_per_minute": 300,
+            "backup_interval_hours": 24,
+            "backup_keep_count": 7,
+            "category_item_cache_size": 64,
         })
 
 
@@ -1076,9 +1858,11 @@ class ArknightsBlindBoxPlugin(Star):
                 dst = self.data_dir / file_name
                 if src.exists() and not dst.exists():
                     dst.parent.mkdir(parents=True, exist_ok=True)
-                    shutil.copy2(src, dst)
-
-        self._sync_legacy_resource_dirs()
+                    if src.suffix == ".db":
+                        # The legacy instance may still be writing; a plain file copy could be torn.
+                        db_online_backup(src, dst)
+                    else:
+                        shutil.copy2(src, dst)
 
     def _sync_legacy_resource_dirs(self):
         sub_dir_map = {
@@ -1103,57 +1887,236 @@ class ArknightsBlindBoxPlugin(Star):
                     shutil.copytree(src, dst, dirs_exist_ok=True)
 
     def _init_db(self):
-        init_db(self.db_path)
-        init_inventory_table(self.db_path)
+        engine = normalize_storage_engine(self.runtime_config.get("storage_engine", "sqlite"))
+        self.storage = create_storage(engine, self.db_path, self.memory_snapshot_path)
+        self.storage.init()
+        logger.info(f"[arknights_blindbox] 存储引擎：{self.storage.engine}")
+        counts = getattr(self.storage, "seeded_counts", None)
+        if counts is not None:
+            logger.info(
+                f"[arknights_blindbox] 未找到内存快照，已从 {self.db_path.name} 迁入："
+                f"钱包 {counts.get('wallet', 0)}，库存 {counts.get('inventory', 0)}，卡池 {counts.get('pool', 0)}，"
+                f"挂单 {counts.get('listing', 0)}，KV {counts.get('kv', 0)} 条（成交历史不迁移）"
+            )
+        elif (
+            self.storage.engine == "sqlite"
+            and self.memory_snapshot_path.exists()
+            and (not self.db_path.exists() or self.memory_snapshot_path.stat().st_mtime > self.db_path.stat().st_mtime)
+        ):
+            logger.warning(
+                f"[arknights_blindbox] {self.memory_snapshot_path.name} 比 {self.db_path.name} 新，"
+                "切回 sqlite 会丢失内存引擎期间的变更；请先在 memory 引擎下执行 管理员 导出 全部，再在 sqlite 下 管理员 导入"
+            )
 
     def _db_get_user(self, group_id: str, user_id: str):
-        return db_get_user(self.db_path, group_id, user_id)
+        return self.storage.get_user(group_id, user_id)
 
     def _db_get_balance(self, group_id: str, user_id: str) -> Optional[int]:
-        return db_get_balance(self.db_path, group_id, user_id)
+        return self.storage.get_balance(group_id, user_id)
 
     def _db_register_user(self, group_id: str, user_id: str, balance: int):
-        db_register_user(self.db_path, group_id, user_id, balance)
+        self.storage.register_user(group_id, user_id, balance)
 
     def _db_update_balance(self, group_id: str, user_id: str, balance: int):
-        db_update_balance(self.db_path, group_id, user_id, balance)
+        self.storage.update_balance(group_id, user_id, balance)
+
+    def _db_adjust_balance(self, group_id: str, user_id: str, delta: int) -> Optional[int]:
+        return self.storage.adjust_balance(group_id, user_id, delta)
 
     def _db_add_inventory_item(self, group_id: str, user_id: str, category_id: str, item_name: str, count: int = 1):
-        add_inventory_item(self.db_path, group_id, user_id, category_id, item_name, count)
+        self.storage.add_inventory_item(group_id, user_id, category_id, item_name, count)
 
     def _db_get_user_inventory(self, group_id: str, user_id: str):
-        return get_user_inventory(self.db_path, group_id, user_id)
+        return self.storage.get_user_inventory(group_id, user_id)
 
     def _db_get_user_inventory_by_category(self, group_id: str, user_id: str, category_id: str):
-        return get_user_inventory_by_category(self.db_path, group_id, user_id, category_id)
+        return self.storage.get_user_inventory_by_category(group_id, user_id, category_id)
 
     def _db_consume_inventory_item(self, group_id: str, user_id: str, category_id: str, item_name: str, count: int = 1) -> bool:
-        return consume_inventory_item(self.db_path, group_id, user_id, category_id, item_name, count)
+        return self.storage.consume_inventory_item(group_id, user_id, category_id, item_name, count)
 
-    def _db_ensure_category_state(self, category_id: str, category: dict):
-        db_ensure_category_state(self.db_path, category_id, category)
+    def _get_pool_group_id(self, group_id: str) -> str:
+        scope = str(self.runtime_config.get("pool_scope", "global")).strip().lower()
+        return group_id if group_id and scope in {"group", "per_group", "群"} else ""
 
-    def _db_get_category_state(self, category_id: str) -> Tuple[List[str], List[int]]:
-        return db_get_category_state(self.db_path, category_id)
+    def _ensure_pool_states(self, pool_group_id: str, category_ids: List[str]):
+        if not pool_group_id:
+            return
+        missing = {
+            cid: self.categories[cid]
+            for cid in category_ids
+            if cid in self.categories and (pool_group_id, cid) not in self._ensured_pool_keys
+        }
+        if not missing:
+            return
+        self.storage.ensure_category_states(missing, pool_group_id)
+        if self._on_loop_thread():
+            self._ensured_pool_keys.update((pool_group_id, cid) for cid in missing)
+
+    def _commit_open_with_retry(
+        self, group_id: str, user_id: str, category_id: str, choose_slots: List[int], unit_price: int
+    ) -> Tuple[str, List[str], int, List[int], Optional[int]]:
+        """(status, drawn item ids, remaining pool size, remaining slots, new balance)."""
+        pool_group_id = self._get_pool_group_id(group_id)
+        category = self.categories[category_id]
+        remaining = 0
+        slots: List[int] = []
+        for _ in range(self.OPEN_RETRY_LIMIT):
+            self._ensure_pool_states(pool_group_id, [category_id])
+            # The pool is stored pre-shuffled; opening takes the next items at the draw cursor.
+            selected, remaining, slots, version = self._db_get_draw_window(category_id, pool_group_id, len(choose_slots))
+            if version is None or any(slot not in slots for slot in choose_slots):
+                return "slot_taken", [], remaining, slots, None
+            if remaining < len(choose_slots):
+                return "pool_short", [], remaining, slots, None
+            remaining -= len(selected)
+            for slot in choose_slots:
+                slots.remove(slot)
+            try:
+                status, balance = self._db_commit_draw(
+                    group_id, user_id, pool_group_id, category_id, version, len(selected), slots,
+                    unit_price * len(choose_slots),
+                    [category.items[item_id].name for item_id in selected],
+                )
+            except sqlite3.OperationalError as ex:
+                logger.warning(f"[arknights_blindbox] 开盒写入失败（数据库繁忙）：{ex}")
+                return "busy", [], remaining, slots, None
+            if status == "ok":
+                cache_key = (pool_group_id, category_id)
+                cached = self._pool_state_cache.get(cache_key)
+                if cached is not None and cached[0][: len(selected)] == selected:
+                    # Advance the cached order instead of reading the whole pool back.
+                    self._pool_state_cache[cache_key] = (cached[0][len(selected):], list(slots))
+                else:
+                    self._pool_state_cache.pop(cache_key, None)
+                self._bump_view_generation("pool", pool_group_id)
+                return status, selected, remaining, slots, balance
+            if status == "insufficient":
+                return status, [], remaining, slots, None
+            self._pool_state_cache.pop((pool_group_id, category_id), None)
+            self._bump_view_generation("pool", pool_group_id)
+        logger.warning(f"[arknights_blindbox] 开盒并发冲突重试 {self.OPEN_RETRY_LIMIT} 次仍失败：{pool_group_id}:{category_id}")
+        return "busy", [], remaining, slots, None
+
+    def _use_local_state_cache(self) -> bool:
+        return not bool(self.runtime_config.get("multi_process_mode", False))
+
+    def _db_ensure_category_states(self, categories: Dict[str, Category]):
+        self.storage.ensure_category_states(categories)
+
+    def _db_get_draw_window(
+        self, category_id: str, pool_group_id: str, count: int
+    ) -> Tuple[List[str], int, List[int], Optional[int]]:
+        return self.storage.get_draw_window(category_id, count, pool_group_id)
+
+    def _db_commit_draw(
+        self,
+        group_id: str,
+        user_id: str,
+        pool_group_id: str,
+        category_id: str,
+        expected_version: int,
+        draw_count: int,
+        remaining_slots: List[int],
+        price: int,
+        item_names: List[str],
+    ) -> Tuple[str, Optional[int]]:
+        return self.storage.commit_draw(
+            group_id=group_id,
+            user_id=user_id,
+            pool_group_id=pool_group_id,
+            category_id=category_id,
+            expected_version=expected_version,
+            draw_count=draw_count,
+            remaining_slots=remaining_slots,
+            price=price,
+            item_names=item_names,
+        )
 
-    def _db_set_category_state(self, category_id: str, items: List[str], slots: List[int]):
-        signature = self.categories.get(category_id, {}).get("signature", "")
-        db_set_category_state(self.db_path, category_id, signature, items, slots)
+    def _db_get_pool_draw_info(self, category_id: str, group_id: str = "") -> Optional[Tuple[int, int, int]]:
+        return self.storage.get_pool_draw_info(category_id, self._get_pool_group_id(group_id))
+
+    def _db_get_category_state(self, category_id: str, group_id: str = "") -> Tuple[List[str], List[int]]:
+        pool_group_id = self._get_pool_group_id(group_id)
+        cached = self._pool_state_cache.get((pool_group_id, category_id)) if self._use_local_state_cache() else None
+        if cached is None:
+            self._ensure_pool_states(pool_group_id, [category_id])
+            cached = self.storage.get_category_state(category_id, pool_group_id)
+            if self._on_loop_thread():
+                self._pool_state_cache[(pool_group_id, category_id)] = cached
+        return list(cached[0]), list(cached[1])
+
+    def _db_get_category_states(self, category_ids: List[str], group_id: str = "") -> Dict[str, Tuple[List[str], List[int]]]:
+        pool_group_id = self._get_pool_group_id(group_id)
+        result: Dict[str, Tuple[List[str], List[int]]] = {}
+        missing: List[str] = []
+        use_cache = self._use_local_state_cache()
+        for cid in category_ids:
+            cached = self._pool_state_cache.get((pool_group_id, cid)) if use_cache else None
+            if cached is None:
+                missing.append(cid)
+            else:
+                result[cid] = (list(cached[0]), list(cached[1]))
+        if missing:
+            self._ensure_pool_states(pool_group_id, missing)
+            loaded = self.storage.get_category_states(missing, pool_group_id)
+            # A worker-thread read may predate a draw committed on the loop meanwhile; never cache it.
+            publish = self._on_loop_thread()
+            for cid, state in loaded.items():
+                if publish:
+                    self._pool_state_cache[(pool_group_id, cid)] = state
+                result[cid] = (list(state[0]), list(state[1]))
+        return result
+
+    def _db_set_category_state(self, category_id: str, items: List[str], slots: List[int], group_id: str = ""):
+        pool_group_id = self._get_pool_group_id(group_id)
+        category = self.categories.get(category_id)
+        signature = category.signature if category is not None else ""
+        self.storage.set_category_state(category_id, signature, items, slots, pool_group_id)
+        self._pool_state_cache[(pool_group_id, category_id)] = (list(items), sorted(int(v) for v in slots))
+        self._bump_view_generation("pool", pool_group_id)
+
+    def _db_reset_category_state(self, category_id: str, category: Category, group_id: str = ""):
+        self._db_set_category_state(category_id, category.item_ids, list(category.slots), group_id)
+
+    def _db_get_media_id(self, content_hash: str, platform: str) -> Optional[str]:
+        return self.storage.get_media_id(content_hash, platform)
 
-    def _db_reset_category_state(self, category_id: str, category: dict):
-        self._db_set_category_state(category_id, list(category["items"].keys()), list(category["slots"]))
+    def _db_set_media_id(self, content_hash: str, platform: str, media_id: str, ttl_seconds: int):
+        self.storage.set_media_id(content_hash, platform, media_id, ttl_seconds)
+
+    def _db_delete_media_id(self, content_hash: str, platform: str):
+        self.storage.delete_media_id(content_hash, platform)
 
     def _utc8_date_hour(self) -> Tuple[str, int]:
         return utc8_date_hour()
 
+    def _db_get_leaderboard(self, group_id: str, metric: str, limit: int) -> List[Tuple[str, int]]:
+        return self.storage.get_leaderboard(group_id, metric, limit)
+
+    def _db_get_user_stats(self, group_id: str, user_id: str) -> Tuple[int, int]:
+        return self.storage.get_user_stats(group_id, user_id)
+
     def _db_get_kv(self, key: str) -> Optional[str]:
-        return db_get_kv(self.db_path, key)
+        return self.storage.get_kv(key)
 
     def _db_set_kv(self, key: str, value: str):
-        db_set_kv(self.db_path, key, value)
+        self.storage.set_kv(key, value)
+
+    def _db_get_kv_by_prefix(self, prefix: str) -> Dict[str, str]:
+        return self.storage.get_kv_by_prefix(prefix)
+
+    def _db_get_listing_stats(self, group_id: str, category_id: str = "") -> Dict[Tuple[str, str], Tuple[int, int, int, int, int]]:
+        return self.storage.get_listing_stats(group_id, category_id)
+
+    def _db_set_kv_many(self, values: Dict[str, str]):
+        self.storage.set_kv_many(values)
 
     def _db_grant_daily_gift(self, amount: int) -> int:
-        return db_grant_daily_gift(self.db_path, amount)
+        return self.storage.grant_daily_gift(amount)
+
+    def _db_grant_daily_gift_once(self, amount: int, date_key: str) -> Optional[int]:
+        return self.storage.grant_daily_gift_once(amount, date_key)
 
     def _db_add_market_listing(
         self,
@@ -1167,8 +2130,7 @@ class ArknightsBlindBoxPlugin(Star):
         is_system: int,
         day_key: str,
     ):
-        db_add_market_listing(
-            self.db_path,
+        self.storage.add_market_listing(
             group_id,
             category_id,
             item_id,
@@ -1179,22 +2141,38 @@ class ArknightsBlindBoxPlugin(Star):
             is_system,
             day_key,
         )
+        self._bump_view_generation("listing", group_id)
 
     def _db_list_market_listings(self, group_id: str, category_id: str = "") -> List[dict]:
-        return db_list_market_listings(self.db_path, group_id, category_id)
+        return self.storage.list_market_listings(group_id, category_id)
 
     def _db_consume_market_listing(self, listing_id: int, quantity: int) -> bool:
-        return db_consume_market_listing(self.db_path, listing_id, quantity)
+        return self.storage.consume_market_listing(listing_id, quantity)
+
+    def _db_purchase_listing(self, listing_id: int, group_id: str, user_id: str, quantity: int) -> Tuple[str, Optional[int], int]:
+        day_key, _ = self._utc8_date_hour()
+        result = self.storage.purchase_listing(listing_id, group_id, user_id, quantity, day_key)
+        if result[0] == "ok":
+            self._bump_view_generation("listing", group_id)
+        return result
+
+    def _db_rollup_market_trades(self) -> Tuple[int, int]:
+        retention_days = max(1, int(self.runtime_config.get("market_trade_retention_days", 30)))
+        return self.storage.rollup_market_trades(retention_days)
+
+    def _db_get_market_trade_daily(self, group_id: str, category_id: str, item_id: str, since_day: str) -> List[Tuple]:
+        return self.storage.get_market_trade_daily(group_id, category_id, item_id, since_day)
 
     def _db_delete_expired_system_listings(self, group_id: str, day_key: str):
-        db_delete_expired_system_listings(self.db_path, group_id, day_key)
+        self.storage.delete_expired_system_listings(group_id, day_key)
+        self._bump_view_generation("listing", group_id)
 
     def _get_open_cooldown_seconds(self) -> int:
         value = int(self.runtime_config.get("open_cooldown_seconds", 10))
         return max(0, value)
 
     def _get_last_open_ts(self, cooldown_key: str) -> float:
-        if cooldown_key in self._last_open_ts:
+        if cooldown_key in self._last_open_ts and self._use_local_state_cache():
             return self._last_open_ts[cooldown_key]
         db_value = self._db_get_kv(f"last_open_ts:{cooldown_key}")
         if not db_value:
@@ -1222,11 +2200,225 @@ class ArknightsBlindBoxPlugin(Star):
         last_date = self._db_get_kv("last_daily_gift_date")
         if last_date == current_date:
             return False
-        affected = self._db_grant_daily_gift(amount)
-        self._db_set_kv("last_daily_gift_date", current_date)
+        affected = self._db_grant_daily_gift_once(amount, current_date)
+        if affected is None:
+            return False
         logger.info(f"[arknights_blindbox] 每日赠送已发放：日期={current_date} 金额={amount} 覆盖用户数={affected}")
         return True
 
+    async def _storage_snapshot_loop(self):
+        while True:
+            interval = max(5, int(self.runtime_config.get("memory_snapshot_interval_seconds", 60)))
+            await asyncio.sleep(interval)
+            try:
+                self.storage.snapshot()
+            except Exception as ex:
+                logger.warning(f"[arknights_blindbox] 内存存储快照失败：{ex}")
+
+    async def _market_rollup_loop(self):
+        while True:
+            await asyncio.sleep(self.MARKET_ROLLUP_INTERVAL_SECONDS)
+            try:
+                rolled, pruned = self._db_rollup_market_trades()
+                if rolled or pruned:
+                    logger.info(f"[arknights_blindbox] 成交记录汇总：新增 {rolled} 条，清理 {pruned} 条")
+            except Exception as ex:
+                logger.warning(f"[arknights_blindbox] 成交记录汇总任务异常：{ex}")
+
+    def _run_storage_maintenance(self, convert: bool = False) -> Dict[str, int]:
+        today, _ = self._utc8_date_hour()
+        open_ts_before = time.time() - max(86400, self._get_open_cooldown_seconds())
+        return self.storage.run_maintenance(
+            today,
+            utc8_date_days_ago(self.MAINTENANCE_KV_KEEP_DAYS - 1),
+            open_ts_before,
+            self.MAINTENANCE_BATCH_SIZE,
+            convert,
+        )
+
+    def _finish_maintenance(self, report: Dict[str, int], elapsed: float) -> str:
+        open_ts_before = time.time() - max(86400, self._get_open_cooldown_seconds())
+        for key in [k for k, ts in self._last_open_ts.items() if ts < open_ts_before]:
+            del self._last_open_ts[key]
+        self._db_set_kv("last_maintenance_ts", str(int(time.time())))
+        lines = [
+            f"数据库维护完成（耗时 {elapsed:.1f} 秒）：",
+            f"- 清理过期市场倍率记录：{report.get('kv_multiplier', 0)} 条",
+            f"- 清理过期开盒冷却记录：{report.get('kv_open_ts', 0)} 条",
+            f"- 清理过期/售罄挂单：{report.get('listings', 0)} 条",
+            f"- 清理过期图片媒体ID：{report.get('media', 0)} 条",
+        ]
+        if "size_before" in report:
+            before, after = report["size_before"], report["size_after"]
+            lines.append(
+                f"- 数据库大小：{before / 1048576:.2f} MB → {after / 1048576:.2f} MB（回收 {max(0, before - after) / 1048576:.2f} MB）"
+            )
+            if report.get("converted"):
+                lines.append("- 已将数据库切换为增量回收（auto_vacuum=INCREMENTAL）模式")
+            elif report.get("needs_conversion"):
+                lines.append(
+                    "- 数据库尚未启用增量回收，空间不会自动回收；请在空闲时发送 管理员 维护 完整 执行一次完整 VACUUM（会短暂锁库）"
+                )
+        summary = "\n".join(lines)
+        self._last_maintenance_summary = f"{time.strftime('%Y-%m-%d %H:%M:%S')} " + "；".join(v.lstrip("- ") for v in lines[1:])
+        logger.info(f"[arknights_blindbox] {summary}")
+        return summary
+
+    async def _run_maintenance(self, convert: bool = False) -> str:
+        started = time.time()
+        try:
+            if self.storage.engine == "sqlite":
+                # Batched deletes commit as they go, but VACUUM/optimize can still take a while on big files.
+                report = await asyncio.to_thread(self._run_storage_maintenance, convert)
+            else:
+                report = self._run_storage_maintenance(convert)
+        except sqlite3.OperationalError as ex:
+            # Busy: last_maintenance_ts is left alone, so the loop retries at its next check.
+            logger.warning(f"[arknights_blindbox] 数据库维护跳过（数据库繁忙），稍后重试：{ex}")
+            self._last_maintenance_summary = f"{time.strftime('%Y-%m-%d %H:%M:%S')} 数据库繁忙，稍后重试：{ex}"
+            return self._last_maintenance_summary
+        except Exception as ex:
+            logger.warning(f"[arknights_blindbox] 数据库维护失败：{ex}")
+            self._last_maintenance_summary = f"{time.strftime('%Y-%m-%d %H:%M:%S')} 失败：{ex}"
+            return self._last_maintenance_summary
+        return self._finish_maintenance(report, time.time() - started)
+
+    def _start_maintenance(self, convert: bool = False) -> bool:
+        if self._maintenance_job is not None and not self._maintenance_job.done():
+            return False
+        self._maintenance_job = asyncio.create_task(self._run_maintenance(convert))
+        return True
+
+    async def _maintenance_loop(self):
+        while True:
+            await asyncio.sleep(self.MAINTENANCE_CHECK_SECONDS)
+            interval_hours = float(self.runtime_config.get("maintenance_interval_hours", 24))
+            if interval_hours <= 0:
+                continue
+            try:
+                last_ts = float(self._db_get_kv("last_maintenance_ts") or 0)
+                if time.time() - last_ts < interval_hours * 3600:
+                    continue
+                if self._start_maintenance():
+                    await self._maintenance_job
+            except Exception as ex:
+                logger.warning(f"[arknights_blindbox] 数据库维护任务异常：{ex}")
+
+    def _run_storage_backup(self) -> Tuple[Path, Dict[str, int], int]:
+        target, report = self.storage.backup(self.backup_dir)
+        removed = rotate_backups(self.backup_dir, int(self.runtime_config.get("backup_keep_count", 7)))
+        return target, report, removed
+
+    async def _run_backup(self) -> str:
+        started = time.time()
+        try:
+            if self.storage.engine == "sqlite":
+                # The backup API copies page batches with short sleeps in between; keep it off the event loop.
+                target, report, removed = await asyncio.to_thread(self._run_storage_backup)
+            else:
+                target, report, removed = self._run_storage_backup()
+        except Exception as ex:
+            logger.warning(f"[arknights_blindbox] 数据库备份失败：{ex}")
+            self._last_backup_summary = f"{time.strftime('%Y-%m-%d %H:%M:%S')} 失败：{ex}"
+            return self._last_backup_summary
+        self._db_set_kv("last_backup_ts", str(int(time.time())))
+        self._last_backup_summary = (
+            f"{time.strftime('%Y-%m-%d %H:%M:%S')} {target.name}（{report['size'] / 1048576:.2f} MB，"
+            f"耗时 {time.time() - started:.1f} 秒，已校验，轮换删除 {removed} 个旧备份）"
+        )
+        logger.info(f"[arknights_blindbox] 数据库备份完成：{self._last_backup_summary}")
+        return self._last_backup_summary
+
+    def _start_backup(self) -> bool:
+        if self._backup_job is not None and not self._backup_job.done():
+            return False
+        self._backup_job = asyncio.create_task(self._run_backup())
+        return True
+
+    def _build_backup_list_text(self) -> str:
+        backups = list_backups(self.backup_dir)
+        if not backups:
+            return f"暂无备份。\n备份目录：{self.backup_dir}"
+        lines = [f"现有备份（{len(backups)} 个，保留最近 {int(self.runtime_config.get('backup_keep_count', 7))} 个）："]
+        for path in reversed(backups):
+            lines.append(f"- {path.name}（{path.stat().st_size / 1048576:.2f} MB）")
+        lines.append(f"备份目录：{self.backup_dir}")
+        return "\n".join(lines)
+
+    def _run_storage_export(self, group_id: str) -> Tuple[Path, Dict[str, int]]:
+        path = self.export_dir / export_file_name(group_id)
+        return path, write_jsonl(path, export_header(group_id), self.storage.export_records(group_id))
+
+    def _run_storage_import(self, path: Path, target_group: str) -> Tuple[Path, Dict[str, int]]:
+        header, records = read_jsonl(path)
+        source_group = str(header.get("group_id", ""))
+        if target_group and target_group != source_group:
+            if not source_group:
+                raise ValueError("全部群的导出文件不能指定目标群")
+            records = remap_group(records, source_group, target_group)
+        return path, self.storage.import_records(records)
+
+    async def _run_transfer(self, label: str, func, *args) -> str:
+        started = time.time()
+        try:
+            if self.storage.engine == "sqlite":
+                # Streams through cursors and chunked transactions; keep it off the event loop.
+                path, counts = await asyncio.to_thread(func, *args)
+            else:
+                path, counts = func(*args)
+        except Exception as ex:
+            logger.warning(f"[arknights_blindbox] 经济数据{label}失败：{ex}")
+            self._last_transfer_summary = f"{time.strftime('%Y-%m-%d %H:%M:%S')} {label}失败：{ex}"
+            return self._last_transfer_summary
+        finally:
+            if label == "导入":
+                # Imported rows bypassed the per-process caches, even when the import stopped halfway.
+                self._invalidate_local_caches()
+        self._last_transfer_summary = (
+            f"{time.strftime('%Y-%m-%d %H:%M:%S')} {label} {path.name}："
+            f"钱包 {counts.get('wallet', 0)}，库存 {counts.get('inventory', 0)}，卡池 {counts.get('pool', 0)}，"
+            f"挂单 {counts.get('listing', 0)}，KV {counts.get('kv', 0)} 条（耗时 {time.time() - started:.1f} 秒）"
+        )
+        logger.info(f"[arknights_blindbox] 经济数据{self._last_transfer_summary}")
+        return self._last_transfer_summary
+
+    def _start_transfer(self, label: str, func, *args) -> bool:
+        if self._transfer_job is not None and not self._transfer_job.done():
+            return False
+        self._transfer_job = asyncio.create_task(self._run_transfer(label, func, *args))
+        return True
+
+    def _invalidate_local_caches(self):
+        self._pool_state_cache.clear()
+        self._ensured_pool_keys.clear()
+        self._last_open_ts.clear()
+        self._view_cache.clear()
+        self._system_market_refreshed.clear()
+
+    def _build_export_list_text(self) -> str:
+        files = sorted(self.export_dir.glob("economy-*.jsonl")) if self.export_dir.exists() else []
+        if not files:
+            return f"暂无导出文件。\n导出目录：{self.export_dir}"
+        lines = ["用法：/方舟盲盒 管理员 导入 <文件名> [目标group_id]", "现有导出文件："]
+        for path in reversed(files):
+            lines.append(f"- {path.name}（{path.stat().st_size / 1048576:.2f} MB）")
+        return "\n".join(lines)
+
+    async def _backup_loop(self):
+        while True:
+            await asyncio.sleep(self.BACKUP_CHECK_SECONDS)
+            interval_hours = float(self.runtime_config.get("backup_interval_hours", 24))
+            if interval_hours <= 0:
+                continue
+            try:
+                last_ts = float(self._db_get_kv("last_backup_ts") or 0)
+                if time.time() - last_ts < interval_hours * 3600:
+                    continue
+                if self._start_backup():
+                    await self._backup_job
+            except Exception as ex:
+                logger.warning(f"[arknights_blindbox] 数据库备份任务异常：{ex}")
+
     async def _daily_gift_loop(self):
         while True:
             try:
@@ -1249,14 +2441,47 @@ class ArknightsBlindBoxPlugin(Star):
         path.parent.mkdir(parents=True, exist_ok=True)
         with path.open("w", encoding="utf-8") as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
+        if path == self.runtime_config_path:
+            self._bump_view_generation("config")
 
     def _safe_mtime(self, path: Path) -> float:
         return path.stat().st_mtime if path.exists() else 0
 
     async def terminate(self):
+        if self._profiler is not None:
+            self._finish_profiler()
         if self._daily_gift_task:
             self._daily_gift_task.cancel()
             self._daily_gift_task = None
+        if self._market_rollup_task:
+            self._market_rollup_task.cancel()
+            self._market_rollup_task = None
+        if self._maintenance_task:
+            self._maintenance_task.cancel()
+            self._maintenance_task = None
+        if self._backup_task:
+            self._backup_task.cancel()
+            self._backup_task = None
+        if self._maintenance_job and not self._maintenance_job.done():
+            self._maintenance_job.cancel()
+        self._maintenance_job = None
+        if self._backup_job and not self._backup_job.done():
+            self._backup_job.cancel()
+        self._backup_job = None
+        if self._transfer_job and not self._transfer_job.done():
+            self._transfer_job.cancel()
+        self._transfer_job = None
+        if self._startup_task and not self._startup_task.done():
+            self._startup_task.cancel()
+        self._startup_task = None
+        if self._rescan_task and not self._rescan_task.done():
+            self._rescan_task.cancel()
+        self._rescan_task = None
+        if self._snapshot_task:
+            self._snapshot_task.cancel()
+            self._snapshot_task = None
+        if self.storage is not None:
+            self.storage.close()
         self._save_json(self.session_path, self.sessions)
         self._save_json(self.runtime_config_path, self.runtime_config)
         logger.info("[arknights_blindbox] 插件已卸载，状态已保存。")
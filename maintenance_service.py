@@ -0,0 +1,107 @@
+"""Retention and compaction helpers for blind-box plugin."""
+
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict, Tuple
+
+try:
+    from .db_service import connect_db
+except Exception:
+    from db_service import connect_db
+
+
+MULTIPLIER_KV_PREFIX = "market_multiplier:"
+OPEN_TS_KV_PREFIX = "last_open_ts:"
+
+
+def prefix_upper_bound(prefix: str) -> str:
+    """Smallest string greater than every key starting with ``prefix`` (for index range scans)."""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def db_file_size(db_path: Path) -> int:
+    total = 0
+    for suffix in ("", "-wal"):
+        path = Path(f"{db_path}{suffix}")
+        if path.exists():
+            total += path.stat().st_size
+    return total
+
+
+def _delete_in_batches(conn: sqlite3.Connection, table: str, where: str, params: Tuple, batch_size: int) -> int:
+    """Deletes matching rows ``batch_size`` at a time, committing between batches to keep write locks short."""
+    batch_size = max(1, int(batch_size))
+    total = 0
+    while True:
+        cur = conn.execute(
+            f"DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} WHERE {where} LIMIT ?)",
+            params + (batch_size,),
+        )
+        conn.commit()
+        deleted = max(0, cur.rowcount)
+        total += deleted
+        if deleted < batch_size:
+            return total
+
+
+def db_run_maintenance(
+    db_path: Path,
+    *,
+    today: str,
+    multiplier_keep_from: str,
+    open_ts_before: float,
+    batch_size: int = 500,
+    convert: bool = False,
+) -> Dict[str, int]:
+    """Prunes stale KV keys, expired listings and media references, then compacts the file.
+
+    ``multiplier_keep_from`` is the oldest date whose market multipliers are kept; cooldown
+    timestamps older than ``open_ts_before`` are dropped. A database created before incremental
+    auto-vacuum is only switched over (one full VACUUM) when ``convert`` is set; otherwise
+    ``needs_conversion`` is reported. Returns per-step counters plus ``size_before`` /
+    ``size_after`` in bytes.
+    """
+    report: Dict[str, int] = {"size_before": db_file_size(db_path)}
+    conn = connect_db(db_path)
+    try:
+        report["kv_multiplier"] = _delete_in_batches(
+            conn,
+            "system_kv",
+            "k>=? AND k<?",
+            (MULTIPLIER_KV_PREFIX, f"{MULTIPLIER_KV_PREFIX}{multiplier_keep_from}"),
+            batch_size,
+        )
+        report["kv_open_ts"] = _delete_in_batches(
+            conn,
+            "system_kv",
+            "k>=? AND k<? AND CAST(v AS REAL)<?",
+            (OPEN_TS_KV_PREFIX, prefix_upper_bound(OPEN_TS_KV_PREFIX), float(open_ts_before)),
+            batch_size,
+        )
+        report["listings"] = _delete_in_batches(
+            conn, "market_listing", "(is_system=1 AND day_key<>?) OR quantity<=0", (today,), batch_size
+        )
+        report["media"] = _delete_in_batches(conn, "media_cache", "expires_at<=?", (int(time.time()),), batch_size)
+
+        report["freed_pages"] = int(conn.execute("PRAGMA freelist_count").fetchone()[0])
+        report["converted"] = 0
+        report["needs_conversion"] = 0
+        if int(conn.execute("PRAGMA auto_vacuum").fetchone()[0]) != 2:
+            if convert:
+                # Databases created before incremental auto-vacuum need one full VACUUM to switch modes.
+                # It holds an exclusive lock for the whole rewrite, so it only runs when an admin asks.
+                conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                conn.execute("VACUUM")
+                report["converted"] = 1
+            else:
+                report["needs_conversion"] = 1
+        else:
+            # executescript steps the pragma to completion; execute() would free a single page.
+            conn.executescript("PRAGMA incremental_vacuum;")
+        conn.execute("PRAGMA optimize")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+    finally:
+        conn.close()
+    report["size_after"] = db_file_size(db_path)
+    return report
@@ -1,7 +1,7 @@
 """Market pricing helpers for blind-box plugin."""
 
 import random
-from typing import Callable, Optional, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
 
 
 def clamp_volatility(value: object, low: float = 0.1, high: float = 0.5) -> float:
@@ -108,3 +108,56 @@ def build_market_breakdown(
         else "基准价待定"
     )
     return final_price, detail
+
+
+def normalize_listing_price_mode(value: object) -> str:
+    mode = str(value or "").strip().lower()
+    return "weighted" if mode in {"weighted", "volume", "vwap", "加权"} else "mean"
+
+
+def calc_listing_average(rows: List[Tuple[int, int, int, int, int]], mode: str = "mean") -> Optional[float]:
+    """Averages aggregated user listings given as (price_sum, count, quantity_sum, price_quantity_sum, min_price)."""
+    if mode == "weighted":
+        quantity = sum(r[2] for r in rows)
+        return sum(r[3] for r in rows) / quantity if quantity > 0 else None
+    count = sum(r[1] for r in rows)
+    return sum(r[0] for r in rows) / count if count > 0 else None
+
+
+class PricingContext:
+    """Pricing inputs preloaded once per command so item valuation runs in memory."""
+
+    def __init__(
+        self,
+        *,
+        date_str: str,
+        volatility: float,
+        scarcity_weight: float,
+        remaining_items: Dict[str, List[str]],
+        stored_multipliers: Dict[str, str],
+        listing_stats: Dict[Tuple[str, str], Tuple[int, int, int, int, int]],
+        listing_price_mode: str = "mean",
+    ):
+        self.date_str = date_str
+        self.volatility = volatility
+        self.scarcity_weight = scarcity_weight
+        self.remaining_items = remaining_items
+        self.stored_multipliers = stored_multipliers
+        self.listing_stats = listing_stats
+        self.listing_price_mode = normalize_listing_price_mode(listing_price_mode)
+        self.pending_kv: Dict[str, str] = {}
+
+    def kv_get(self, key: str) -> Optional[str]:
+        if key in self.pending_kv:
+            return self.pending_kv[key]
+        return self.stored_multipliers.get(key)
+
+    def kv_set(self, key: str, value: str):
+        self.pending_kv[key] = value
+
+    def user_listing_average(self, category_id: str, item_id: str = "") -> Optional[float]:
+        if item_id:
+            rows = [self.listing_stats[(category_id, item_id)]] if (category_id, item_id) in self.listing_stats else []
+        else:
+            rows = [v for (cid, _), v in self.listing_stats.items() if cid == category_id]
+        return calc_listing_average(rows, self.listing_price_mode)
@@ -0,0 +1,135 @@
+"""Uploaded media reference cache helpers for blind-box plugin."""
+
+import time
+from pathlib import Path
+from typing import Any, Callable, Optional, Protocol
+
+try:
+    from .db_service import connect_db
+except Exception:
+    from db_service import connect_db
+
+
+def init_media_cache_table(db_path: Path):
+    conn = connect_db(db_path)
+    try:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS media_cache (
+                content_hash TEXT NOT NULL,
+                platform TEXT NOT NULL,
+                media_id TEXT NOT NULL,
+                created_at INTEGER NOT NULL,
+                expires_at INTEGER NOT NULL,
+                PRIMARY KEY (content_hash, platform)
+            )
+            """
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def get_media_id(db_path: Path, content_hash: str, platform: str) -> Optional[str]:
+    conn = connect_db(db_path)
+    try:
+        cur = conn.execute(
+            "SELECT media_id FROM media_cache WHERE content_hash=? AND platform=? AND expires_at>?",
+            (content_hash, platform, int(time.time())),
+        )
+        row = cur.fetchone()
+        return str(row[0]) if row else None
+    finally:
+        conn.close()
+
+
+def set_media_id(db_path: Path, content_hash: str, platform: str, media_id: str, ttl_seconds: int):
+    now = int(time.time())
+    conn = connect_db(db_path)
+    try:
+        conn.execute(
+            "INSERT OR REPLACE INTO media_cache(content_hash,platform,media_id,created_at,expires_at) VALUES (?,?,?,?,?)",
+            (content_hash, platform, str(media_id), now, now + max(1, int(ttl_seconds))),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def delete_media_id(db_path: Path, content_hash: str, platform: str):
+    conn = connect_db(db_path)
+    try:
+        conn.execute("DELETE FROM media_cache WHERE content_hash=? AND platform=?", (content_hash, platform))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+class MediaUploader(Protocol):
+    """Adapter glue for one platform that can upload an image once and reference it by media id.
+
+    AstrBot events have no portable upload API, so media-id reuse is only active for
+    platforms whose uploader was registered with the plugin.
+    """
+
+    platform: str
+
+    async def upload(self, image: Path) -> Optional[str]:
+        """Uploads ``image`` and returns the platform's reusable media id, or None."""
+        ...
+
+    def reference(self, media_id: str) -> Any:
+        """A message component that sends an already uploaded media id."""
+        ...
+
+
+class MediaReferenceCache:
+    """Resolves images to reusable media references through (content hash, platform) -> media id.
+
+    ``lookup`` / ``remember`` / ``forget`` are the storage backend's media cache calls. A
+    valid id is reused; a miss, an expired id or a reference the adapter rejects falls back
+    to a fresh upload. Every failure yields None so the caller can send the image normally.
+    """
+
+    def __init__(
+        self,
+        lookup: Callable[[str, str], Optional[str]],
+        remember: Callable[[str, str, str, int], None],
+        forget: Callable[[str, str], None],
+        warn: Callable[[str], None] = lambda message: None,
+    ):
+        self.lookup = lookup
+        self.remember = remember
+        self.forget = forget
+        self.warn = warn
+        self.reused = 0
+        self.uploaded = 0
+
+    async def resolve(self, uploader: MediaUploader, image: Path, content_hash: str, ttl_seconds: int) -> Any:
+        platform = str(uploader.platform)
+        media_id = self.lookup(content_hash, platform)
+        if media_id:
+            try:
+                component = uploader.reference(media_id)
+                self.reused += 1
+                return component
+            except Exception as ex:
+                self.warn(f"复用已上传图片失败（{platform}:{media_id}）：{ex}")
+                self.forget(content_hash, platform)
+
+        try:
+            media_id = await uploader.upload(image)
+        except Exception as ex:
+            self.warn(f"上传图片失败（{image}）：{ex}")
+            return None
+        if not media_id:
+            return None
+        media_id = str(media_id)
+        try:
+            component = uploader.reference(media_id)
+        except Exception as ex:
+            self.warn(f"按媒体ID发送图片失败（{platform}:{media_id}）：{ex}")
+            return None
+        self.remember(content_hash, platform, media_id, ttl_seconds)
+        self.uploaded += 1
+        return component
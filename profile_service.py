@@ -0,0 +1,114 @@
+"""On-demand profiling helpers for blind-box plugin."""
+
+import cProfile
+import io
+import pstats
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+
+class CommandProfiler:
+    """Profiles the next N command invocations and dumps aggregated stats."""
+
+    def __init__(self, out_dir: Path, invocations: int, trace_memory: bool = False, top_n: int = 30):
+        self.out_dir = out_dir
+        self.target = max(1, int(invocations))
+        self.remaining = self.target
+        self.trace_memory = bool(trace_memory)
+        self.top_n = max(1, int(top_n))
+        self.started_at = time.time()
+        self.profile = cProfile.Profile()
+        self.memory_growth: Dict[str, List[int]] = {}
+        self._tracemalloc_owned = False
+        self.in_flight = False
+        self.skipped_concurrent = 0
+        self.overlapped = 0
+        self._overlapped_now = False
+
+    @property
+    def active(self) -> bool:
+        return self.remaining > 0
+
+    @property
+    def busy(self) -> bool:
+        return self.in_flight
+
+    def note_concurrent(self):
+        """Records a command that arrived while a profiled one was in flight and ran unprofiled."""
+        self.skipped_concurrent += 1
+        self._overlapped_now = True
+
+    def begin(self) -> Optional[object]:
+        self.in_flight = True
+        self._overlapped_now = False
+        snapshot = None
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._tracemalloc_owned = True
+            snapshot = tracemalloc.take_snapshot()
+        self.profile.enable()
+        return snapshot
+
+    def pause(self):
+        self.profile.disable()
+
+    def resume(self):
+        self.profile.enable()
+
+    def end(self, action: str, snapshot: Optional[object]) -> bool:
+        """Closes one invocation; returns True when the requested count is reached."""
+        self.profile.disable()
+        self.in_flight = False
+        if self._overlapped_now:
+            # Another command ran on the loop while this one awaited; its allocations would be mixed in.
+            self.overlapped += 1
+        elif snapshot is not None and tracemalloc.is_tracing():
+            after = tracemalloc.take_snapshot()
+            growth = sum(stat.size_diff for stat in after.compare_to(snapshot, "filename"))
+            self.memory_growth.setdefault(action or "(help)", []).append(int(growth))
+        self.remaining -= 1
+        return self.remaining <= 0
+
+    def finish(self) -> Tuple[Path, Path]:
+        self.remaining = 0
+        if self._tracemalloc_owned and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self._tracemalloc_owned = False
+
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        stamp = time.strftime("%Y%m%d_%H%M%S", time.localtime(self.started_at))
+        stats_path = self.out_dir / f"profile_{stamp}.pstats"
+        summary_path = self.out_dir / f"profile_{stamp}.txt"
+
+        self.profile.create_stats()
+        self.profile.dump_stats(str(stats_path))
+
+        buf = io.StringIO()
+        buf.write(f"invocations: {self.target}\n")
+        buf.write(f"elapsed: {time.time() - self.started_at:.1f}s\n")
+        buf.write(f"skipped (concurrent): {self.skipped_concurrent}\n")
+        buf.write(f"overlapped by a concurrent command: {self.overlapped} (memory samples dropped)\n")
+        buf.write(
+            "note: only the event loop thread is profiled; time spent in asyncio.to_thread workers is excluded, "
+            "and loop-thread time of an overlapping unprofiled command may still show up\n\n"
+        )
+        if self.profile.stats:
+            stats = pstats.Stats(self.profile, stream=buf)
+            stats.strip_dirs().sort_stats("cumulative").print_stats(self.top_n)
+        else:
+            buf.write("(no samples)\n")
+        if self.memory_growth:
+            buf.write("\ntracemalloc growth per action (bytes):\n")
+            for action, values in sorted(self.memory_growth.items()):
+                avg = sum(values) / len(values)
+                buf.write(f"- {action}: calls={len(values)} avg={avg:.0f} max={max(values)} total={sum(values)}\n")
+        summary_path.write_text(buf.getvalue(), encoding="utf-8")
+        return stats_path, summary_path
+
+    def status_text(self) -> str:
+        mode = "cProfile + tracemalloc" if self.trace_memory else "cProfile"
+        done = self.target - self.remaining
+        return f"性能采样进行中：{done}/{self.target}（模式：{mode}，并发跳过 {self.skipped_concurrent} 次）"
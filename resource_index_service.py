@@ -1,41 +1,81 @@
-"""Resource index helpers for market/recycle per-box pricing."""
-
-from pathlib import Path
-from typing import Dict
-import json
-
-
-def build_box_index(categories: Dict[str, dict]) -> Dict[str, dict]:
-    data: Dict[str, dict] = {}
-    for category_id, category in categories.items():
-        items = category.get("items", {})
-        boxes = []
-        for item_id, item in items.items():
-            boxes.append(
-                {
-                    "item_id": item_id,
-                    "name": str(item.get("name", item_id)),
-                    "slot_no": int(item.get("slot_no", 0)),
-                }
-            )
-        boxes.sort(key=lambda x: (x.get("slot_no", 0), x.get("item_id", "")))
-        data[category_id] = {
-            "box_type": category.get("box_type", ""),
-            "box_count": len(boxes),
-            "boxes": boxes,
-        }
-    return data
-
-
-def sync_box_index_file(path: Path, categories: Dict[str, dict]) -> Dict[str, dict]:
-    index_data = build_box_index(categories)
-    old = {}
-    if path.exists():
-        try:
-            old = json.loads(path.read_text(encoding="utf-8"))
-        except Exception:
-            old = {}
-    if old != index_data:
-        path.parent.mkdir(parents=True, exist_ok=True)
-        path.write_text(json.dumps(index_data, ensure_ascii=False, indent=2), encoding="utf-8")
-    return index_data
+"""Item name index for fuzzy prize lookups; box index helpers live in resource_service."""
+
+from typing import Dict, List, Set, Tuple
+
+try:
+    from .resource_service import build_box_index, sync_box_index_file
+except Exception:
+    from resource_service import build_box_index, sync_box_index_file
+
+
+def normalize_item_name(name: str) -> str:
+    return "".join(str(name or "").split()).lower()
+
+
+def _name_grams(text: str) -> Set[str]:
+    if len(text) <= 1:
+        return {text} if text else set()
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def build_name_index(index_data: Dict[str, dict]) -> Dict[str, object]:
+    by_category: Dict[str, Dict[str, str]] = {}
+    entries: List[Tuple[str, str, str, int]] = []
+    grams: Dict[str, List[int]] = {}
+    chars: Dict[str, List[int]] = {}
+    for category_id, category in index_data.items():
+        exact = by_category.setdefault(category_id, {})
+        for box in category.get("boxes", []):
+            item_id = str(box.get("item_id", ""))
+            name = str(box.get("name", item_id)).strip()
+            exact.setdefault(name, item_id)
+            entry_no = len(entries)
+            entries.append((category_id, item_id, name, int(box.get("slot_no", 0))))
+            normalized = normalize_item_name(name)
+            for gram in _name_grams(normalized):
+                grams.setdefault(gram, []).append(entry_no)
+            for char in set(normalized):
+                chars.setdefault(char, []).append(entry_no)
+    return {"by_category": by_category, "entries": entries, "grams": grams, "chars": chars}
+
+
+def search_name_index(
+    name_index: Dict[str, object],
+    keyword: str,
+    category_id: str = "",
+    limit: int = 10,
+    min_score: float = 0.3,
+) -> List[Tuple[str, str, str, int, float]]:
+    target = normalize_item_name(keyword)
+    if not target or not name_index:
+        return []
+    entries = name_index.get("entries", [])
+    postings = name_index.get("grams", {})
+    target_grams = _name_grams(target)
+
+    shared: Dict[int, int] = {}
+    if len(target) == 1:
+        # A single character has no bigram to share; every name containing it is a substring hit.
+        for entry_no in name_index.get("chars", {}).get(target, []):
+            shared[entry_no] = 1
+    else:
+        for gram in target_grams:
+            for entry_no in postings.get(gram, []):
+                shared[entry_no] = shared.get(entry_no, 0) + 1
+
+    scored = []
+    for entry_no, common in shared.items():
+        cid, item_id, name, slot_no = entries[entry_no]
+        if category_id and cid != category_id:
+            continue
+        normalized = normalize_item_name(name)
+        if normalized == target:
+            score = 1.0
+        elif target in normalized:
+            score = 0.9 + 0.09 * len(target) / len(normalized)
+        else:
+            score = 2.0 * common / (len(target_grams) + len(_name_grams(normalized)))
+        if score >= min_score:
+            scored.append((cid, item_id, name, slot_no, score))
+    scored.sort(key=lambda x: (-x[4], x[0], x[3], x[1]))
+    return scored[:max(1, int(limit))]
@@ -1,40 +1,333 @@
-"""Resource index helpers for market/recycle per-box pricing."""
+"""Resource scanning, the category/item model and the per-box resource index."""
 
+import hashlib
+import os
+import re
+import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
 import json
 
 
-def build_box_index(categories: Dict[str, dict]) -> Dict[str, dict]:
-    data: Dict[str, dict] = {}
-    for category_id, category in categories.items():
-        items = category.get("items", {})
-        boxes = []
-        for item_id, item in items.items():
-            boxes.append(
-                {
-                    "item_id": item_id,
-                    "name": str(item.get("name", item_id)),
-                    "slot_no": int(item.get("slot_no", 0)),
-                }
+CATEGORY_DIGEST_SIZE = 16
+ITEM_TABLE_CACHE_SIZE = 64
+PRIZE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp"}
+PRIZE_NAME_PATTERN = re.compile(r"^(\d+)[-_](.+)$")
+SCAN_MAX_WORKERS = 8
+SCAN_CACHE_VERSION = 1
+# A directory modified this recently may still change within the same mtime tick; rescan it next time.
+SCAN_CACHE_RACY_NS = 2_000_000_000
+
+ItemEntry = Tuple[str, str, int]
+
+
+@dataclass(frozen=True, slots=True)
+class Item:
+    """One prize image of a category; the file name doubles as the item id."""
+
+    item_id: str
+    name: str
+    slot_no: int
+
+
+@dataclass(frozen=True, slots=True, eq=False)
+class Category:
+    """Header of a scanned blind-box category.
+
+    Only the id, type, counts and a fixed-size digest signature are kept per
+    category; the item table is parsed on first access through ``store`` and kept
+    in its LRU, so listing thousands of categories never materializes their items.
+    Image paths are derived from ``root`` on demand.
+    """
+
+    id: str
+    box_type: str
+    root: Path
+    guide_image: Optional[Path]
+    item_count: int
+    slot_total: int
+    signature: str
+    store: "CategoryItemStore"
+
+    @property
+    def items(self) -> Dict[str, Item]:
+        return self.store.get(self)[0]
+
+    @property
+    def slots(self) -> array:
+        return self.store.get(self)[1]
+
+    @property
+    def item_ids(self) -> List[str]:
+        return list(self.items)
+
+    def image_path(self, item_id: str) -> Path:
+        return self.root / item_id
+
+    def legacy_signature(self) -> str:
+        """The joined-id signature stored by older versions, used to adopt their pool rows."""
+        return "|".join(sorted(self.items)) + "::" + ",".join(map(str, self.slots))
+
+
+def category_signature(item_ids: Iterable[str], slots: Iterable[int]) -> str:
+    digest = hashlib.blake2b(digest_size=CATEGORY_DIGEST_SIZE)
+    for item_id in sorted(item_ids):
+        digest.update(item_id.encode("utf-8"))
+        digest.update(b"\0")
+    digest.update(b"::")
+    digest.update(",".join(map(str, sorted(slots))).encode("ascii"))
+    return digest.hexdigest()
+
+
+def build_item_table(entries: Iterable[ItemEntry]) -> Tuple[Dict[str, Item], array]:
+    """Item table and sorted slot array from ``(item_id, name, slot_no)`` entries."""
+    items: Dict[str, Item] = {}
+    for item_id, name, slot_no in entries:
+        item_id = sys.intern(item_id)
+        items[item_id] = Item(item_id, sys.intern(name), int(slot_no))
+    return items, array("q", sorted({item.slot_no for item in items.values()}))
+
+
+def summarize_entries(entries: Iterable[ItemEntry]) -> Tuple[int, int, str]:
+    """(item count, slot count, signature) of a category; the entries are not retained."""
+    item_ids = set()
+    slots = set()
+    for item_id, _, slot_no in entries:
+        item_ids.add(item_id)
+        slots.add(int(slot_no))
+    return len(item_ids), len(slots), category_signature(item_ids, slots)
+
+
+class CategoryItemStore:
+    """Bounded LRU of parsed item tables, keyed by (category id, signature).
+
+    ``loader`` re-reads a category directory and returns its item entries. A new
+    scan with an unchanged signature keeps hitting the same table; a changed
+    signature simply misses and the stale table ages out.
+    """
+
+    def __init__(self, loader: Callable[[Path], Iterable[ItemEntry]], capacity: int = ITEM_TABLE_CACHE_SIZE):
+        self.loader = loader
+        self.capacity = max(1, int(capacity))
+        self.hits = 0
+        self.loads = 0
+        self._tables: "OrderedDict[Tuple[str, str], Tuple[Dict[str, Item], array]]" = OrderedDict()
+        # Views render in worker threads, so lookups and evictions are serialized.
+        self._lock = threading.Lock()
+
+    def get(self, category: Category) -> Tuple[Dict[str, Item], array]:
+        key = (category.id, category.signature)
+        with self._lock:
+            table = self._tables.get(key)
+            if table is not None:
+                self._tables.move_to_end(key)
+                self.hits += 1
+                return table
+        table = build_item_table(self.loader(category.root))
+        with self._lock:
+            self.loads += 1
+            self._tables[key] = table
+            self._tables.move_to_end(key)
+            self._evict()
+        return table
+
+    def resize(self, capacity: int):
+        with self._lock:
+            self.capacity = max(1, int(capacity))
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._tables.clear()
+
+    def stats_text(self) -> str:
+        return f"奖品表缓存：{len(self._tables)}/{self.capacity} 个种类，命中 {self.hits} 次，加载 {self.loads} 次"
+
+    def _evict(self):
+        while len(self._tables) > self.capacity:
+            self._tables.popitem(last=False)
+
+
+def scan_category_dir(cat_dir: Path, guide_candidates: Iterable[str]) -> Tuple[List[ItemEntry], Optional[str]]:
+    """Prize entries and guide image name of one category from a single directory listing."""
+    with os.scandir(cat_dir) as it:
+        # DirEntry.is_file() answers from the cached directory listing except for symlinks.
+        files = {e.name for e in it if e.is_file()}
+    guide_candidates = list(guide_candidates)
+    guide = next((name for name in guide_candidates if name in files), None)
+    entries: List[ItemEntry] = []
+    for name in sorted(files):
+        if name in guide_candidates:
+            continue
+        stem, suffix = os.path.splitext(name)
+        if suffix.lower() not in PRIZE_SUFFIXES:
+            continue
+        m = PRIZE_NAME_PATTERN.match(stem)
+        if not m:
+            continue
+        entries.append((name, m.group(2).strip() or stem, int(m.group(1))))
+    return entries, guide
+
+
+class ResourceScanner:
+    """Scans the box roots into category headers, backed by a persistent scan cache.
+
+    The cache maps each category directory to its mtime and parsed header (guide
+    image, counts, signature). Adding, removing or renaming a prize changes the
+    directory mtime, so a warm scan costs one ``stat`` per category and only
+    changed directories are listed and parsed again. Directories are checked
+    concurrently on a bounded thread pool and merged in sorted order.
+    """
+
+    def __init__(
+        self,
+        cache_path: Path,
+        guide_candidates: Iterable[str],
+        capacity: int = ITEM_TABLE_CACHE_SIZE,
+        max_workers: int = SCAN_MAX_WORKERS,
+    ):
+        self.cache_path = cache_path
+        self.guide_candidates = tuple(guide_candidates)
+        self.max_workers = max(1, int(max_workers))
+        self.store = CategoryItemStore(self.load_entries, capacity)
+        self.last_stats: Dict[str, float] = {}
+        self._cache: Optional[Dict[str, list]] = None
+
+    def load_entries(self, cat_dir: Path) -> List[ItemEntry]:
+        return scan_category_dir(cat_dir, self.guide_candidates)[0]
+
+    def scan(self, roots: Iterable[Tuple[str, Path]]) -> Dict[str, Category]:
+        started = time.perf_counter()
+        cache = self._load_cache()
+        cat_dirs: List[Tuple[str, Path]] = []
+        for box_type, root in roots:
+            if not root.exists():
+                continue
+            with os.scandir(root) as it:
+                cat_dirs.extend((box_type, Path(e.path)) for e in sorted(it, key=lambda e: e.name) if e.is_dir())
+
+        workers = max(1, min(self.max_workers, len(cat_dirs)))
+        dirs = [cat_dir for _, cat_dir in cat_dirs]
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="blindbox-scan") as pool:
+                scans = list(pool.map(self._scan_dir, dirs))
+        else:
+            scans = [self._scan_dir(cat_dir) for cat_dir in dirs]
+
+        result: Dict[str, Category] = {}
+        fresh: Dict[str, list] = {}
+        reparsed = 0
+        for (box_type, cat_dir), (record, parsed) in zip(cat_dirs, scans):
+            reparsed += parsed
+            if record is None:
+                continue
+            mtime_ns, guide, item_count, slot_total, signature = record
+            if mtime_ns:
+                fresh[str(cat_dir)] = record
+            if not item_count:
+                continue
+            result[cat_dir.name] = Category(
+                id=sys.intern(cat_dir.name),
+                box_type=sys.intern(box_type),
+                root=cat_dir,
+                guide_image=(cat_dir / guide) if guide else None,
+                item_count=item_count,
+                slot_total=slot_total,
+                signature=signature,
+                store=self.store,
             )
-        boxes.sort(key=lambda x: (x.get("slot_no", 0), x.get("item_id", "")))
-        data[category_id] = {
-            "box_type": category.get("box_type", ""),
-            "box_count": len(boxes),
-            "boxes": boxes,
+        if fresh != cache:
+            self._cache = fresh
+            self._save_cache(fresh)
+        self.last_stats = {
+            "categories": len(result),
+            "reparsed": reparsed,
+            "elapsed_ms": (time.perf_counter() - started) * 1000,
         }
-    return data
+        return result
+
+    def _scan_dir(self, cat_dir: Path) -> Tuple[Optional[list], int]:
+        """(cache record, 1 if the directory had to be listed and parsed)."""
+        try:
+            mtime_ns = cat_dir.stat().st_mtime_ns
+        except OSError:
+            return None, 0
+        cached = self._cache.get(str(cat_dir)) if self._cache else None
+        if cached is not None and cached[0] == mtime_ns:
+            return cached, 0
+        entries, guide = scan_category_dir(cat_dir, self.guide_candidates)
+        item_count, slot_total, signature = summarize_entries(entries)
+        if time.time_ns() - mtime_ns < SCAN_CACHE_RACY_NS:
+            mtime_ns = 0
+        return [mtime_ns, guide or "", item_count, slot_total, signature], 1
+
+    def _load_cache(self) -> Dict[str, list]:
+        if self._cache is None:
+            self._cache = {}
+            try:
+                data = json.loads(self.cache_path.read_text(encoding="utf-8"))
+                if data.get("version") == SCAN_CACHE_VERSION and data.get("guide_candidates") == list(self.guide_candidates):
+                    self._cache = {str(k): list(v) for k, v in data.get("dirs", {}).items()}
+            except Exception:
+                self._cache = {}
+        return self._cache
+
+    def _save_cache(self, dirs: Dict[str, list]):
+        data = {"version": SCAN_CACHE_VERSION, "guide_candidates": list(self.guide_candidates), "dirs": dirs}
+        try:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.cache_path.with_name(f"{self.cache_path.name}.tmp")
+            tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp, self.cache_path)
+        except OSError:
+            # The cache only saves work on the next start; a failed write is not fatal.
+            pass
 
 
-def sync_box_index_file(path: Path, categories: Dict[str, dict]) -> Dict[str, dict]:
-    index_data = build_box_index(categories)
+def _box_index_entry(category: Category) -> dict:
+    boxes = [{"item_id": item.item_id, "name": item.name, "slot_no": item.slot_no} for item in category.items.values()]
+    boxes.sort(key=lambda x: (x.get("slot_no", 0), x.get("item_id", "")))
+    return {
+        "box_type": category.box_type,
+        "box_count": len(boxes),
+        "signature": category.signature,
+        "boxes": boxes,
+    }
+
+
+def build_box_index(categories: Dict[str, Category]) -> Dict[str, dict]:
+    return {category_id: _box_index_entry(category) for category_id, category in categories.items()}
+
+
+def sync_box_index_file(path: Path, categories: Dict[str, Category]) -> Dict[str, dict]:
+    """Returns the box index, reusing entries of the existing file whose signature still matches.
+
+    Only categories with a changed digest load their items, and the file is rewritten
+    only when some entry changed.
+    """
     old = {}
     if path.exists():
         try:
             old = json.loads(path.read_text(encoding="utf-8"))
         except Exception:
             old = {}
+    index_data: Dict[str, dict] = {}
+    for category_id, category in categories.items():
+        entry = old.get(category_id) if isinstance(old, dict) else None
+        if (
+            isinstance(entry, dict)
+            and entry.get("signature") == category.signature
+            and entry.get("box_type") == category.box_type
+        ):
+            index_data[category_id] = entry
+        else:
+            index_data[category_id] = _box_index_entry(category)
     if old != index_data:
         path.parent.mkdir(parents=True, exist_ok=True)
         path.write_text(json.dumps(index_data, ensure_ascii=False, indent=2), encoding="utf-8")
@@ -0,0 +1,995 @@
+"""Storage backends (SQLite / in-memory) for blind-box plugin."""
+
+import bisect
+import json
+import os
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    from . import backup_service
+    from . import db_service
+    from . import export_service
+    from . import inventory_service
+    from . import maintenance_service
+    from . import media_cache_service
+    from . import resource_service
+except Exception:
+    import backup_service
+    import db_service
+    import export_service
+    import inventory_service
+    import maintenance_service
+    import media_cache_service
+    import resource_service
+
+
+ListingStats = Dict[Tuple[str, str], Tuple[int, int, int, int, int]]
+
+# user_stats columns, in the order MemoryStorage keeps them.
+STATS_METRICS = ("collection", "opens")
+
+
+class StorageBackend(ABC):
+    """Persistence interface for wallets, pools, inventory, listings, KV and media references."""
+
+    engine = ""
+
+    @abstractmethod
+    def init(self):
+        raise NotImplementedError
+
+    def snapshot(self) -> bool:
+        """Persists in-memory state if the engine keeps any; returns True when something was written."""
+        return False
+
+    def close(self):
+        self.snapshot()
+
+    @abstractmethod
+    def run_maintenance(
+        self, today: str, multiplier_keep_from: str, open_ts_before: float, batch_size: int = 500, convert: bool = False
+    ) -> Dict[str, int]:
+        """Prunes stale KV keys / expired listings / expired media references and compacts storage.
+
+        ``convert`` allows a one-time full rewrite of the storage file where the engine needs one.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def backup(self, backup_dir: Path) -> Tuple[Path, Dict[str, int]]:
+        """Writes a verified, timestamped copy of all data into ``backup_dir``."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def export_records(self, group_id: str = "") -> Iterator[dict]:
+        """Streams wallet / inventory / pool / listing / kv records of one group ("" = everything)."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def import_records(self, records: Iterable[dict]) -> Dict[str, int]:
+        """Upserts exported records; a group's listings are replaced. Returns per-type counts."""
+        raise NotImplementedError
+
+    # wallets
+    @abstractmethod
+    def get_user(self, group_id: str, user_id: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_balance(self, group_id: str, user_id: str) -> Optional[int]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def register_user(self, group_id: str, user_id: str, balance: int):
+        raise NotImplementedError
+
+    @abstractmethod
+    def update_balance(self, group_id: str, user_id: str, balance: int):
+        raise NotImplementedError
+
+    @abstractmethod
+    def adjust_balance(self, group_id: str, user_id: str, delta: int, min_balance: int = 0) -> Optional[int]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def grant_daily_gift(self, amount: int) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def grant_daily_gift_once(self, amount: int, date_key: str) -> Optional[int]:
+        raise NotImplementedError
+
+    # inventory
+    @abstractmethod
+    def add_inventory_item(self, group_id: str, user_id: str, category_id: str, item_name: str, count: int = 1):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_user_inventory(self, group_id: str, user_id: str) -> List[Tuple[str, str, int]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_user_inventory_by_category(self, group_id: str, user_id: str, category_id: str) -> List[Tuple[str, int]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def consume_inventory_item(self, group_id: str, user_id: str, category_id: str, item_name: str, count: int = 1) -> bool:
+        raise NotImplementedError
+
+    # pools
+    @abstractmethod
+    def ensure_category_states(self, categories: Dict[str, resource_service.Category], group_id: str = ""):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_category_state(self, category_id: str, group_id: str = "") -> Tuple[List[str], List[int]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_category_states(self, category_ids: List[str], group_id: str = "") -> Dict[str, Tuple[List[str], List[int]]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_draw_window(self, category_id: str, count: int, group_id: str = "") -> Tuple[List[str], int, List[int], Optional[int]]:
+        """(next ``count`` items at the draw cursor, remaining count, slots, version); version is None without a pool."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_category_state(self, category_id: str, signature: str, items: List[str], slots: List[int], group_id: str = ""):
+        raise NotImplementedError
+
+    @abstractmethod
+    def commit_draw(self, **kwargs) -> Tuple[str, Optional[int]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_pool_draw_info(self, category_id: str, group_id: str = "") -> Optional[Tuple[int, int, int]]:
+        """(seed, cursor, total) of the pool's recorded draw order."""
+        raise NotImplementedError
+
+    # leaderboards
+    @abstractmethod
+    def get_leaderboard(self, group_id: str, metric: str, limit: int = 10) -> List[Tuple[str, int]]:
+        """Top users of a group by ``metric`` (balance / collection / opens), largest first."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_user_stats(self, group_id: str, user_id: str) -> Tuple[int, int]:
+        """Returns (collection_count, open_count)."""
+        raise NotImplementedError
+
+    # kv
+    @abstractmethod
+    def get_kv(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_kv(self, key: str, value: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_kv_by_prefix(self, prefix: str) -> Dict[str, str]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_kv_many(self, values: Dict[str, str]):
+        raise NotImplementedError
+
+    # market
+    @abstractmethod
+    def add_market_listing(
+        self,
+        group_id: str,
+        category_id: str,
+        item_id: str,
+        item_name: str,
+        price: int,
+        quantity: int,
+        seller_user_id: str,
+        is_system: int,
+        day_key: str,
+    ):
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_market_listings(self, group_id: str, category_id: str = "") -> List[dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def consume_market_listing(self, listing_id: int, quantity: int) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def purchase_listing(
+        self, listing_id: int, group_id: str, buyer_user_id: str, quantity: int, day_key: str = ""
+    ) -> Tuple[str, Optional[int], int]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def rollup_market_trades(self, retention_days: int) -> Tuple[int, int]:
+        """Folds new trades into daily OHLC rows and prunes raw trades past retention; returns (rolled_up, pruned)."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_market_trade_daily(self, group_id: str, category_id: str, item_id: str, since_day: str) -> List[Tuple]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_expired_system_listings(self, group_id: str, day_key: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_listing_stats(self, group_id: str, category_id: str = "") -> ListingStats:
+        raise NotImplementedError
+
+    # media references
+    @abstractmethod
+    def get_media_id(self, content_hash: str, platform: str) -> Optional[str]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_media_id(self, content_hash: str, platform: str, media_id: str, ttl_seconds: int):
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_media_id(self, content_hash: str, platform: str):
+        raise NotImplementedError
+
+
+class SqliteStorage(StorageBackend):
+    engine = "sqlite"
+
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+
+    def init(self):
+        db_service.init_db(self.db_path)
+        inventory_service.init_inventory_table(self.db_path)
+        media_cache_service.init_media_cache_table(self.db_path)
+
+    def run_maintenance(
+        self, today: str, multiplier_keep_from: str, open_ts_before: float, batch_size: int = 500, convert: bool = False
+    ) -> Dict[str, int]:
+        return maintenance_service.db_run_maintenance(
+            self.db_path,
+            today=today,
+            multiplier_keep_from=multiplier_keep_from,
+            open_ts_before=open_ts_before,
+            batch_size=batch_size,
+            convert=convert,
+        )
+
+    def backup(self, backup_dir: Path) -> Tuple[Path, Dict[str, int]]:
+        target = backup_dir / backup_service.backup_file_name()
+        return target, backup_service.db_online_backup(self.db_path, target)
+
+    def export_records(self, group_id: str = "") -> Iterator[dict]:
+        return export_service.iter_db_records(self.db_path, group_id)
+
+    def import_records(self, records: Iterable[dict]) -> Dict[str, int]:
+        return export_service.db_import_records(self.db_path, records)
+
+    def get_user(self, group_id: str, user_id: str):
+        return db_service.db_get_user(self.db_path, group_id, user_id)
+
+    def get_balance(self, group_id: str, user_id: str) -> Optional[int]:
+        return db_service.db_get_balance(self.db_path, group_id, user_id)
+
+    def register_user(self, group_id: str, user_id: str, balance: int):
+        db_service.db_register_user(self.db_path, group_id, user_id, balance)
+
+    def update_balance(self, group_id: str, user_id: str, balance: int):
+        db_service.db_update_balance(self.db_path, group_id, user_id, balance)
+
+    def adjust_balance(self, group_id: str, user_id: str, delta: int, min_balance: int = 0) -> Optional[int]:
+        return db_service.db_adjust_balance(self.db_path, group_id, user_id, delta, min_balance)
+
+    def grant_daily_gift(self, amount: int) -> int:
+        return db_service.db_grant_daily_gift(self.db_path, amount)
+
+    def grant_daily_gift_once(self, amount: int, date_key: str) -> Optional[int]:
+        return db_service.db_grant_daily_gift_once(self.db_path, amount, date_key)
+
+    def add_inventory_item(self, group_id: str, user_id: str, category_id: str, item_name: str, count: int = 1):
+        inventory_service.add_inventory_item(self.db_path, group_id, user_id, category_id, item_name, count)
+
+    def get_user_inventory(self, group_id: str, user_id: str) -> List[Tuple[str, str, int]]:
+        return inventory_service.get_user_inventory(self.db_path, group_id, user_id)
+
+    def get_user_inventory_by_category(self, group_id: str, user_id: str, category_id: str) -> List[Tuple[str, int]]:
+        return inventory_service.get_user_inventory_by_category(self.db_path, group_id, user_id, category_id)
+
+    def consume_inventory_item(self, group_id: str, user_id: str, category_id: str, item_name: str, count: int = 1) -> bool:
+        return inventory_service.consume_inventory_item(self.db_path, group_id, user_id, category_id, item_name, count)
+
+    def ensure_category_states(self, categories: Dict[str, resource_service.Category], group_id: str = ""):
+        db_service.db_ensure_category_states(self.db_path, categories, group_id)
+
+    def get_category_state(self, category_id: str, group_id: str = "") -> Tuple[List[str], List[int]]:
+        return db_service.db_get_category_state(self.db_path, category_id, group_id)
+
+    def get_category_states(self, category_ids: List[str], group_id: str = "") -> Dict[str, Tuple[List[str], List[int]]]:
+        return db_service.db_get_category_states(self.db_path, category_ids, group_id)
+
+    def get_draw_window(self, category_id: str, count: int, group_id: str = "") -> Tuple[List[str], int, List[int], Optional[int]]:
+        return db_service.db_get_draw_window(self.db_path, category_id, count, group_id)
+
+    def set_category_state(self, category_id: str, signature: str, items: List[str], slots: List[int], group_id: str = ""):
+        db_service.db_set_category_state(self.db_path, category_id, signature, items, slots, group_id)
+
+    def commit_draw(self, **kwargs) -> Tuple[str, Optional[int]]:
+        return db_service.db_commit_draw(self.db_path, **kwargs)
+
+    def get_pool_draw_info(self, category_id: str, group_id: str = "") -> Optional[Tuple[int, int, int]]:
+        return db_service.db_get_pool_draw_info(self.db_path, category_id, group_id)
+
+    def get_leaderboard(self, group_id: str, metric: str, limit: int = 10) -> List[Tuple[str, int]]:
+        return db_service.db_get_leaderboard(self.db_path, group_id, metric, limit)
+
+    def get_user_stats(self, group_id: str, user_id: str) -> Tuple[int, int]:
+        return db_service.db_get_user_stats(self.db_path, group_id, user_id)
+
+    def get_kv(self, key: str) -> Optional[str]:
+        return db_service.db_get_kv(self.db_path, key)
+
+    def set_kv(self, key: str, value: str):
+        db_service.db_set_kv(self.db_path, key, value)
+
+    def get_kv_by_prefix(self, prefix: str) -> Dict[str, str]:
+        return db_service.db_get_kv_by_prefix(self.db_path, prefix)
+
+    def set_kv_many(self, values: Dict[str, str]):
+        db_service.db_set_kv_many(self.db_path, values)
+
+    def add_market_listing(
+        self,
+        group_id: str,
+        category_id: str,
+        item_id: str,
+        item_name: str,
+        price: int,
+        quantity: int,
+        seller_user_id: str,
+        is_system: int,
+        day_key: str,
+    ):
+        db_service.db_add_market_listing(
+            self.db_path, group_id, category_id, item_id, item_name, price, quantity, seller_user_id, is_system, day_key
+        )
+
+    def list_market_listings(self, group_id: str, category_id: str = "") -> List[dict]:
+        return db_service.db_list_market_listings(self.db_path, group_id, category_id)
+
+    def consume_market_listing(self, listing_id: int, quantity: int) -> bool:
+        return db_service.db_consume_market_listing(self.db_path, listing_id, quantity)
+
+    def purchase_listing(
+        self, listing_id: int, group_id: str, buyer_user_id: str, quantity: int, day_key: str = ""
+    ) -> Tuple[str, Optional[int], int]:
+        return db_service.db_purchase_listing(self.db_path, listing_id, group_id, buyer_user_id, quantity, day_key)
+
+    def rollup_market_trades(self, retention_days: int) -> Tuple[int, int]:
+        return db_service.db_rollup_market_trades(self.db_path, retention_days)
+
+    def get_market_trade_daily(self, group_id: str, category_id: str, item_id: str, since_day: str) -> List[Tuple]:
+        return db_service.db_get_market_trade_daily(self.db_path, group_id, category_id, item_id, since_day)
+
+    def delete_expired_system_listings(self, group_id: str, day_key: str):
+        db_service.db_delete_expired_system_listings(self.db_path, group_id, day_key)
+
+    def get_listing_stats(self, group_id: str, category_id: str = "") -> ListingStats:
+        return db_service.db_get_listing_stats(self.db_path, group_id, category_id)
+
+    def get_media_id(self, content_hash: str, platform: str) -> Optional[str]:
+        return media_cache_service.get_media_id(self.db_path, content_hash, platform)
+
+    def set_media_id(self, content_hash: str, platform: str, media_id: str, ttl_seconds: int):
+        media_cache_service.set_media_id(self.db_path, content_hash, platform, media_id, ttl_seconds)
+
+    def delete_media_id(self, content_hash: str, platform: str):
+        media_cache_service.delete_media_id(self.db_path, content_hash, platform)
+
+
+class MemoryStorage(StorageBackend):
+    """Dict-backed engine; state lives in process memory and is snapshotted to a JSON file."""
+
+    engine = "memory"
+
+    def __init__(self, snapshot_path: Optional[Path] = None, seed_db_path: Optional[Path] = None):
+        self.snapshot_path = snapshot_path
+        self.wallets: Dict[Tuple[str, str], List[int]] = {}
+        self.inventory: Dict[Tuple[str, str, str, str], int] = {}
+        self.pools: Dict[Tuple[str, str], dict] = {}
+        self.kv: Dict[str, str] = {}
+        self.listings: Dict[int, dict] = {}
+        self.next_listing_id = 1
+        self.media: Dict[Tuple[str, str], Tuple[str, int]] = {}
+        self.user_stats: Dict[str, Dict[str, List[int]]] = {}
+        self.trades: List[dict] = []
+        self.trade_daily: Dict[Tuple[str, str, str, str], List[int]] = {}
+        # (group_id, metric) -> [(-value, user_id)] in rank order; built on the first leaderboard
+        # query and kept sorted by every write to that metric afterwards.
+        self.ranks: Dict[Tuple[str, str], List[Tuple[int, str]]] = {}
+        self.dirty = False
+        self.seed_db_path = seed_db_path
+        self.seeded_counts: Optional[Dict[str, int]] = None
+
+    def init(self):
+        if self.snapshot_path is None or not self.snapshot_path.exists():
+            self._seed_from_sqlite()
+            return
+        data = json.loads(self.snapshot_path.read_text(encoding="utf-8"))
+        self.wallets = {(g, u): [int(b), int(r), int(v)] for g, u, b, r, v in data.get("wallets", [])}
+        self.inventory = {(g, u, c, n): int(cnt) for g, u, c, n, cnt in data.get("inventory", [])}
+        self.pools = {}
+        for row in data.get("pools", []):
+            g, c, sig, items, slots, ver = row[:6]
+            if len(row) >= 8:
+                pool = {"items": list(items), "seed": int(row[6]), "cursor": int(row[7])}
+            else:
+                # Snapshots from before the recorded draw order: shuffle what is left once.
+                pool = _new_pool(sig, items, slots, ver)
+            pool.update({"signature": sig, "slots": [int(v) for v in slots], "version": int(ver)})
+            self.pools[(g, c)] = pool
+        self.kv = {str(k): str(v) for k, v in data.get("kv", {}).items()}
+        self.listings = {int(row["id"]): dict(row) for row in data.get("listings", [])}
+        self.next_listing_id = int(data.get("next_listing_id", max(self.listings, default=0) + 1))
+        self.media = {(h, p): (str(m), int(e)) for h, p, m, e in data.get("media", [])}
+        for (g, u, _, _), cnt in self.inventory.items():
+            self._user_stats(g, u)[0] += cnt
+        for g, u, opens in data.get("open_counts", []):
+            self._user_stats(g, u)[1] = int(opens)
+        self.trades = [dict(row) for row in data.get("trades", [])]
+        self.trade_daily = {tuple(row[:4]): [int(v) for v in row[4:]] for row in data.get("trade_daily", [])}
+        self.ranks = {}
+
+    def _seed_from_sqlite(self):
+        # First start on the memory engine of an existing install: carry the SQLite data over
+        # instead of starting with an empty economy, and write the first snapshot right away.
+        if self.seed_db_path is None or not self.seed_db_path.exists():
+            return
+        try:
+            SqliteStorage(self.seed_db_path).init()
+            counts = self.import_records(export_service.iter_db_records(self.seed_db_path))
+            for g, u, opens in db_service.db_get_open_counts(self.seed_db_path):
+                self._user_stats(g, u)[1] = opens
+            gift_date = db_service.db_get_kv(self.seed_db_path, "last_daily_gift_date")
+            if gift_date is not None:
+                self.kv["last_daily_gift_date"] = gift_date
+            self.snapshot()
+        except Exception as exc:
+            raise RuntimeError(
+                f"cannot seed the memory engine from {self.seed_db_path}: {exc}; "
+                "keep storage_engine=sqlite until the database can be read"
+            ) from exc
+        self.seeded_counts = counts
+
+    def snapshot(self) -> bool:
+        if self.snapshot_path is None or not self.dirty:
+            return False
+        self._write_snapshot(self.snapshot_path, self._snapshot_payload())
+        self.dirty = False
+        return True
+
+    def backup(self, backup_dir: Path) -> Tuple[Path, Dict[str, int]]:
+        target = backup_dir / backup_service.backup_file_name(suffix=".json")
+        self._write_snapshot(target, self._snapshot_payload())
+        # Read back before reporting success, like integrity_check does for the SQLite engine.
+        restored = json.loads(target.read_text(encoding="utf-8"))
+        return target, {"wallets": len(restored.get("wallets", [])), "size": target.stat().st_size}
+
+    def export_records(self, group_id: str = "") -> Iterator[dict]:
+        def _wanted(g: str) -> bool:
+            return not group_id or g == group_id
+
+        for (g, u), (balance, registered_at, _) in sorted(self.wallets.items()):
+            if _wanted(g):
+                yield {"type": "wallet", "group_id": g, "user_id": u, "balance": balance, "registered_at": registered_at}
+        for (g, u, c, n), cnt in sorted(self.inventory.items()):
+            if _wanted(g):
+                yield {"type": "inventory", "group_id": g, "user_id": u, "category_id": c, "item_name": n, "count": cnt}
+        for (g, c), pool in sorted(self.pools.items()):
+            if _wanted(g):
+                yield {
+                    "type": "pool", "group_id": g, "category_id": c, "signature": pool["signature"],
+                    "draw_order": list(pool["items"]), "remaining_items": pool["items"][pool["cursor"]:],
+                    "remaining_slots": list(pool["slots"]), "draw_seed": pool["seed"], "draw_cursor": pool["cursor"],
+                }
+        for _, row in sorted(self.listings.items()):
+            if _wanted(row["group_id"]) and row["quantity"] > 0:
+                yield dict({k: v for k, v in row.items() if k != "id"}, type="listing")
+        prefix = f"{maintenance_service.OPEN_TS_KV_PREFIX}{group_id}:" if group_id else ""
+        for k, v in sorted(self.kv.items()):
+            if k.startswith(prefix) and export_service.is_economy_kv(k):
+                yield {"type": "kv", "k": k, "v": v}
+
+    def import_records(self, records: Iterable[dict]) -> Dict[str, int]:
+        counts = {record_type: 0 for record_type in export_service.RECORD_TYPES}
+        replaced_groups = set()
+        for record in records:
+            record_type = record["type"]
+            if record_type == "wallet":
+                key = (str(record["group_id"]), str(record["user_id"]))
+                wallet = self.wallets.setdefault(key, [0, int(record.get("registered_at", time.time())), -1])
+                wallet[0] = int(record["balance"])
+                wallet[2] += 1
+            elif record_type == "inventory":
+                g, u = str(record["group_id"]), str(record["user_id"])
+                key = (g, u, str(record["category_id"]), str(record["item_name"]))
+                count = int(record["count"])
+                self._user_stats(g, u)[0] += count - self.inventory.get(key, 0)
+                self.inventory[key] = count
+            elif record_type == "pool":
+                key = (str(record.get("group_id", "")), str(record["category_id"]))
+                order, seed, cursor = export_service.pool_draw_state(record)
+                self.pools[key] = {
+                    "signature": str(record.get("signature", "")),
+                    "items": order,
+                    "slots": sorted(int(v) for v in record.get("remaining_slots", [])),
+                    "version": self.pools.get(key, {}).get("version", -1) + 1,
+                    "seed": seed,
+                    "cursor": cursor,
+                }
+            elif record_type == "listing":
+                g = str(record["group_id"])
+                if g not in replaced_groups:
+                    for lid in [lid for lid, row in self.listings.items() if row["group_id"] == g]:
+                        del self.listings[lid]
+                    replaced_groups.add(g)
+                self.add_market_listing(
+                    g, str(record["category_id"]), str(record["item_id"]), str(record["item_name"]),
+                    int(record["price"]), int(record["quantity"]), str(record["seller_user_id"]),
+                    int(record["is_system"]), str(record["day_key"]),
+                )
+            elif export_service.is_economy_kv(record["k"]):
+                self.kv[str(record["k"])] = str(record["v"])
+            else:
+                continue
+            counts[record_type] += 1
+        self.ranks.clear()
+        self.dirty = True
+        return counts
+
+    def _snapshot_payload(self) -> dict:
+        return {
+            "saved_at": int(time.time()),
+            "wallets": [[g, u] + list(v) for (g, u), v in self.wallets.items()],
+            "inventory": [[g, u, c, n, cnt] for (g, u, c, n), cnt in self.inventory.items()],
+            "pools": [
+                [g, c, p["signature"], p["items"], p["slots"], p["version"], p["seed"], p["cursor"]]
+                for (g, c), p in self.pools.items()
+            ],
+            "kv": self.kv,
+            "listings": list(self.listings.values()),
+            "next_listing_id": self.next_listing_id,
+            "media": [[h, p, m, e] for (h, p), (m, e) in self.media.items()],
+            "trades": self.trades,
+            "trade_daily": [list(key) + acc for key, acc in self.trade_daily.items()],
+            "open_counts": [
+                [g, u, v[1]] for g, users in self.user_stats.items() for u, v in users.items() if v[1]
+            ],
+        }
+
+    def _write_snapshot(self, path: Path, data: dict):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, path)
+
+    def run_maintenance(
+        self, today: str, multiplier_keep_from: str, open_ts_before: float, batch_size: int = 500, convert: bool = False
+    ) -> Dict[str, int]:
+        stale_multiplier = f"{maintenance_service.MULTIPLIER_KV_PREFIX}{multiplier_keep_from}"
+        report = {"kv_multiplier": 0, "kv_open_ts": 0}
+        for key in list(self.kv):
+            if key.startswith(maintenance_service.MULTIPLIER_KV_PREFIX) and key < stale_multiplier:
+                report["kv_multiplier"] += 1
+            elif key.startswith(maintenance_service.OPEN_TS_KV_PREFIX) and _float_or_zero(self.kv[key]) < open_ts_before:
+                report["kv_open_ts"] += 1
+            else:
+                continue
+            del self.kv[key]
+        expired = [
+            lid for lid, row in self.listings.items()
+            if (row["is_system"] == 1 and row["day_key"] != today) or row["quantity"] <= 0
+        ]
+        for lid in expired:
+            del self.listings[lid]
+        report["listings"] = len(expired)
+        now = int(time.time())
+        stale_media = [key for key, (_, expires_at) in self.media.items() if expires_at <= now]
+        for key in stale_media:
+            del self.media[key]
+        report["media"] = len(stale_media)
+        if any(report.values()):
+            self.dirty = True
+        return report
+
+    def get_user(self, group_id: str, user_id: str):
+        wallet = self.wallets.get((group_id, user_id))
+        return (group_id, user_id, wallet[0], wallet[1]) if wallet else None
+
+    def get_balance(self, group_id: str, user_id: str) -> Optional[int]:
+        wallet = self.wallets.get((group_id, user_id))
+        return int(wallet[0]) if wallet else None
+
+    def register_user(self, group_id: str, user_id: str, balance: int):
+        if (group_id, user_id) not in self.wallets:
+            self.wallets[(group_id, user_id)] = [int(balance), int(time.time()), 0]
+            self._rank_move(group_id, "balance", user_id, 0, int(balance))
+            self.dirty = True
+
+    def update_balance(self, group_id: str, user_id: str, balance: int):
+        wallet = self.wallets.get((group_id, user_id))
+        if wallet:
+            self._set_balance(group_id, user_id, wallet, int(balance))
+            self.dirty = True
+
+    def adjust_balance(self, group_id: str, user_id: str, delta: int, min_balance: int = 0) -> Optional[int]:
+        wallet = self.wallets.get((group_id, user_id))
+        if not wallet or wallet[0] + int(delta) < int(min_balance):
+            return None
+        self._set_balance(group_id, user_id, wallet, wallet[0] + int(delta))
+        self.dirty = True
+        return wallet[0]
+
+    def grant_daily_gift(self, amount: int) -> int:
+        for wallet in self.wallets.values():
+            wallet[0] += int(amount)
+            wallet[2] += 1
+        # Every wallet moved; rebuild the balance ranks lazily rather than re-sorting them here.
+        self.ranks.clear()
+        self.dirty = True
+        return len(self.wallets)
+
+    def grant_daily_gift_once(self, amount: int, date_key: str) -> Optional[int]:
+        if self.kv.get("last_daily_gift_date") == date_key:
+            return None
+        affected = self.grant_daily_gift(amount)
+        self.kv["last_daily_gift_date"] = date_key
+        return affected
+
+    def add_inventory_item(self, group_id: str, user_id: str, category_id: str, item_name: str, count: int = 1):
+        key = (group_id, user_id, category_id, item_name)
+        self.inventory[key] = self.inventory.get(key, 0) + int(count)
+        self._add_stat(group_id, user_id, 0, int(count))
+        self.dirty = True
+
+    def get_user_inventory(self, group_id: str, user_id: str) -> List[Tuple[str, str, int]]:
+        rows = [(c, n, cnt) for (g, u, c, n), cnt in self.inventory.items() if g == group_id and u == user_id]
+        return sorted(rows)
+
+    def get_user_inventory_by_category(self, group_id: str, user_id: str, category_id: str) -> List[Tuple[str, int]]:
+        return [(n, cnt) for c, n, cnt in self.get_user_inventory(group_id, user_id) if c == category_id]
+
+    def consume_inventory_item(self, group_id: str, user_id: str, category_id: str, item_name: str, count: int = 1) -> bool:
+        need = max(1, int(count))
+        key = (group_id, user_id, category_id, item_name)
+        have = self.inventory.get(key, 0)
+        if have < need:
+            return False
+        if have - need > 0:
+            self.inventory[key] = have - need
+        else:
+            self.inventory.pop(key, None)
+        self._add_stat(group_id, user_id, 0, -need)
+        self.dirty = True
+        return True
+
+    def ensure_category_states(self, categories: Dict[str, resource_service.Category], group_id: str = ""):
+        for category_id, category in categories.items():
+            pool = self.pools.get((group_id, category_id))
+            if pool and pool["signature"] == category.signature:
+                continue
+            if pool and pool["signature"] == category.legacy_signature():
+                pool["signature"] = category.signature
+                self.dirty = True
+                continue
+            self.pools[(group_id, category_id)] = _new_pool(
+                category.signature,
+                category.item_ids,
+                list(category.slots),
+                (pool["version"] + 1) if pool else 0,
+            )
+            self.dirty = True
+
+    def get_category_state(self, category_id: str, group_id: str = "") -> Tuple[List[str], List[int]]:
+        pool = self.pools.get((group_id, category_id))
+        if not pool:
+            return [], []
+        return pool["items"][pool["cursor"]:], sorted(pool["slots"])
+
+    def get_category_states(self, category_ids: List[str], group_id: str = "") -> Dict[str, Tuple[List[str], List[int]]]:
+        result = {}
+        for cid in category_ids:
+            pool = self.pools.get((group_id, cid))
+            if pool:
+                result[cid] = (pool["items"][pool["cursor"]:], sorted(pool["slots"]))
+        return result
+
+    def get_draw_window(self, category_id: str, count: int, group_id: str = "") -> Tuple[List[str], int, List[int], Optional[int]]:
+        pool = self.pools.get((group_id, category_id))
+        if not pool:
+            return [], 0, [], None
+        cursor = pool["cursor"]
+        return (
+            pool["items"][cursor:cursor + int(count)],
+            len(pool["items"]) - cursor,
+            sorted(pool["slots"]),
+            int(pool["version"]),
+        )
+
+    def get_pool_draw_info(self, category_id: str, group_id: str = "") -> Optional[Tuple[int, int, int]]:
+        pool = self.pools.get((group_id, category_id))
+        return (pool["seed"], pool["cursor"], len(pool["items"])) if pool else None
+
+    def set_category_state(self, category_id: str, signature: str, items: List[str], slots: List[int], group_id: str = ""):
+        pool = self.pools.get((group_id, category_id))
+        if pool:
+            self.pools[(group_id, category_id)] = _new_pool(signature, items, slots, pool["version"] + 1)
+            self.dirty = True
+
+    def commit_draw(
+        self,
+        *,
+        group_id: str,
+        user_id: str,
+        pool_group_id: str,
+        category_id: str,
+        expected_version: int,
+        draw_count: int,
+        remaining_slots: List[int],
+        price: int,
+        item_names: List[str],
+    ) -> Tuple[str, Optional[int]]:
+        pool = self.pools.get((pool_group_id, category_id))
+        if not pool or pool["version"] != int(expected_version):
+            return "conflict", None
+        wallet = self.wallets.get((group_id, user_id))
+        if not wallet or wallet[0] < int(price):
+            return "insufficient", None
+        pool.update({"cursor": pool["cursor"] + int(draw_count), "slots": list(remaining_slots), "version": pool["version"] + 1})
+        self._set_balance(group_id, user_id, wallet, wallet[0] - int(price))
+        for item_name in item_names:
+            self.add_inventory_item(group_id, user_id, category_id, item_name, 1)
+        self._add_stat(group_id, user_id, 1, len(item_names))
+        return "ok", wallet[0]
+
+    def _user_stats(self, group_id: str, user_id: str) -> List[int]:
+        return self.user_stats.setdefault(group_id, {}).setdefault(user_id, [0, 0])
+
+    def _set_balance(self, group_id: str, user_id: str, wallet: List[int], balance: int):
+        old = wallet[0]
+        wallet[0] = balance
+        wallet[2] += 1
+        self._rank_move(group_id, "balance", user_id, old, balance)
+
+    def _add_stat(self, group_id: str, user_id: str, column: int, delta: int):
+        stats = self._user_stats(group_id, user_id)
+        old = stats[column]
+        stats[column] += delta
+        self._rank_move(group_id, STATS_METRICS[column], user_id, old, stats[column])
+
+    def _rank_move(self, group_id: str, metric: str, user_id: str, old: int, new: int):
+        ranks = self.ranks.get((group_id, metric))
+        if ranks is None or old == new:
+            return
+        if old > 0:
+            i = bisect.bisect_left(ranks, (-old, user_id))
+            if i < len(ranks) and ranks[i] == (-old, user_id):
+                del ranks[i]
+        if new > 0:
+            bisect.insort(ranks, (-new, user_id))
+
+    def _build_ranks(self, group_id: str, metric: str) -> List[Tuple[int, str]]:
+        if metric == "balance":
+            values = ((u, v[0]) for (g, u), v in self.wallets.items() if g == group_id)
+        else:
+            column = STATS_METRICS.index(metric)
+            values = ((u, v[column]) for u, v in self.user_stats.get(group_id, {}).items())
+        ranks = sorted((-v, u) for u, v in values if v > 0)
+        self.ranks[(group_id, metric)] = ranks
+        return ranks
+
+    def get_leaderboard(self, group_id: str, metric: str, limit: int = 10) -> List[Tuple[str, int]]:
+        ranks = self.ranks.get((group_id, metric))
+        if ranks is None:
+            ranks = self._build_ranks(group_id, metric)
+        return [(u, -v) for v, u in ranks[:max(1, int(limit))]]
+
+    def get_user_stats(self, group_id: str, user_id: str) -> Tuple[int, int]:
+        stats = self.user_stats.get(group_id, {}).get(user_id)
+        return (stats[0], stats[1]) if stats else (0, 0)
+
+    def get_kv(self, key: str) -> Optional[str]:
+        return self.kv.get(key)
+
+    def set_kv(self, key: str, value: str):
+        self.kv[key] = str(value)
+        self.dirty = True
+
+    def get_kv_by_prefix(self, prefix: str) -> Dict[str, str]:
+        return {k: v for k, v in self.kv.items() if k.startswith(prefix)}
+
+    def set_kv_many(self, values: Dict[str, str]):
+        if values:
+            self.kv.update({k: str(v) for k, v in values.items()})
+            self.dirty = True
+
+    def add_market_listing(
+        self,
+        group_id: str,
+        category_id: str,
+        item_id: str,
+        item_name: str,
+        price: int,
+        quantity: int,
+        seller_user_id: str,
+        is_system: int,
+        day_key: str,
+    ):
+        listing_id = self.next_listing_id
+        self.next_listing_id += 1
+        self.listings[listing_id] = {
+            "id": listing_id,
+            "group_id": group_id,
+            "category_id": category_id,
+            "item_id": item_id,
+            "item_name": item_name,
+            "price": int(price),
+            "quantity": int(quantity),
+            "seller_user_id": seller_user_id,
+            "is_system": int(is_system),
+            "day_key": day_key,
+        }
+        self.dirty = True
+
+    def list_market_listings(self, group_id: str, category_id: str = "") -> List[dict]:
+        rows = [
+            dict(row)
+            for row in self.listings.values()
+            if row["group_id"] == group_id and row["quantity"] > 0 and (not category_id or row["category_id"] == category_id)
+        ]
+        rows.sort(key=lambda r: (r["category_id"] if not category_id else "", -r["is_system"], r["price"], r["id"]))
+        return rows
+
+    def consume_market_listing(self, listing_id: int, quantity: int) -> bool:
+        need = max(1, int(quantity))
+        row = self.listings.get(int(listing_id))
+        if not row or row["quantity"] < need:
+            return False
+        row["quantity"] -= need
+        if row["quantity"] <= 0:
+            self.listings.pop(int(listing_id), None)
+        self.dirty = True
+        return True
+
+    def purchase_listing(
+        self, listing_id: int, group_id: str, buyer_user_id: str, quantity: int, day_key: str = ""
+    ) -> Tuple[str, Optional[int], int]:
+        need = max(1, int(quantity))
+        row = self.listings.get(int(listing_id))
+        if not row or row["quantity"] < need:
+            return "sold_out", None, 0
+        total_price = row["price"] * need
+        new_balance = self.adjust_balance(group_id, buyer_user_id, -total_price)
+        if new_balance is None:
+            return "insufficient", None, total_price
+        self.consume_market_listing(listing_id, need)
+        self.add_inventory_item(group_id, buyer_user_id, row["category_id"], row["item_name"], need)
+        self.trades.append(
+            {
+                "group_id": group_id,
+                "category_id": row["category_id"],
+                "item_id": row["item_id"],
+                "price": row["price"],
+                "quantity": need,
+                "buyer_user_id": buyer_user_id,
+                "seller_user_id": row["seller_user_id"],
+                "is_system": row["is_system"],
+                "day_key": day_key,
+                "traded_at": int(time.time()),
+                "rolled": False,
+            }
+        )
+        return "ok", new_balance, total_price
+
+    def rollup_market_trades(self, retention_days: int) -> Tuple[int, int]:
+        rolled = 0
+        for trade in self.trades:
+            if trade["rolled"]:
+                continue
+            db_service.merge_trade_into_daily(
+                self.trade_daily,
+                (trade["group_id"], trade["category_id"], trade["item_id"], trade["day_key"], trade["price"], trade["quantity"]),
+            )
+            trade["rolled"] = True
+            rolled += 1
+        cutoff = int(time.time()) - max(0, int(retention_days)) * 86400
+        kept = [trade for trade in self.trades if not trade["rolled"] or trade["traded_at"] >= cutoff]
+        pruned = len(self.trades) - len(kept)
+        self.trades = kept
+        if rolled or pruned:
+            self.dirty = True
+        return rolled, pruned
+
+    def get_market_trade_daily(self, group_id: str, category_id: str, item_id: str, since_day: str) -> List[Tuple]:
+        rows = [
+            (key[3],) + tuple(acc)
+            for key, acc in self.trade_daily.items()
+            if key[:3] == (group_id, category_id, item_id) and key[3] >= since_day
+        ]
+        return sorted(rows)
+
+    def delete_expired_system_listings(self, group_id: str, day_key: str):
+        expired = [
+            lid for lid, row in self.listings.items()
+            if row["group_id"] == group_id and row["is_system"] == 1 and row["day_key"] != day_key
+        ]
+        for lid in expired:
+            self.listings.pop(lid, None)
+        if expired:
+            self.dirty = True
+
+    def get_listing_stats(self, group_id: str, category_id: str = "") -> ListingStats:
+        stats: Dict[Tuple[str, str], List[int]] = {}
+        for row in self.listings.values():
+            if row["group_id"] != group_id or row["is_system"] or row["quantity"] <= 0:
+                continue
+            if category_id and row["category_id"] != category_id:
+                continue
+            price, qty = row["price"], row["quantity"]
+            acc = stats.setdefault((row["category_id"], row["item_id"]), [0, 0, 0, 0, price])
+            acc[0] += price
+            acc[1] += 1
+            acc[2] += qty
+            acc[3] += price * qty
+            acc[4] = min(acc[4], price)
+        return {key: tuple(value) for key, value in stats.items()}
+
+    def get_media_id(self, content_hash: str, platform: str) -> Optional[str]:
+        entry = self.media.get((content_hash, platform))
+        if not entry or entry[1] <= int(time.time()):
+            return None
+        return entry[0]
+
+    def set_media_id(self, content_hash: str, platform: str, media_id: str, ttl_seconds: int):
+        self.media[(content_hash, platform)] = (str(media_id), int(time.time()) + max(1, int(ttl_seconds)))
+        self.dirty = True
+
+    def delete_media_id(self, content_hash: str, platform: str):
+        if self.media.pop((content_hash, platform), None) is not None:
+            self.dirty = True
+
+
+def _new_pool(signature: str, items: List[str], slots: List[int], version: int) -> dict:
+    seed = db_service.new_draw_seed()
+    return {
+        "signature": signature,
+        "items": db_service.build_draw_order(list(items), seed),
+        "slots": [int(v) for v in slots],
+        "version": int(version),
+        "seed": seed,
+        "cursor": 0,
+    }
+
+
+def _float_or_zero(value: str) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def normalize_storage_engine(value: object) -> str:
+    engine = str(value or "").strip().lower()
+    return "memory" if engine in {"memory", "mem", "内存"} else "sqlite"
+
+
+def create_storage(engine: str, db_path: Path, snapshot_path: Path) -> StorageBackend:
+    if normalize_storage_engine(engine) == "memory":
+        return MemoryStorage(snapshot_path, seed_db_path=db_path)
+    return SqliteStorage(db_path)
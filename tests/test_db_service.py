@@ -0,0 +1,39 @@
+import sqlite3
+
+from db_service import db_ensure_category_states, db_get_category_state, db_get_draw_window, init_db
+
+
+class StubCategory:
+    signature = "sig"
+    item_ids = [f"{n}-item.png" for n in range(1, 11)]
+    slots = list(range(1, 11))
+
+    def legacy_signature(self):
+        return ""
+
+
+def _pool(tmp_path):
+    db_path = tmp_path / "blindbox.db"
+    init_db(db_path)
+    db_ensure_category_states(db_path, {"7.0": StubCategory()}, "g1")
+    return db_path
+
+
+def test_draw_window_returns_next_items_at_cursor(tmp_path):
+    db_path = _pool(tmp_path)
+    order, _ = db_get_category_state(db_path, "7.0", "g1")
+    window, remaining, slots, version = db_get_draw_window(db_path, "7.0", 3, "g1")
+    assert window == order[:3]
+    assert (remaining, slots, version) == (10, list(range(1, 11)), 0)
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE group_category_state SET draw_cursor=8")
+    conn.commit()
+    conn.close()
+    window, remaining, _, _ = db_get_draw_window(db_path, "7.0", 3, "g1")
+    assert (window, remaining) == (order[8:], 2)
+
+
+def test_draw_window_of_missing_pool(tmp_path):
+    db_path = _pool(tmp_path)
+    assert db_get_draw_window(db_path, "7.0", 1, "other") == ([], 0, [], None)
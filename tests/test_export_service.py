@@ -0,0 +1,61 @@
+import sqlite3
+
+from db_service import db_register_user, db_set_kv, init_db
+from export_service import db_import_records, iter_db_records
+from inventory_service import init_inventory_table
+
+
+def _db(tmp_path, name):
+    db_path = tmp_path / name
+    init_db(db_path)
+    init_inventory_table(db_path)
+    return db_path
+
+
+def _kv(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return dict(conn.execute("SELECT k,v FROM system_kv").fetchall())
+    finally:
+        conn.close()
+
+
+def test_full_export_only_carries_economy_kv(tmp_path):
+    source = _db(tmp_path, "source.db")
+    db_set_kv(source, "market_multiplier:2026-10-19:7.0:a", "1.1")
+    db_set_kv(source, "last_open_ts:g1:1001", "1792380000")
+    for key in ("market_trade_rollup_id", "last_daily_gift_date", "last_maintenance_ts", "last_backup_ts"):
+        db_set_kv(source, key, "42")
+
+    exported = [r["k"] for r in iter_db_records(source) if r["type"] == "kv"]
+    assert exported == ["last_open_ts:g1:1001", "market_multiplier:2026-10-19:7.0:a"]
+
+
+def test_import_skips_bookkeeping_kv(tmp_path):
+    target = _db(tmp_path, "target.db")
+    db_set_kv(target, "market_trade_rollup_id", "7")
+    records = [
+        {"type": "kv", "k": "market_trade_rollup_id", "v": "9000"},
+        {"type": "kv", "k": "last_maintenance_ts", "v": "1"},
+        {"type": "kv", "k": "last_open_ts:g1:1001", "v": "1792380000"},
+    ]
+    counts = db_import_records(target, records)
+    kv = _kv(target)
+    assert counts["kv"] == 1
+    assert kv["market_trade_rollup_id"] == "7"
+    assert "last_maintenance_ts" not in kv
+    assert kv["last_open_ts:g1:1001"] == "1792380000"
+
+
+def test_export_reads_one_snapshot(tmp_path):
+    source = _db(tmp_path, "source.db")
+    db_register_user(source, "g1", "1001", 200)
+    records = iter_db_records(source)
+    first = next(records)
+    assert first["type"] == "wallet"
+    # A wallet written after the export started must not show up in it.
+    db_register_user(source, "g2", "2002", 200)
+    db_set_kv(source, "last_open_ts:g2:2002", "1792380000")
+    rest = list(records)
+    assert [r for r in rest if r["type"] == "wallet"] == []
+    assert [r for r in rest if r["type"] == "kv"] == []
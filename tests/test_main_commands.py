@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("astrbot.api.star")
+
+import main
+
+
+class StubContext:
+    def __init__(self, data_dir, config):
+        self.data_dir = data_dir
+        self.config = config
+
+    def get_data_dir(self):
+        return str(self.data_dir)
+
+    def get_config(self):
+        return self.config
+
+
+class StubEvent:
+    def __init__(self, message, user_id="1001", group_id="g1"):
+        self.message_str = message
+        self.user_id = user_id
+        self.group_id = group_id
+
+    def plain_result(self, text):
+        return ("text", text)
+
+    def image_result(self, path):
+        return ("image", path)
+
+    def chain_result(self, chain):
+        return ("chain", chain)
+
+
+async def _send(plugin, message):
+    return [r async for r in plugin.arknights_blindbox(StubEvent(message))]
+
+
+def _texts(results):
+    return "\n".join(str(v) for kind, v in results if kind == "text")
+
+
+def test_english_select_alias_resolves_the_group(tmp_path):
+    async def scenario():
+        config = {"rate_limit_user_per_minute": 0, "rate_limit_group_per_minute": 0}
+        plugin = main.ArknightsBlindBoxPlugin(StubContext(tmp_path, config))
+        await plugin.initialize()
+        try:
+            await _send(plugin, "/方舟盲盒 注册")
+            category_id = next(iter(plugin.categories), "")
+            unknown = _texts(await _send(plugin, "/方舟盲盒 select no-such-box"))
+            selected = _texts(await _send(plugin, f"/方舟盲盒 select {category_id}"))
+        finally:
+            await plugin.terminate()
+        return category_id, unknown, selected
+
+    category_id, unknown, selected = asyncio.run(scenario())
+    assert "不存在种类" in unknown
+    if category_id:
+        assert f"你已选择【{category_id}】" in selected
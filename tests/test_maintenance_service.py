@@ -0,0 +1,48 @@
+import sqlite3
+
+from db_service import init_db
+from inventory_service import init_inventory_table
+from maintenance_service import db_run_maintenance
+from media_cache_service import init_media_cache_table
+
+
+def _legacy_db(tmp_path):
+    db_path = tmp_path / "blindbox.db"
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA auto_vacuum=NONE")
+    conn.execute("CREATE TABLE legacy_marker (v INTEGER)")
+    conn.commit()
+    conn.close()
+    init_db(db_path)
+    init_inventory_table(db_path)
+    init_media_cache_table(db_path)
+    return db_path
+
+
+def _run(db_path, **kwargs):
+    return db_run_maintenance(
+        db_path, today="2026-10-19", multiplier_keep_from="2026-10-18", open_ts_before=0, **kwargs
+    )
+
+
+def _auto_vacuum(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_scheduled_run_never_vacuums_a_legacy_database(tmp_path):
+    db_path = _legacy_db(tmp_path)
+    report = _run(db_path)
+    assert (report["converted"], report["needs_conversion"]) == (0, 1)
+    assert _auto_vacuum(db_path) == 0
+
+
+def test_explicit_conversion_switches_to_incremental(tmp_path):
+    db_path = _legacy_db(tmp_path)
+    report = _run(db_path, convert=True)
+    assert (report["converted"], report["needs_conversion"]) == (1, 0)
+    assert _auto_vacuum(db_path) == 2
+    assert _run(db_path)["needs_conversion"] == 0
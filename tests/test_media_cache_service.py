@@ -0,0 +1,91 @@
+import asyncio
+import sqlite3
+
+from media_cache_service import (
+    delete_media_id,
+    get_media_id,
+    init_media_cache_table,
+    MediaReferenceCache,
+    set_media_id,
+)
+
+
+class StubUploader:
+    """Stub adapter: hands out sequential media ids and wraps references in tuples."""
+
+    platform = "stub"
+
+    def __init__(self, fail_upload=False, rejected=()):
+        self.fail_upload = fail_upload
+        self.rejected = set(rejected)
+        self.uploads = []
+
+    async def upload(self, image):
+        if self.fail_upload:
+            raise RuntimeError("upload failed")
+        self.uploads.append(image)
+        return f"mid-{len(self.uploads)}"
+
+    def reference(self, media_id):
+        if media_id in self.rejected:
+            raise ValueError("unknown media id")
+        return ("ref", media_id)
+
+
+def _cache(db_path, warnings=None):
+    init_media_cache_table(db_path)
+    return MediaReferenceCache(
+        lambda h, p: get_media_id(db_path, h, p),
+        lambda h, p, m, ttl: set_media_id(db_path, h, p, m, ttl),
+        lambda h, p: delete_media_id(db_path, h, p),
+        (warnings if warnings is not None else []).append,
+    )
+
+
+def test_uploads_once_then_reuses_media_id(tmp_path):
+    cache = _cache(tmp_path / "m.db")
+    uploader = StubUploader()
+    image = tmp_path / "selection.png"
+
+    first = asyncio.run(cache.resolve(uploader, image, "hash-a", 3600))
+    second = asyncio.run(cache.resolve(uploader, image, "hash-a", 3600))
+
+    assert first == second == ("ref", "mid-1")
+    assert uploader.uploads == [image]
+    assert (cache.uploaded, cache.reused) == (1, 1)
+
+
+def test_expired_id_is_uploaded_again(tmp_path):
+    db_path = tmp_path / "m.db"
+    cache = _cache(db_path)
+    uploader = StubUploader()
+    asyncio.run(cache.resolve(uploader, tmp_path / "a.png", "hash-a", 3600))
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE media_cache SET expires_at=0")
+    conn.commit()
+    conn.close()
+
+    assert asyncio.run(cache.resolve(uploader, tmp_path / "a.png", "hash-a", 3600)) == ("ref", "mid-2")
+    assert get_media_id(db_path, "hash-a", "stub") == "mid-2"
+
+
+def test_rejected_reference_is_forgotten_and_reuploaded(tmp_path):
+    db_path = tmp_path / "m.db"
+    warnings = []
+    cache = _cache(db_path, warnings)
+    set_media_id(db_path, "hash-a", "stub", "stale", 3600)
+    uploader = StubUploader(rejected={"stale"})
+
+    assert asyncio.run(cache.resolve(uploader, tmp_path / "a.png", "hash-a", 3600)) == ("ref", "mid-1")
+    assert get_media_id(db_path, "hash-a", "stub") == "mid-1"
+    assert len(warnings) == 1
+
+
+def test_failures_fall_back_to_none(tmp_path):
+    db_path = tmp_path / "m.db"
+    cache = _cache(db_path)
+
+    assert asyncio.run(cache.resolve(StubUploader(fail_upload=True), tmp_path / "a.png", "hash-a", 3600)) is None
+    # A fresh id the adapter cannot reference is not cached.
+    assert asyncio.run(cache.resolve(StubUploader(rejected={"mid-1"}), tmp_path / "a.png", "hash-a", 3600)) is None
+    assert get_media_id(db_path, "hash-a", "stub") is None
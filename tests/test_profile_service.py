@@ -0,0 +1,20 @@
+from profile_service import CommandProfiler
+
+
+def test_concurrent_commands_are_skipped_and_reported(tmp_path):
+    profiler = CommandProfiler(tmp_path, 2, trace_memory=True)
+    snapshot = profiler.begin()
+    assert profiler.busy
+    profiler.note_concurrent()
+    assert not profiler.end("开", snapshot)
+    assert not profiler.busy and profiler.memory_growth == {}
+
+    snapshot = profiler.begin()
+    assert profiler.end("开", snapshot)
+    assert len(profiler.memory_growth["开"]) == 1
+
+    _, summary_path = profiler.finish()
+    summary = summary_path.read_text(encoding="utf-8")
+    assert "skipped (concurrent): 1" in summary
+    assert "overlapped by a concurrent command: 1" in summary
+    assert "asyncio.to_thread" in summary
@@ -0,0 +1,35 @@
+from resource_index_service import build_name_index, search_name_index
+
+
+INDEX_DATA = {
+    "7.0": {
+        "boxes": [
+            {"item_id": "1_新约能天使精二.png", "name": "新约能天使精二", "slot_no": 1},
+            {"item_id": "2_银灰精二.png", "name": "银灰精二", "slot_no": 2},
+            {"item_id": "3_能.png", "name": "能", "slot_no": 3},
+        ]
+    },
+    "special": {
+        "boxes": [{"item_id": "1_能天使.png", "name": "能天使", "slot_no": 1}],
+    },
+}
+
+
+def test_single_character_matches_names_containing_it():
+    idx = build_name_index(INDEX_DATA)
+    names = [hit[2] for hit in search_name_index(idx, "能")]
+    assert names[0] == "能"
+    assert set(names) == {"能", "能天使", "新约能天使精二"}
+
+
+def test_single_character_respects_category_filter():
+    idx = build_name_index(INDEX_DATA)
+    hits = search_name_index(idx, "灰", category_id="7.0")
+    assert [(hit[0], hit[2]) for hit in hits] == [("7.0", "银灰精二")]
+    assert search_name_index(idx, "灰", category_id="special") == []
+
+
+def test_multi_character_search_still_uses_bigrams():
+    idx = build_name_index(INDEX_DATA)
+    hits = search_name_index(idx, "能天使")
+    assert [hit[2] for hit in hits][:2] == ["能天使", "新约能天使精二"]
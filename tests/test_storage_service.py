@@ -0,0 +1,85 @@
+import json
+
+import pytest
+
+from db_service import db_register_user, db_set_kv, init_db
+from inventory_service import init_inventory_table
+from storage_service import MemoryStorage, create_storage
+
+
+def _sqlite_install(tmp_path):
+    db_path = tmp_path / "blindbox.db"
+    init_db(db_path)
+    init_inventory_table(db_path)
+    db_register_user(db_path, "g1", "1001", 321)
+    db_set_kv(db_path, "last_daily_gift_date", "2026-10-19")
+    db_set_kv(db_path, "market_trade_rollup_id", "42")
+    return db_path
+
+
+def test_memory_engine_seeds_from_existing_database(tmp_path):
+    db_path = _sqlite_install(tmp_path)
+    snapshot_path = tmp_path / "memory_snapshot.json"
+    storage = create_storage("memory", db_path, snapshot_path)
+    storage.init()
+
+    assert storage.seeded_counts["wallet"] == 1
+    assert storage.get_balance("g1", "1001") == 321
+    assert storage.grant_daily_gift_once(10, "2026-10-19") is None
+    assert "market_trade_rollup_id" not in storage.kv
+    assert json.loads(snapshot_path.read_text(encoding="utf-8"))["wallets"][0][:3] == ["g1", "1001", 321]
+
+    # The snapshot now exists, so the next start loads it instead of seeding again.
+    restarted = create_storage("memory", db_path, snapshot_path)
+    restarted.init()
+    assert restarted.seeded_counts is None
+    assert restarted.get_balance("g1", "1001") == 321
+
+
+def test_fresh_memory_install_starts_empty(tmp_path):
+    storage = create_storage("memory", tmp_path / "blindbox.db", tmp_path / "memory_snapshot.json")
+    storage.init()
+    assert storage.seeded_counts is None
+    assert storage.wallets == {}
+
+
+def test_unreadable_database_refuses_to_start_empty(tmp_path):
+    db_path = tmp_path / "blindbox.db"
+    db_path.write_bytes(b"not a sqlite database" * 64)
+    storage = MemoryStorage(tmp_path / "memory_snapshot.json", seed_db_path=db_path)
+    with pytest.raises(RuntimeError, match="cannot seed the memory engine"):
+        storage.init()
+
+
+def _brute_leaderboard(storage, group_id, metric):
+    if metric == "balance":
+        values = [(u, v[0]) for (g, u), v in storage.wallets.items() if g == group_id]
+    else:
+        column = 0 if metric == "collection" else 1
+        values = [(u, v[column]) for u, v in storage.user_stats.get(group_id, {}).items()]
+    return sorted(((u, v) for u, v in values if v > 0), key=lambda x: (-x[1], x[0]))
+
+
+def test_memory_leaderboard_stays_sorted_across_writes():
+    storage = MemoryStorage()
+    for n in range(6):
+        storage.register_user("g1", f"u{n}", 100 + n)
+    metrics = ("balance", "collection", "opens")
+    for metric in metrics:
+        storage.get_leaderboard("g1", metric)  # build the ranks before the writes below
+
+    storage.adjust_balance("g1", "u0", 50)
+    storage.update_balance("g1", "u5", 0)
+    storage.add_inventory_item("g1", "u2", "7.0", "a", 3)
+    storage.add_inventory_item("g1", "u3", "7.0", "b", 3)
+    storage.consume_inventory_item("g1", "u2", "7.0", "a", 1)
+    storage.pools[("g1", "7.0")] = {"version": 0, "cursor": 0, "items": ["x", "y"], "slots": [1, 2]}
+    storage.commit_draw(
+        group_id="g1", user_id="u4", pool_group_id="g1", category_id="7.0", expected_version=0,
+        draw_count=2, remaining_slots=[], price=30, item_names=["x", "y"],
+    )
+    for metric in metrics:
+        assert storage.get_leaderboard("g1", metric, 10) == _brute_leaderboard(storage, "g1", metric)
+
+    storage.grant_daily_gift(5)
+    assert storage.get_leaderboard("g1", "balance", 2) == _brute_leaderboard(storage, "g1", "balance")[:2]
@@ -8,3 +8,8 @@ def utc8_date_hour() -> Tuple[str, int]:
     ts = time.time() + 8 * 3600
     t = time.gmtime(ts)
     return time.strftime("%Y-%m-%d", t), t.tm_hour
+
+
+def utc8_date_days_ago(days: int) -> str:
+    t = time.gmtime(time.time() + 8 * 3600 - int(days) * 86400)
+    return time.strftime("%Y-%m-%d", t)